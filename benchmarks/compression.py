@@ -0,0 +1,115 @@
+"""
+S3 transfer bytes and time of plain, gzip and zstd transaction files.
+
+The same seeded synthetic file is compressed with each codec (zstd only when
+the zstandard package is installed). For every variant the script reports
+the object size, the time to decompress and split it into lines the way
+stream_s3_file does, and the transfer time at --bandwidth MiB/s. With
+--bucket the variants are also uploaded to that bucket and read back through
+stream_s3_file, so the transfer time is measured instead of estimated (the
+objects are deleted afterwards). Run it from the project root:
+
+    python benchmarks/compression.py --rows 500000 --accounts 5000 --output compression.json
+    python benchmarks/compression.py --rows 500000 --bucket my-test-bucket
+"""
+import argparse
+import gzip
+import io
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from synthetic import generate_csv
+from util import decompressing_stream, iter_lines, stream_s3_file
+
+# Lambda usually gets 50 to 100 MiB/s out of a single S3 GET
+DEFAULT_BANDWIDTH_MIB = 80
+
+
+def compressed_variants(data):
+  """Returns (name, extension, compression, body) of every variant of `data`."""
+  variants = [('plain', '.csv', None, data), ('gzip', '.csv.gz', 'gzip', gzip.compress(data, compresslevel=6))]
+  try:
+    import zstandard
+  except ImportError:
+    print('zstandard is not installed, skipping zstd')
+  else:
+    variants.append(('zstd', '.csv.zst', 'zstd', zstandard.ZstdCompressor(level=3).compress(data)))
+  return variants
+
+def best_time(function, repeat):
+  best = float('inf')
+  for _ in range(repeat):
+    start = time.perf_counter()
+    function()
+    best = min(best, time.perf_counter() - start)
+  return best
+
+def count_lines(stream):
+  return sum(1 for _ in iter_lines(stream))
+
+def measure_s3(bucket, key, body, repeat):
+  """Uploads `body` and returns the best time to stream it back as lines."""
+  from aws_clients import get_client
+  s3 = get_client('s3')
+  s3.put_object(Bucket=bucket, Key=key, Body=body)
+  try:
+    return best_time(lambda: sum(1 for _ in stream_s3_file(bucket, key)), repeat)
+  finally:
+    s3.delete_object(Bucket=bucket, Key=key)
+
+def run(rows, accounts, seed, repeat, bandwidth_mib, bucket):
+  data = generate_csv(rows, accounts, seed).encode('utf-8')
+  results = {}
+  for name, extension, compression, body in compressed_variants(data):
+    decode_seconds = best_time(lambda: count_lines(decompressing_stream(io.BytesIO(body), compression)), repeat)
+    transfer_seconds = len(body) / (bandwidth_mib * 2 ** 20)
+    result = {
+      'bytes': len(body),
+      'ratio': len(data) / len(body),
+      'decode_seconds': decode_seconds,
+      'transfer_seconds': transfer_seconds,
+      'estimated_seconds': transfer_seconds + decode_seconds
+    }
+    if bucket:
+      result['s3_seconds'] = measure_s3(bucket, f'benchmarks/compression-{seed}{extension}', body, repeat)
+    results[name] = result
+    print_result(name, result)
+  return results
+
+def print_result(name, result):
+  line = (f"{name:6} {result['bytes'] / 2 ** 20:9.2f} MiB {result['ratio']:6.2f}x "
+          f"decode {result['decode_seconds']:8.4f}s transfer {result['transfer_seconds']:8.4f}s "
+          f"total {result['estimated_seconds']:8.4f}s")
+  if 's3_seconds' in result:
+    line += f" measured {result['s3_seconds']:8.4f}s"
+  print(line)
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+  parser.add_argument('--rows', type=int, default=200_000)
+  parser.add_argument('--accounts', type=int, default=2_000)
+  parser.add_argument('--seed', type=int, default=42)
+  parser.add_argument('--repeat', type=int, default=3)
+  parser.add_argument('--bandwidth', type=float, default=DEFAULT_BANDWIDTH_MIB,
+                      help='S3 throughput in MiB/s used for the estimated transfer time')
+  parser.add_argument('--bucket', help='S3 bucket to measure the real transfer time against')
+  parser.add_argument('--output', help='write the results to this JSON file')
+  args = parser.parse_args()
+
+  results = run(args.rows, args.accounts, args.seed, args.repeat, args.bandwidth, args.bucket)
+  if args.output:
+    document = {
+      'params': {'rows': args.rows, 'accounts': args.accounts, 'seed': args.seed, 'bandwidth': args.bandwidth},
+      'python': platform.python_version(),
+      'results': results
+    }
+    with open(args.output, 'w') as output:
+      json.dump(document, output, indent=2)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,160 @@
+"""
+Micro-benchmarks of the parse, aggregate, render and persist stages.
+
+Every stage runs over the same seeded synthetic file. The script reports
+rows per second and peak traced memory for each stage and can write the
+results as JSON. When it is given an earlier results file as a baseline, it
+exits with status 1 if a stage got slower or used more memory than the
+tolerance allows. Run it from the project root:
+
+    python benchmarks/run_benchmarks.py --rows 200000 --accounts 2000 --output results.json
+    python benchmarks/run_benchmarks.py --rows 200000 --accounts 2000 --baseline results.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from synthetic import generate_csv
+from util import (calculate_balance, calculate_overall_averages, calculate_transactions_by_month,
+                  parse_transactions, summarize_transactions)
+from numpy_backend import np, summarize_transactions_numpy
+from lambda_function import summary_figures
+from template_registry import SUMMARY_TEMPLATE, TemplateRegistry
+
+
+def measure(function, setup=None, repeat=3):
+  """Returns the best wall time of `repeat` runs and the peak traced memory
+  of one more run. `setup` builds fresh arguments outside the timed region."""
+  best = float('inf')
+  for _ in range(repeat):
+    args = setup() if setup else ()
+    start = time.perf_counter()
+    function(*args)
+    best = min(best, time.perf_counter() - start)
+  args = setup() if setup else ()
+  tracemalloc.start()
+  try:
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  return best, peak
+
+def render_emails(template, summaries):
+  for summary in summaries.values():
+    template.render(summary_figures(summary))
+
+@contextlib.contextmanager
+def transactions_table():
+  from moto import mock_aws
+  import boto3
+  from dynamodb_manager import DynamoDBManager
+  os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+  os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+  os.environ.setdefault('AWS_REGION', 'us-east-1')
+  with mock_aws():
+    boto3.resource('dynamodb', region_name=os.environ['AWS_REGION']).create_table(
+      TableName='transactions',
+      KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+      AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
+      BillingMode='PAY_PER_REQUEST'
+    )
+    yield DynamoDBManager('transactions')
+
+def run(rows, accounts, seed, repeat, persist_rows):
+  csv_content = generate_csv(rows, accounts, seed)
+  lines = csv_content.splitlines()
+  transactions = parse_transactions(csv_content)
+  summaries = summarize_transactions(lines)
+  template = TemplateRegistry().get(SUMMARY_TEMPLATE)
+
+  cases = [
+    ('parse_transactions', rows, lambda: parse_transactions(csv_content), None),
+    ('calculate_balance', rows, lambda: calculate_balance(transactions), None),
+    ('calculate_overall_averages', rows, lambda: calculate_overall_averages(transactions), None),
+    ('calculate_transactions_by_month', rows, lambda: calculate_transactions_by_month(transactions), None),
+    ('summarize_transactions', rows, lambda: summarize_transactions(lines), None),
+  ]
+  if np is not None:
+    cases.append(('summarize_transactions_numpy', rows, lambda: summarize_transactions_numpy(lines), None))
+  # one email per account, rows/s counts the rows those emails cover
+  cases.append(('render_emails', rows, lambda: render_emails(template, summaries), None))
+
+  results = {}
+  for name, items, function, setup in cases:
+    seconds, peak = measure(function, setup, repeat)
+    results[name] = {'seconds': seconds, 'rows_per_sec': items / seconds, 'peak_bytes': peak}
+    print_result(name, results[name])
+
+  if persist_rows:
+    persisted = transactions[:persist_rows]
+    for name, workers in (('save_transactions', 1), ('save_transactions_threaded', 8)):
+      with transactions_table() as manager:
+        seconds, peak = measure(lambda rows: manager.save_transactions(rows, workers=workers),
+                                lambda: (persisted,), repeat)
+      results[name] = {'seconds': seconds, 'rows_per_sec': len(persisted) / seconds, 'peak_bytes': peak}
+      print_result(name, results[name])
+  return results
+
+def print_result(name, result):
+  print(f"{name:34} {result['seconds']:9.4f}s {result['rows_per_sec']:14,.0f} rows/s "
+        f"{result['peak_bytes'] / 2 ** 20:9.1f} MiB peak")
+
+def compare(results, baseline, tolerance):
+  """Returns the regressions of `results` against `baseline` results."""
+  regressions = []
+  for name, result in results.items():
+    previous = baseline.get(name)
+    if not previous:
+      continue
+    if result['rows_per_sec'] < previous['rows_per_sec'] * (1 - tolerance):
+      regressions.append(f"{name}: {result['rows_per_sec']:,.0f} rows/s, baseline {previous['rows_per_sec']:,.0f}")
+    if result['peak_bytes'] > previous['peak_bytes'] * (1 + tolerance):
+      regressions.append(f"{name}: {result['peak_bytes']:,} peak bytes, baseline {previous['peak_bytes']:,}")
+  return regressions
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+  parser.add_argument('--rows', type=int, default=100_000)
+  parser.add_argument('--accounts', type=int, default=1_000)
+  parser.add_argument('--seed', type=int, default=42)
+  parser.add_argument('--repeat', type=int, default=3)
+  parser.add_argument('--persist-rows', type=int, default=5_000,
+                      help='rows saved to a moto DynamoDB table, 0 to skip')
+  parser.add_argument('--output', help='write the results to this JSON file')
+  parser.add_argument('--baseline', help='JSON results file to compare against')
+  parser.add_argument('--tolerance', type=float, default=0.25,
+                      help='allowed relative slowdown or memory growth before failing')
+  args = parser.parse_args()
+
+  params = {'rows': args.rows, 'accounts': args.accounts, 'seed': args.seed}
+  results = run(args.rows, args.accounts, args.seed, args.repeat, args.persist_rows)
+  document = {
+    'params': {**params, 'persist_rows': min(args.persist_rows, args.rows)},
+    'python': platform.python_version(),
+    'results': results
+  }
+  if args.output:
+    with open(args.output, 'w') as output:
+      json.dump(document, output, indent=2)
+
+  if args.baseline:
+    with open(args.baseline) as baseline_file:
+      baseline = json.load(baseline_file)
+    if baseline['params'] != document['params']:
+      print(f"warning: baseline was run with {baseline['params']}")
+    regressions = compare(results, baseline['results'], args.tolerance)
+    for regression in regressions:
+      print(f"REGRESSION {regression}")
+    if regressions:
+      sys.exit(1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,86 @@
+"""
+Import time of the Lambda handler modules, the part of a cold start the code controls.
+
+Every module is imported in a fresh interpreter, several times, and the best
+and median wall times are reported along with the heavy packages the import
+pulled in. AWS_EXECUTION_ENV is set like in the Lambda runtime, so the .env
+file is not loaded. As with run_benchmarks.py, the results can be written as
+JSON and compared against an earlier run. Run it from the project root:
+
+    python benchmarks/startup.py --output startup.json
+    python benchmarks/startup.py --baseline startup.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+MODULES = ['lambda_function', 'lambda_account']
+# packages worth knowing about when they are loaded at import time
+HEAVY_PACKAGES = ['boto3', 'botocore', 'jinja2', 'numpy', 'dotenv', 'smtplib', 'multiprocessing']
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'loaded': [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def measure_import(module, repeat):
+  """Returns the best and median import time of `module` over `repeat`
+  fresh interpreters, and the heavy packages it loaded."""
+  env = {**os.environ, 'AWS_EXECUTION_ENV': 'AWS_Lambda_python3.11', 'PYTHONDONTWRITEBYTECODE': '1'}
+  times, loaded = [], []
+  for _ in range(repeat):
+    output = subprocess.run([sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY_PACKAGES)],
+                            cwd=SRC_DIR, env=env, capture_output=True, text=True, check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    times.append(result['seconds'])
+    loaded = result['loaded']
+  return {'best_ms': min(times) * 1000, 'median_ms': statistics.median(times) * 1000, 'loaded': loaded}
+
+def compare(results, baseline, tolerance):
+  """Returns the modules of `results` that import slower than `baseline` allows."""
+  regressions = []
+  for module, result in results.items():
+    previous = baseline.get(module)
+    if previous and result['median_ms'] > previous['median_ms'] * (1 + tolerance):
+      regressions.append(f"{module}: {result['median_ms']:.1f} ms, baseline {previous['median_ms']:.1f} ms")
+  return regressions
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+  parser.add_argument('--repeat', type=int, default=10)
+  parser.add_argument('--output', help='write the results to this JSON file')
+  parser.add_argument('--baseline', help='JSON results file to compare against')
+  parser.add_argument('--tolerance', type=float, default=0.25,
+                      help='allowed relative slowdown before failing')
+  args = parser.parse_args()
+
+  results = {}
+  for module in MODULES:
+    results[module] = measure_import(module, args.repeat)
+    result = results[module]
+    print(f"{module:20} {result['best_ms']:8.1f} ms best {result['median_ms']:8.1f} ms median "
+          f"loaded: {', '.join(result['loaded']) or '-'}")
+  if args.output:
+    with open(args.output, 'w') as output:
+      json.dump({'python': platform.python_version(), 'results': results}, output, indent=2)
+
+  if args.baseline:
+    with open(args.baseline) as baseline_file:
+      baseline = json.load(baseline_file)
+    regressions = compare(results, baseline['results'], args.tolerance)
+    for regression in regressions:
+      print(f"REGRESSION {regression}")
+    if regressions:
+      sys.exit(1)
+
+if __name__ == '__main__':
+  main()
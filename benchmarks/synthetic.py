@@ -0,0 +1,41 @@
+"""
+Seeded generator of synthetic transaction files.
+
+The files use the `Id;AccountId;Date;Transaction` layout of the uploads, so
+the same seed always gives the same file. Run it to write a file:
+
+    python benchmarks/synthetic.py --rows 100000 --accounts 1000 --output transactions.csv
+"""
+import argparse
+import random
+
+HEADER = 'Id;AccountId;Date;Transaction'
+# Month abbreviations that parse with both the English and Spanish locales
+MONTHS = ['feb', 'mar', 'may', 'jun', 'jul', 'oct', 'nov']
+
+
+def generate_lines(rows, accounts, seed=42):
+  """Yields the header and `rows` transaction lines spread over `accounts` accounts."""
+  rng = random.Random(seed)
+  yield HEADER
+  for i in range(1, rows + 1):
+    date = f"{rng.choice(MONTHS)}-{rng.randint(1, 28):02d}"
+    amount = f"{rng.choice('+-')}{rng.randint(1, 10 ** 6) / 100}"
+    yield f"{i};{rng.randint(1, accounts)};{date};{amount}"
+
+def generate_csv(rows, accounts, seed=42):
+  return '\n'.join(generate_lines(rows, accounts, seed)) + '\n'
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+  parser.add_argument('--rows', type=int, default=100_000)
+  parser.add_argument('--accounts', type=int, default=1_000)
+  parser.add_argument('--seed', type=int, default=42)
+  parser.add_argument('--output', required=True)
+  args = parser.parse_args()
+  with open(args.output, 'w') as output:
+    for line in generate_lines(args.rows, args.accounts, args.seed):
+      output.write(line + '\n')
+
+if __name__ == '__main__':
+  main()
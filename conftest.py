@@ -1,8 +1,19 @@
 import os
 import sys
 from pathlib import Path
+import pytest
 
 # sys.path.append(str(Path(__file__).parent.parent))
 sys.path.append(os.path.realpath(os.path.dirname(__file__)+"/src"))
 
-print(sys.path)
\ No newline at end of file
+print(sys.path)
+
+
+@pytest.fixture(autouse=True)
+def fresh_aws_clients():
+  """Every test gets its own boto3 clients, so mocks patched into boto3 and
+  moto contexts are picked up."""
+  import aws_clients
+  aws_clients.reset()
+  yield
+  aws_clients.reset()
@@ -0,0 +1,72 @@
+from collections import OrderedDict
+import os
+import threading
+import time
+import config
+
+# Marks a cached "this account has no item" answer, so a miss is not
+# confused with an account whose email is None.
+MISSING = object()
+# Default of `get` telling an absent or expired entry apart from MISSING.
+NOT_CACHED = object()
+
+
+class TTLCache:
+  """Bounded LRU cache whose entries expire `ttl` seconds after being stored.
+  Negative entries (MISSING) get their own, usually shorter, `negative_ttl`
+  so that accounts created after the lookup are found again soon. Keeps hit
+  and miss counters."""
+
+  def __init__(self, maxsize=10000, ttl=900, negative_ttl=60, clock=time.monotonic):
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self.negative_ttl = negative_ttl
+    self.clock = clock
+    self.hits = 0
+    self.misses = 0
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key, default=None):
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None and entry[1] > self.clock():
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+      if entry is not None:
+        del self._entries[key]
+      self.misses += 1
+      return default
+
+  def put(self, key, value):
+    ttl = self.negative_ttl if value is MISSING else self.ttl
+    with self._lock:
+      self._entries[key] = (value, self.clock() + ttl)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.maxsize:
+        self._entries.popitem(last=False)
+
+  def invalidate(self, key):
+    with self._lock:
+      self._entries.pop(key, None)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def stats(self):
+    return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+# Account emails by account id; lives as long as the Lambda container, so
+# warm invocations skip the accounts table for accounts seen before. Other
+# lambdas cannot reach it, so an account written elsewhere is only seen once
+# its entry expires: staleness is bounded by the TTLs.
+account_emails = TTLCache(
+  maxsize=int(os.getenv('ACCOUNT_CACHE_SIZE', 10000)),
+  ttl=float(os.getenv('ACCOUNT_CACHE_TTL', 900)),
+  negative_ttl=float(os.getenv('ACCOUNT_CACHE_NEGATIVE_TTL', 60))
+)
@@ -0,0 +1,77 @@
+import os
+import threading
+import config
+
+# boto3 and botocore take a good part of a cold start, so they are only
+# imported when the first client is created
+
+_clients = {}
+_config = None
+_lock = threading.Lock()
+# boto3 resources are not thread safe, so every thread gets its own; the
+# generation makes `reset` forget those of every thread
+_local = threading.local()
+_generation = 0
+
+
+def client_config():
+  """The botocore Config of every client: one connection pool per client,
+  sized for the threads that share it (email dispatch, batched reads, bulk
+  writes), with keep-alive and standard retries."""
+  global _config
+  if _config is None:
+    from botocore.config import Config
+    _config = Config(
+      max_pool_connections=int(os.getenv('AWS_MAX_POOL_CONNECTIONS', 50)),
+      tcp_keepalive=True,
+      retries={'max_attempts': 5, 'mode': 'standard'}
+    )
+  return _config
+
+def get_client(service, region_name=None):
+  """Returns the process-wide boto3 client of `service`, created on first use.
+  Clients are thread safe and live as long as the Lambda container, so warm
+  invocations reuse their connections."""
+  region_name = region_name or os.getenv('AWS_REGION')
+  key = (service, region_name)
+  client = _clients.get(key)
+  if client is None:
+    with _lock:
+      client = _clients.get(key)
+      if client is None:
+        import boto3
+        client = _clients[key] = boto3.client(service, region_name=region_name, config=client_config())
+  return client
+
+def get_resource(service, region_name=None):
+  """Returns the boto3 resource of `service` of the calling thread, created
+  on first use. Resources are not thread safe: objects made from it (such as
+  a DynamoDB Table) stay on this thread, other threads go through its
+  `meta.client`."""
+  region_name = region_name or os.getenv('AWS_REGION')
+  if getattr(_local, 'generation', None) != _generation:
+    _local.resources = {}
+    _local.generation = _generation
+  key = (service, region_name)
+  resource = _local.resources.get(key)
+  if resource is None:
+    import boto3
+    resource = _local.resources[key] = boto3.resource(service, region_name=region_name, config=client_config())
+  return resource
+
+def error_code(error):
+  """Returns the AWS error code of a botocore ClientError (e.g.
+  'ConditionalCheckFailedException'), or None for any other exception.
+  Read from the error's response, so catching it needs no botocore import."""
+  response = getattr(error, 'response', None)
+  if not isinstance(response, dict):
+    return None
+  return response.get('Error', {}).get('Code')
+
+def reset():
+  """Forgets every client and resource, e.g. in a forked worker process whose
+  inherited connections must not be shared with the parent."""
+  global _generation
+  with _lock:
+    _clients.clear()
+    _generation += 1
@@ -7,18 +7,20 @@
 # # Call `load_config` when this module is imported
 # load_config()
 
+import logging
 import os
-from dotenv import load_dotenv
 
 # Define a function to determine if the environment is AWS Lambda
 def running_on_aws_lambda():
     return os.getenv('AWS_EXECUTION_ENV') is not None
 
 # Load environment variables from .env file when not running on AWS Lambda
+# (dotenv is only imported here, so the lambda never pays for it)
 if not running_on_aws_lambda():
+    from dotenv import load_dotenv
     # Assuming your project structure places the .env file at the project root
     dotenv_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env')
-    print(f'Loading environment variables from: {dotenv_path}')
+    logging.debug(f'Loading environment variables from: {dotenv_path}')
     load_dotenv(dotenv_path)
 
 # Configuration getters that you use throughout your code
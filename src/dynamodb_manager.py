@@ -1,24 +1,91 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import boto3
+import hashlib
+from itertools import islice
+import random
+import time
+from aws_clients import error_code, get_resource
 import logging
-import os
 import config
 
+# Global secondary index of the transactions table: accountId hash key and
+# date (ISO string) range key
+TRANSACTIONS_BY_ACCOUNT_INDEX = 'account_date'
+
+def _iso(value):
+  return value if isinstance(value, str) else value.isoformat()
+
+def _file_marker(file_id):
+  # what an item records of each file applied to it: 16 characters whatever
+  # the length of the bucket, key and ETag
+  return hashlib.blake2b(file_id.encode(), digest_size=8).hexdigest()
+
 
 class DynamoDBManager:
   def __init__(self, table_name):
-    self.dynamodb = boto3.resource('dynamodb', region_name=os.getenv('AWS_REGION'))
+    self.dynamodb = get_resource('dynamodb')
     self.table = self.dynamodb.Table(table_name)
     logging.info(f"Initializing DynamoDBManager with table name: {table_name}")
 
 
-  def save_transactions(self, transactions):
-    with self.table.batch_writer() as batch:
-      for transaction in transactions:
-        print(f"processing transaction: {transaction}")
-        if isinstance(transaction['date'], datetime):
-          transaction['date'] = transaction['date'].isoformat()
-        batch.put_item(Item=transaction)
+  def _batch_write(self, items, max_retries, backoff_seconds):
+    """Puts up to 25 items with one BatchWriteItem call, sending the
+    UnprocessedItems again after a jittered backoff. Returns the number of
+    retries it took."""
+    request = {self.table.table_name: [{'PutRequest': {'Item': item}} for item in items]}
+    for attempt in range(max_retries + 1):
+      response = self.dynamodb.meta.client.batch_write_item(RequestItems=request)
+      request = response.get('UnprocessedItems')
+      if not request:
+        return attempt
+      if attempt < max_retries:
+        time.sleep(random.uniform(0, min(backoff_seconds * 2 ** attempt, 5)))
+    raise RuntimeError(f"{len(request[self.table.table_name])} items still unprocessed after {max_retries} retries")
+
+  def save_transactions(self, transactions, workers=1, max_retries=8, backoff_seconds=0.05):
+    """Saves the transactions 25 per BatchWriteItem call. With `workers` > 1
+    the batches are written by that many threads, while `transactions` (which
+    may be a generator) is consumed as the writes go, so at most two batches
+    per worker are waiting at any time. datetime values are stored as ISO
+    strings without changing the caller's dicts.
+
+    Returns the number of items, batches and retries, and the items per
+    second of the whole write."""
+    start = time.perf_counter()
+    transactions = iter(transactions)
+    stats = {'items': 0, 'batches': 0, 'retries': 0}
+
+    def batches():
+      while True:
+        batch = [{key: value.isoformat() if isinstance(value, datetime) else value for key, value in transaction.items()}
+                 for transaction in islice(transactions, 25)]
+        if not batch:
+          return
+        stats['items'] += len(batch)
+        stats['batches'] += 1
+        yield batch
+
+    try:
+      if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+          pending = deque()
+          for batch in batches():
+            if len(pending) >= 2 * workers:
+              stats['retries'] += pending.popleft().result()
+            pending.append(executor.submit(self._batch_write, batch, max_retries, backoff_seconds))
+          while pending:
+            stats['retries'] += pending.popleft().result()
+      else:
+        for batch in batches():
+          stats['retries'] += self._batch_write(batch, max_retries, backoff_seconds)
+    except Exception as e:
+      logging.error(f"Error saving transactions to {self.table.table_name}: {e}")
+      raise
+    seconds = time.perf_counter() - start
+    stats['items_per_sec'] = stats['items'] / seconds if seconds else 0.0
+    logging.info(f"Saved transactions to {self.table.table_name}: {stats}")
+    return stats
 
   def get_item(self, key):
     logging.info(f"Getting item from table {self.table.table_name} with key: {key}")
@@ -49,4 +116,301 @@ class DynamoDBManager:
       return response
     except Exception as e:
       logging.error(f"Error saving account: {e}")
+      raise
+
+  def _create_chunk(self, items, max_attempts, backoff_seconds):
+    statuses = [None] * len(items)
+    pending = list(range(len(items)))
+    for attempt in range(max_attempts):
+      try:
+        self.dynamodb.meta.client.transact_write_items(TransactItems=[{
+          'Put': {'TableName': self.table.table_name, 'Item': items[i], 'ConditionExpression': 'attribute_not_exists(id)'}
+        } for i in pending])
+        for i in pending:
+          statuses[i] = 'created'
+        return statuses
+      except Exception as e:
+        if error_code(e) != 'TransactionCanceledException':
+          raise
+        reasons = e.response.get('CancellationReasons') or [{}] * len(pending)
+      # items that already exist are done; the rest (cancelled only because
+      # of them, or by a conflict or throttling) go in the next transaction
+      retry = []
+      for i, reason in zip(pending, reasons):
+        if reason.get('Code') == 'ConditionalCheckFailed':
+          statuses[i] = 'exists'
+        else:
+          retry.append(i)
+      if any(reason.get('Code') not in ('None', 'ConditionalCheckFailed') for reason in reasons):
+        time.sleep(random.uniform(0, min(backoff_seconds * 2 ** attempt, 5)))
+      pending = retry
+      if not pending:
+        return statuses
+    for i in pending:
+      statuses[i] = 'error'
+    return statuses
+
+  def create_items(self, items, max_attempts=5, backoff_seconds=0.05):
+    """Puts the items whose id is not in the table yet, never overwriting one.
+    Items go 100 per TransactWriteItems call with an attribute_not_exists(id)
+    condition each, so a new item takes a single round trip and concurrent
+    creations of the same id cannot both win. A transaction cancelled by
+    existing ids is sent again without them.
+
+    Returns 'created', 'exists' or 'error' (still cancelled after
+    `max_attempts` transactions) for each item, in order. The ids must be
+    unique within `items`."""
+    statuses = []
+    try:
+      for start in range(0, len(items), 100):
+        statuses.extend(self._create_chunk(items[start:start + 100], max_attempts, backoff_seconds))
+      return statuses
+    except Exception as e:
+      logging.error(f"Error creating items in {self.table.table_name}: {e}")
+      raise
+
+  def update_account_aggregate(self, account_id, summary, year=None, file_id=None):
+    """Atomically adds the totals of an AccountSummary to the running
+    aggregate item of the account and returns the updated item.
+
+    Monthly counts are kept as top-level count_<year>_<month> attributes,
+    since ADD only works on top-level attributes. With a `file_id` (the
+    uploaded object version) the item records a marker of the file in its
+    applied_files set and a file already applied is not added again, so a
+    retried file does not count twice; the current item is returned then."""
+    year = year or datetime.now().year
+    increments = {
+      'balance': summary.balance,
+      'credit_total': summary.credit_total,
+      'credit_count': summary.credit_count,
+      'debit_total': summary.debit_total,
+      'debit_count': summary.debit_count,
+    }
+    for month, count in enumerate(summary.month_counts):
+      if count:
+        increments[f"count_{year}_{month:02d}"] = count
+    names = {f"#a{i}": name for i, name in enumerate(increments)}
+    values = {f":a{i}": value for i, value in enumerate(increments.values())}
+    additions = [f"#a{i} :a{i}" for i in range(len(increments))]
+    params = {}
+    if file_id:
+      marker = _file_marker(file_id)
+      names['#applied'] = 'applied_files'
+      values.update({':applied': {marker}, ':marker': marker})
+      additions.append('#applied :applied')
+      params['ConditionExpression'] = 'NOT contains(#applied, :marker)'
+    try:
+      response = self.table.update_item(
+        Key={'id': account_id},
+        UpdateExpression='ADD ' + ', '.join(additions),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+        ReturnValues='ALL_NEW',
+        **params
+      )
+      return response['Attributes']
+    except Exception as e:
+      if error_code(e) == 'ConditionalCheckFailedException':
+        logging.info(f"File {file_id} was already added to the aggregate of account {account_id}")
+        return self.table.get_item(Key={'id': account_id}, ConsistentRead=True)['Item']
+      logging.error(f"Error updating aggregate for account {account_id}: {e}")
+      raise
+
+  def _update_rollup(self, account_id, month_key, count, credit_total, debit_total, marker=None):
+    # called from several threads, so through the (thread safe) client;
+    # returns False if the item already has the file's marker
+    names = {'#count': 'count'}
+    values = {':count': count, ':credit': credit_total, ':debit': debit_total, ':balance': credit_total + debit_total}
+    update = 'ADD #count :count, credit_total :credit, debit_total :debit, balance :balance'
+    params = {}
+    if marker:
+      names['#applied'] = 'applied_files'
+      values.update({':applied': {marker}, ':marker': marker})
+      update += ', #applied :applied'
+      params['ConditionExpression'] = 'NOT contains(#applied, :marker)'
+    try:
+      self.dynamodb.meta.client.update_item(
+        TableName=self.table.table_name,
+        Key={'accountId': account_id, 'month': month_key},
+        UpdateExpression=update,
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+        **params
+      )
+      return True
+    except Exception as e:
+      if error_code(e) == 'ConditionalCheckFailedException':
+        return False
+      raise
+
+  def update_monthly_rollups(self, summaries, year=None, workers=1, file_id=None):
+    """Adds the per-month totals of (account_id, AccountSummary) pairs to the
+    rollup item of each account and month, keyed by accountId and month
+    ('2024-07'): transaction count, credit and debit sums and the balance
+    change. UpdateItem calls run on `workers` threads; returns how many
+    rollup items were updated.
+
+    With a `file_id` each item records a marker of the file in its
+    applied_files set and the items that already have it are skipped, so a
+    file retried after a failure part way through adds only what is
+    missing."""
+    year = year or datetime.now().year
+    marker = _file_marker(file_id) if file_id else None
+    updates = [(str(account_id), f"{year}-{month:02d}", count, credit_total, debit_total, marker)
+               for account_id, summary in summaries
+               for month, count, credit_total, debit_total in summary.monthly_totals()]
+    try:
+      if workers > 1 and len(updates) > 1:
+        with ThreadPoolExecutor(max_workers=min(workers, len(updates))) as executor:
+          return sum(executor.map(lambda update: self._update_rollup(*update), updates))
+      return sum(self._update_rollup(*update) for update in updates)
+    except Exception as e:
+      logging.error(f"Error updating monthly rollups in {self.table.table_name}: {e}")
+      raise
+
+  def get_monthly_rollups(self, account_id, start_month=None, end_month=None):
+    """Returns the rollup items of an account in month order, optionally from
+    `start_month` to `end_month` (both 'YYYY-MM' and inclusive)."""
+    names = {'#account': 'accountId'}
+    values = {':account': str(account_id)}
+    condition = '#account = :account'
+    if start_month or end_month:
+      names['#month'] = 'month'
+      condition += ' AND #month BETWEEN :start AND :end'
+      values.update({':start': start_month or '0000-00', ':end': end_month or '9999-99'})
+    params = {'KeyConditionExpression': condition, 'ExpressionAttributeNames': names, 'ExpressionAttributeValues': values}
+    items = []
+    try:
+      while True:
+        response = self.table.query(**params)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+          return items
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    except Exception as e:
+      logging.error(f"Error getting monthly rollups of account {account_id}: {e}")
+      raise
+
+  def _batch_get(self, keys, max_retries, backoff_seconds):
+    request = {self.table.table_name: {'Keys': keys}}
+    items = []
+    for attempt in range(max_retries + 1):
+      # the resource's client is thread safe and takes plain Python values
+      response = self.dynamodb.meta.client.batch_get_item(RequestItems=request)
+      items.extend(response['Responses'].get(self.table.table_name, []))
+      request = response.get('UnprocessedKeys')
+      if not request:
+        return items
+      if attempt < max_retries:
+        time.sleep(min(backoff_seconds * 2 ** attempt, 5))
+    raise RuntimeError(f"{len(request[self.table.table_name]['Keys'])} keys still unprocessed after {max_retries} retries")
+
+  def batch_get_items(self, keys, workers=1, max_retries=8, backoff_seconds=0.05):
+    """Gets the items for a list of keys, 100 keys per BatchGetItem call.
+    UnprocessedKeys are requested again with exponential backoff, and with
+    `workers` > 1 the batches run concurrently. Duplicate keys are only
+    requested once; keys without an item are left out of the result."""
+    unique_keys = list({tuple(sorted(key.items())): key for key in keys}.values())
+    batches = [unique_keys[start:start + 100] for start in range(0, len(unique_keys), 100)]
+    try:
+      if workers > 1 and len(batches) > 1:
+        with ThreadPoolExecutor(max_workers=min(workers, len(batches))) as executor:
+          results = list(executor.map(lambda batch: self._batch_get(batch, max_retries, backoff_seconds), batches))
+      else:
+        results = [self._batch_get(batch, max_retries, backoff_seconds) for batch in batches]
+      return [item for items in results for item in items]
+    except Exception as e:
+      logging.error(f"Error batch getting items from {self.table.table_name}: {e}")
+      raise
+
+  def query_transactions(self, account_id, start=None, end=None, columns=None, page_size=None,
+                         index_name=TRANSACTIONS_BY_ACCOUNT_INDEX):
+    """Yields the transactions of an account in date order, from `start`
+    (inclusive) to `end` (exclusive). Both bounds are datetimes, dates or ISO
+    strings and either can be left out, e.g. July is
+    `query_transactions('1', date(2024, 7, 1), date(2024, 8, 1))`.
+
+    Pages (of `page_size` items, or up to 1 MB) are queried from the
+    account/date index as the generator is consumed, so a read costs the
+    size of its result rather than of the table. `columns` limits the
+    attributes read, e.g. ('date', 'transaction')."""
+    names = {'#account': 'accountId'}
+    values = {':account': str(account_id)}
+    condition = '#account = :account'
+    if start is not None or end is not None:
+      names['#date'] = 'date'
+    if start is not None and end is not None:
+      # BETWEEN includes the end, items on it are skipped below
+      condition += ' AND #date BETWEEN :start AND :end'
+      values.update({':start': _iso(start), ':end': _iso(end)})
+    elif start is not None:
+      condition += ' AND #date >= :start'
+      values[':start'] = _iso(start)
+    elif end is not None:
+      condition += ' AND #date < :end'
+      values[':end'] = _iso(end)
+    params = {'IndexName': index_name, 'KeyConditionExpression': condition, 'ExpressionAttributeValues': values}
+    if columns and ':end' in values and ':start' in values and 'date' not in columns:
+      columns = [*columns, 'date']  # needed to skip the items on the end bound
+    if columns:
+      projected = {f'#c{i}': column for i, column in enumerate(columns)}
+      names.update(projected)
+      params['ProjectionExpression'] = ', '.join(projected)
+    params['ExpressionAttributeNames'] = names
+    if page_size:
+      params['Limit'] = page_size
+    end = _iso(end) if end is not None else None
+    try:
+      while True:
+        response = self.table.query(**params)
+        for item in response['Items']:
+          if end is None or item.get('date') != end:
+            yield item
+        if 'LastEvaluatedKey' not in response:
+          return
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    except Exception as e:
+      logging.error(f"Error querying transactions of account {account_id}: {e}")
+      raise
+
+  def claim_processing(self, item_id, lease_seconds=900):
+    """Marks an item as being processed unless it was already processed or
+    another invocation holds an unexpired claim. Returns True if claimed."""
+    now = int(time.time())
+    try:
+      self.table.put_item(
+        Item={'id': item_id, 'status': 'processing', 'lease_expires': now + lease_seconds},
+        ConditionExpression='attribute_not_exists(id) OR (#status = :processing AND lease_expires < :now)',
+        ExpressionAttributeNames={'#status': 'status'},
+        ExpressionAttributeValues={':processing': 'processing', ':now': now}
+      )
+      return True
+    except Exception as e:
+      if error_code(e) == 'ConditionalCheckFailedException':
+        logging.info(f"Item {item_id} was already processed or is being processed")
+        return False
+      logging.error(f"Error claiming item {item_id}: {e}")
+      raise
+
+  def mark_processed(self, item_id):
+    try:
+      return self.table.put_item(Item={'id': item_id, 'status': 'processed', 'processed_at': datetime.now().isoformat()})
+    except Exception as e:
+      logging.error(f"Error marking item {item_id} as processed: {e}")
+      raise
+
+  def save_versioned_item(self, item, version):
+    """Puts `item` with version `version + 1` only if the stored item still has
+    version `version` (or does not exist). Returns False on a version conflict."""
+    try:
+      self.table.put_item(
+        Item={**item, 'version': version + 1},
+        ConditionExpression='attribute_not_exists(id) OR version = :version',
+        ExpressionAttributeValues={':version': version}
+      )
+      return True
+    except Exception as e:
+      if error_code(e) == 'ConditionalCheckFailedException':
+        return False
+      logging.error(f"Error saving item {item.get('id')}: {e}")
       raise
\ No newline at end of file
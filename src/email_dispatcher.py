@@ -0,0 +1,91 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import random
+import threading
+import time
+from aws_clients import error_code
+import config
+
+# SES error codes returned when the account's send rate is exceeded
+THROTTLING_ERROR_CODES = {'Throttling', 'ThrottlingException', 'TooManyRequestsException', 'MaxSendRateExceeded'}
+# SMTP replies that mean "try again later"
+TRANSIENT_SMTP_CODES = {421, 450, 451, 452, 454}
+
+
+class TokenBucket:
+  """Allows `rate` acquisitions per second on average with bursts of up to
+  `capacity`. Thread safe; `acquire` blocks until a token is available.
+
+  Implemented as the equivalent "virtual scheduling" form: each acquisition
+  reserves the next free slot under the lock and then sleeps outside it
+  until that slot is due."""
+
+  def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+    self.interval = 1.0 / rate
+    self.tolerance = (max(1.0, capacity or rate) - 1) * self.interval
+    self.clock = clock
+    self.sleep = sleep
+    self.next_slot = clock()
+    self.lock = threading.Lock()
+
+  def acquire(self):
+    with self.lock:
+      now = self.clock()
+      slot = max(self.next_slot, now)
+      self.next_slot = slot + self.interval
+    wait = slot - self.tolerance - now
+    if wait > 0:
+      self.sleep(wait)
+
+def is_throttling_error(error):
+  if error_code(error) in THROTTLING_ERROR_CODES:
+    return True
+  # smtplib.SMTPResponseException, matched by attribute so the lambda does
+  # not have to import smtplib
+  return getattr(error, 'smtp_code', None) in TRANSIENT_SMTP_CODES
+
+class EmailDispatcher:
+  """Sends emails through an EmailManager from a bounded pool of threads.
+
+  Every send takes a token from a bucket refilled at `rate` emails per
+  second, so the dispatcher never goes over the SES sending quota. Sends
+  rejected for throttling are retried with exponential backoff and jitter;
+  any other error fails the message straight away. `dispatch` returns one
+  outcome per message, in the order of the messages. Dispatchers running at
+  the same time must share one `bucket`, or each gets the whole quota."""
+
+  def __init__(self, email_manager, workers=8, rate=14.0, max_attempts=4, backoff_seconds=0.5, bucket=None):
+    self.email_manager = email_manager
+    self.workers = workers
+    self.bucket = bucket or TokenBucket(rate)
+    self.max_attempts = max_attempts
+    self.backoff_seconds = backoff_seconds
+
+  def _send(self, recipient, subject, html_body):
+    start = time.perf_counter()
+    outcome = {'recipient': recipient}
+    for attempt in range(1, self.max_attempts + 1):
+      self.bucket.acquire()
+      try:
+        response = self.email_manager.send_email(recipient, subject, html_body)
+        outcome.update(status='sent', message_id=response.get('MessageId'))
+        break
+      except Exception as e:
+        if attempt < self.max_attempts and is_throttling_error(e):
+          delay = self.backoff_seconds * 2 ** (attempt - 1)
+          time.sleep(delay + random.uniform(0, delay))
+          continue
+        logging.error(f"Error sending email to {recipient}: {e}")
+        outcome.update(status='failed', error=str(e))
+        break
+    outcome.update(attempts=attempt, seconds=time.perf_counter() - start)
+    return outcome
+
+  def dispatch(self, messages):
+    """Sends each (recipient, subject, html_body) message and returns the
+    outcome of every one."""
+    messages = list(messages)
+    if not messages:
+      return []
+    with ThreadPoolExecutor(max_workers=min(self.workers, len(messages))) as executor:
+      return list(executor.map(lambda message: self._send(*message), messages))
@@ -1,16 +1,118 @@
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+import json
+import logging
 import os
-import smtplib
-import boto3
+import queue
+import threading
+import time
+from aws_clients import get_client
 import config
 
+# SES accepts up to 50 destinations per SendBulkTemplatedEmail call
+MAX_BULK_DESTINATIONS = 50
+# bulk statuses worth sending again, anything else is a permanent failure
+RETRYABLE_BULK_STATUSES = {'TransientFailure', 'Failed', 'AccountThrottled'}
+
+class SMTPPool:
+  """Keeps up to `size` authenticated SMTP connections open so consecutive
+  messages reuse a session instead of paying a TLS handshake and a login
+  each. An idle connection the server dropped is replaced before the next
+  message; a message whose session breaks while it is sent is not retried.
+
+  smtplib and the email package are only imported by the local delivery,
+  the lambda sends through SES and never loads them."""
+
+  def __init__(self, host, port, user=None, password=None, size=2, starttls=True):
+    self.host = host
+    self.port = port
+    self.user = user
+    self.password = password
+    self.starttls = starttls
+    self._idle = queue.LifoQueue()
+    self._slots = threading.BoundedSemaphore(size)
+    self._open = []
+    self._lock = threading.Lock()
+
+  def _connect(self):
+    import smtplib
+    server = smtplib.SMTP(self.host, self.port)
+    if self.starttls:
+      server.starttls()
+    if self.user:
+      server.login(self.user, self.password)
+    with self._lock:
+      self._open.append(server)
+    return server
+
+  def _discard(self, server):
+    with self._lock:
+      if server in self._open:
+        self._open.remove(server)
+    try:
+      server.close()
+    except Exception:
+      pass
+
+  def _checkout(self):
+    import smtplib
+    import socket
+    try:
+      server = self._idle.get_nowait()
+    except queue.Empty:
+      return self._connect()
+    # The server may have closed an idle session: a NOOP finds out before
+    # any part of the message is sent, so replacing the session can never
+    # deliver a message twice
+    try:
+      healthy = server.noop()[0] == 250
+    except (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout):
+      healthy = False
+    if healthy:
+      return server
+    self._discard(server)
+    return self._connect()
+
+  def sendmail(self, sender, recipient, message):
+    import smtplib
+    self._slots.acquire()
+    try:
+      server = self._checkout()
+      try:
+        result = server.sendmail(sender, recipient, message)
+      except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+        # the server refused the message (e.g. 550 on a recipient) and reset
+        # the transaction, the session itself is fine
+        self._idle.put(server)
+        raise
+      except Exception:
+        # a session that broke mid-message is not sent on again: the server
+        # may have accepted the message already
+        self._discard(server)
+        raise
+      self._idle.put(server)
+      return result
+    finally:
+      self._slots.release()
+
+  def close(self):
+    """Ends every open session with QUIT."""
+    with self._lock:
+      servers, self._open = self._open, []
+    self._idle = queue.LifoQueue()
+    for server in servers:
+      try:
+        server.quit()
+      except Exception:
+        server.close()
+
 class EmailManager:
   def __init__(self, sender, aws_region='us-east-1', running_type='prod'):
     self.sender = sender
     self.running_type = running_type
+    self.smtp_pool = None
+    # the dispatcher's threads may ask for the pool at the same time
+    self._smtp_pool_lock = threading.Lock()
     if self.running_type == 'prod':
-      self.client = boto3.client('ses', region_name=aws_region)
+      self.client = get_client('ses', region_name=aws_region)
 
   def send_email(self,recipient,subject,  html_body):
     if self.running_type == 'prod':
@@ -30,21 +132,74 @@ class EmailManager:
       
     else:
       #for local testing
-      smtp_server=os.getenv('SMTP_SERVER')
-      smtp_port=int(os.getenv('SMTP_PORT'))
-      smtp_user=os.getenv('SMTP_USER')
-      smtp_password=os.getenv('SMTP_PASSWORD')
       #prepare message
+      from email.mime.multipart import MIMEMultipart
+      from email.mime.text import MIMEText
       message = MIMEMultipart("alternative")
       message["Subject"] = subject
       message["From"] = self.sender
       message["To"] = recipient
       message.attach(MIMEText(html_body, "html"))
-      # send email
-      server = smtplib.SMTP(smtp_server, smtp_port)
-      server.starttls()
-      server.login(smtp_user, smtp_password)
-      server.sendmail(self.sender, recipient, message.as_string())
-      server.quit()
+      # send email over a pooled connection, closed by close()
+      self._smtp_pool().sendmail(self.sender, recipient, message.as_string())
       return {'MessageId': 'Email sent with smtp'}
-      
+
+  def _smtp_pool(self):
+    with self._smtp_pool_lock:
+      if self.smtp_pool is None:
+        self.smtp_pool = SMTPPool(
+          os.getenv('SMTP_SERVER'),
+          int(os.getenv('SMTP_PORT')),
+          os.getenv('SMTP_USER'),
+          os.getenv('SMTP_PASSWORD'),
+          size=int(os.getenv('SMTP_POOL_SIZE', 2)),
+          starttls=os.getenv('SMTP_STARTTLS', 'true').lower() == 'true'
+        )
+      return self.smtp_pool
+
+  def close(self):
+    """Closes the pooled SMTP connections, if any were opened."""
+    with self._smtp_pool_lock:
+      smtp_pool, self.smtp_pool = self.smtp_pool, None
+    if smtp_pool is not None:
+      smtp_pool.close()
+
+  def send_bulk_templated_email(self, template_name, destinations, default_data=None, max_attempts=3, backoff_seconds=0.5):
+    """Sends the SES template `template_name` to many recipients, 50 per
+    SendBulkTemplatedEmail call. `destinations` is a list of (recipient,
+    template data) pairs. Destinations with a retryable status are sent again
+    up to `max_attempts` times. Returns the last status of every destination,
+    in the order of `destinations`."""
+    if self.running_type != 'prod':
+      raise ValueError("Bulk templated emails are only sent through SES in prod")
+    destinations = list(destinations)
+    results = [None] * len(destinations)
+    pending = list(range(len(destinations)))
+    default_data = json.dumps(default_data or {})
+    for attempt in range(1, max_attempts + 1):
+      failed = []
+      for start in range(0, len(pending), MAX_BULK_DESTINATIONS):
+        chunk = pending[start:start + MAX_BULK_DESTINATIONS]
+        response = self.client.send_bulk_templated_email(
+          Source=self.sender,
+          Template=template_name,
+          DefaultTemplateData=default_data,
+          Destinations=[{
+            'Destination': {'ToAddresses': [destinations[i][0]]},
+            'ReplacementTemplateData': json.dumps(destinations[i][1], default=str)
+          } for i in chunk]
+        )
+        for i, status in zip(chunk, response['Status']):
+          results[i] = status
+          if status['Status'] in RETRYABLE_BULK_STATUSES:
+            failed.append(i)
+      if not failed:
+        break
+      pending = failed
+      if attempt < max_attempts:
+        logging.info(f"Retrying {len(failed)} bulk email destinations")
+        time.sleep(backoff_seconds * 2 ** (attempt - 1))
+    for i, status in enumerate(results):
+      if status['Status'] != 'Success':
+        logging.error(f"Error sending email to {destinations[i][0]}: {status['Status']} {status.get('Error', '')}")
+    return results
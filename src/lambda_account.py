@@ -10,6 +10,7 @@ import config
 # Configure basic logging
 logging.basicConfig(level=logging.INFO)
 DYNAMODB_ACCOUNTS_TABLE_NAME = os.getenv('DYNAMODB_ACCOUNTS_TABLE_NAME')
+MAX_ACCOUNTS_PER_REQUEST = int(os.getenv('MAX_ACCOUNTS_PER_REQUEST', 1000))
 
 def lambda_handler(event, context):
   dynamo_db_manager = DynamoDBManager(DYNAMODB_ACCOUNTS_TABLE_NAME)
@@ -23,32 +24,71 @@ def lambda_handler(event, context):
     logging.error(error_message)
     return {'statusCode': 400, 'body': 'Invalid request body'}
 
-  account_id = account_info['id']
-  email = account_info['email']
+  # A single account keeps the original responses; a list of accounts gets
+  # one status per account
+  if isinstance(account_info, list):
+    return create_accounts(dynamo_db_manager, account_info)
+  if not isinstance(account_info, dict):
+    return {'statusCode': 400, 'body': 'Invalid request body'}
+
+  account_id = account_info.get('id')
+  email = account_info.get('email')
   
-  if not account_id or not email:
+  if not valid_account(account_id, email):
     return {'statusCode': 400, 'body': 'Missing account ID or email'}
-  # Check if account already exists
-  try:
-    item = dynamo_db_manager.get_item({'id': account_id})
-    if item:
-      logging.info(f"Account already exists: {item}")
-      return {'statusCode': 409, 'body': 'Account already exists'}
-  except Exception as e:
-    traceback_str = ''.join(traceback.format_tb(e.__traceback__))
-    error_message = f"Error try2: {str(e)}. Traceback: {traceback_str}"
-    logging.error(error_message)
-    return {'statusCode': 500, 'body': 'Error accessing DynamoDB'}
-
-  # Add new account
+  # Conditional write: creates the account unless it already exists, in one
+  # round trip and without racing a concurrent request for the same id
   try:
-    dynamo_db_manager.save_account(account_id, email)
+    status = dynamo_db_manager.create_items([{'id': account_id, 'email': email}])[0]
   except Exception as e:
     logging.error("Error saving new account to DynamoDB", exc_info=e)
     traceback_str = ''.join(traceback.format_tb(e.__traceback__))
     error_message = f"Error try3: {str(e)}. Traceback: {traceback_str}"
     logging.error(error_message)
     return {'statusCode': 500, 'body': 'Error saving account to DynamoDB'}
+  if status == 'exists':
+    logging.info(f"Account already exists: {account_id}")
+    return {'statusCode': 409, 'body': 'Account already exists'}
+  if status != 'created':
+    return {'statusCode': 500, 'body': 'Error saving account to DynamoDB'}
+  # The transactions lambda caches account emails in its own containers,
+  # which this lambda cannot reach: a cached "no such account" answer there
+  # expires after ACCOUNT_CACHE_NEGATIVE_TTL seconds
 
   return {'statusCode': 201, 'body': 'Account created successfully'}
 
+def valid_account(account_id, email):
+  # ids and emails are strings in the table; anything else (a number, a list)
+  # would make DynamoDB reject the whole batch
+  return isinstance(account_id, str) and isinstance(email, str) and bool(account_id) and bool(email)
+
+def create_accounts(dynamo_db_manager, accounts):
+  if not accounts or len(accounts) > MAX_ACCOUNTS_PER_REQUEST:
+    return {'statusCode': 400, 'body': f'Send between 1 and {MAX_ACCOUNTS_PER_REQUEST} accounts'}
+  results = []
+  items, positions = [], {}
+  for account in accounts:
+    account_id = account.get('id') if isinstance(account, dict) else None
+    email = account.get('email') if isinstance(account, dict) else None
+    results.append({'id': account_id, 'status': 'invalid'})
+    if not valid_account(account_id, email):
+      continue
+    if account_id in positions:
+      results[-1]['status'] = 'duplicate'
+      continue
+    positions[account_id] = len(results) - 1
+    items.append({'id': account_id, 'email': email})
+
+  try:
+    statuses = dynamo_db_manager.create_items(items)
+  except Exception as e:
+    logging.error("Error saving new accounts to DynamoDB", exc_info=e)
+    return {'statusCode': 500, 'body': 'Error saving accounts to DynamoDB'}
+  for item, status in zip(items, statuses):
+    results[positions[item['id']]]['status'] = status
+
+  created = sum(1 for result in results if result['status'] == 'created')
+  logging.info(f"Created {created} of {len(results)} accounts")
+  # 207 Multi-Status when some accounts were not created
+  return {'statusCode': 201 if created == len(results) else 207,
+          'body': json.dumps({'created': created, 'results': results})}
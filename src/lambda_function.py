@@ -1,111 +1,464 @@
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import json
 import logging
-from jinja2 import Template
-from util import format_monthly_summaries, read_s3_file, parse_transactions, calculate_balance, calculate_overall_averages, calculate_transactions_by_month
-from email_manager import EmailManager
+from util import accumulate_summaries, iter_transaction_batches, iter_transactions, stream_s3_file, summarize_transactions
+from email_manager import RETRYABLE_BULK_STATUSES, EmailManager
+from email_dispatcher import EmailDispatcher, TokenBucket
 from dynamodb_manager import DynamoDBManager
+from metrics import Metrics
+from pipeline import BackgroundStage
+from template_registry import SUMMARY_TEMPLATE, get_registry
+from account_cache import MISSING, NOT_CACHED, account_emails
+from aws_clients import get_client
 import os
 import config
 
 def get_email(account_id):
+  account_id_str = str(account_id)
+  cached = account_emails.get(account_id_str, NOT_CACHED)
+  if cached is not NOT_CACHED:
+    return None if cached is MISSING else cached
   dynamo_db_manager_account = DynamoDBManager(os.getenv('DYNAMODB_ACCOUNTS_TABLE_NAME'))
   try:
-    account_id_str = str(account_id)
     response = dynamo_db_manager_account.get_item({'id': account_id_str})
     # If an item was found, return the email field
     if response:
+      account_emails.put(account_id_str, response.get('email'))
       return response.get('email')
+    account_emails.put(account_id_str, MISSING)
   except Exception as e:
     logging.error(f"Error retrieving email for account_id {account_id}: {e}")
   return None
 
+def get_emails(account_ids):
+  """Resolves the emails of many accounts. Accounts cached by an earlier
+  (warm) invocation are answered from memory, the rest with batched reads of
+  100 accounts per BatchGetItem call. Accounts without an item are left out."""
+  emails, missing = {}, []
+  for account_id in map(str, account_ids):
+    cached = account_emails.get(account_id, NOT_CACHED)
+    if cached is NOT_CACHED:
+      missing.append(account_id)
+    elif cached is not MISSING:
+      emails[account_id] = cached
+  if not missing:
+    return emails
+  dynamo_db_manager_account = DynamoDBManager(os.getenv('DYNAMODB_ACCOUNTS_TABLE_NAME'))
+  try:
+    items = dynamo_db_manager_account.batch_get_items([{'id': account_id} for account_id in missing], workers=4)
+    found = {item['id']: item.get('email') for item in items}
+    for account_id in missing:
+      account_emails.put(account_id, found.get(account_id, MISSING))
+    emails.update(found)
+  except Exception as e:
+    logging.error(f"Error retrieving emails for {len(missing)} accounts: {e}")
+  return emails
+
+def summary_figures(summary):
+  """Formats the figures of one file's summary of an account for the email."""
+  overall_averages = summary.overall_averages()
+  return {
+    'total_balance': "{:.2f}".format(summary.balance),
+    'average_credit': "{:.2f}".format(overall_averages['average_credit']),
+    'average_debit': "{:.2f}".format(overall_averages['average_debit']),
+    'transactions_by_month': summary.transactions_by_month()
+  }
+
+def ses_template_data(email_data):
+  """Converts the email figures to the data of the SES template, whose
+  Handlebars loops need a list instead of a dict."""
+  data = dict(email_data)
+  data['transactions_by_month'] = [{'month': month, 'count': count} for month, count in email_data['transactions_by_month'].items()]
+  return data
+
+def lifetime_figures(aggregate):
+  """Formats the lifetime balance and averages of a running aggregate item."""
+  average_credit = aggregate['credit_total'] / aggregate['credit_count'] if aggregate['credit_count'] else 0
+  average_debit = aggregate['debit_total'] / aggregate['debit_count'] if aggregate['debit_count'] else 0
+  return {
+    'lifetime_balance': "{:.2f}".format(aggregate['balance']),
+    'lifetime_average_credit': "{:.2f}".format(average_credit),
+    'lifetime_average_debit': "{:.2f}".format(average_debit)
+  }
+
+def object_version_id(record):
+  """Identifies one version of an uploaded object, so a re-upload with new
+  content is processed again but a redelivered event is not."""
+  bucket_name = record['s3']['bucket']['name']
+  file_key = record['s3']['object']['key']
+  etag = record['s3']['object'].get('eTag')
+  if not etag:
+    etag = get_client('s3').head_object(Bucket=bucket_name, Key=file_key)['ETag'].strip('"')
+  return f"{bucket_name}/{file_key}#{etag}"
+
 def lambda_handler(event, context):
 
   
   running_type = event.get('running_type', 'prod')
-  # Load the Jinja2 template
-  email_template_str = """<!DOCTYPE html>
-  <html lang="en">
-  <head>
-      <meta charset="UTF-8">
-      <title>Transaction Summary</title>
-      <style>
-          body {
-              font-family: Arial, sans-serif;
-              margin: 0;
-              padding: 20px;
-              color: #333;
-          }
-          .summary-header {
-              background-color: #f0f0f0;
-              padding: 10px;
-              text-align: center;
-          }
-      </style>
-  </head>
-  <body>
-      <div class="summary-header">
-          <!-- <img src="data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAQ0AAAC7CAMAAABIKDvmAAABO1BMVEX///84SWe9/6Fo8uv/lNcdNVkmO13Bxczv8PIzRWSErPOwbuUtQGG/w8q5/5sVMFZkb4TLztQgN1pyfI8pPV8wQ2O4/5r/kNb5+frj5ehcaH//itQUL1aXnquyt8Dd3+NYZHx5gpOKkaDy/+2Smabh/9WrsLv/q9//l9ZW8el6pvJm9urQ+vju/+fo/99pdIgAJ1Fg8fBFVG/R/77Y/8hLWXOvXur/4vPD+faa9vHz/v2o9/KF9O7y8f605fXU4fqZtvVk2ey0zPdp6Ox3z+99rep+o/qPveWAufJ5yvDk/Puf1NCo4MS7+qaf7sZ39eCb+cPT/8LJ/7L2pM/e0Lz/z+ziyr+776uwfeCvZuezmdW40bv/pNyvW+u756/cg960q8zqitvNpe7ZvPHKeuHt3/jlzPP/wuf87/l3cCNnAAAH4klEQVR4nO2a/3/SRhjHE2gi0ZBASNpASaBIaenUKoq12k23+WVzc5t1Tru57276//8FS3KXcEkuQCV5Ae7z/qmQu6d3H5577p7nIggAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA8uPO8cnxnbvLHsVK8PR4WPYZ3lv2SJbO3TtlooUvx8ni9ga1Vt9e3EwMp9Zy8rbJ48rJMNIiF+/oGpZiyrkO3VZM32YlT5scPv3sBitFIMeCsaPSFj2MC/kMkNBQfZtKN0+bKe4/+PyTcoo7ixmtSP7I5VzV0MWAdnFr5dMvDg6+5IhRPl7MbhFqyFSNPG2y3H9w4InB0WIl1XAM36a5k6fNCN8tLl68+JDnGeXygmG0CDWEhqSqRjdXk5TKA18KD74YwysLmi9CDaHe71fztUjYfUS0uPiQK0a5vKD9YtQoiKubj4kYB3wtFnWN9VKjpD0hC+Ur7kIZLri/rpca17RS6VEgx9ccNYYnT89hq1J1dmqtWqM3qDMHAaKG6tQjUr0aNa+T20xbtOuRJbvaO2y1Woed6EkBJ9GbJY9v/C0lFTaG5Xvn0cId67JqWYpiqaast9zwe6KGqMohUo3pVa/5vRRFUU1pNEiabBtGOwiWds9r5rVSrHYggqt7T3ofPOsstFLAt08eP0y6xbkCRmVsKCKDIhtUD6oGgx55QaUlWcwDWY2tJ/t6eMSqy2rYxnSiJ3rCyxZnk6hR0p599/2NG4xbnC87aUqKmKRN5EirYVBvF6q6lXgksQcq0lOyPR+ZtFD7QmGx6HKohi9I6YdAkOHw+Lz7iE2Pyl5eacgm/R2tBjMnUbEidNrL0VMKimZ3YpWqIVQZMYhDFKWGVmLxBTn5gF2kFvzGlt5wvSBZ7Y8kXxCZ9Q2lexhBXcOhTqOohiQZJnUuaxxZJT2NJhFNlb1m0vXe5EmhvhFy6+p5rdTJttGKonyzJ8nyiPxNR55a4xeoZ5iKU29WOm6XLjb1MGwR6qgEWvS8VpWKzdrMfdfmqKFp2s1r5zLS8F3DasW+c8PSVMbIbeoZerSR1C0SRcLwG60xv1U/1rkoNbS0GoEgm6e788dRsr4z9v+Mke+QqUudyVf2mHiHEdMxChazbS7MKVeNQJHNZ7uX57LR9MdmZaXX/JHTYBCfph34AdlEBUYNvRPvXJgau3znCAWZK4jU/WqDmjw6hfBH7gQbjxpfAEKHaGSxPb2+KdOFnfanqUGDyCxBiBpOxlP+yIkXyMnGZP3Q5RPGjXGyVXFq3JohxxyCdAxxSsmWO/KKznMNako0B0xPznZUYCY4U41AkNKtbAu2zvfnKSMP3Ik3z+AYp/aYnmkHKlKNa5xNlhtDdjNNtAK3l/hZFHfkF4JZS+m0NThcxE6x9MNsm/kwe61QPU6zLNRpmmo4nKx8mhrpTbnmq6GwavDCc5E1k+fzeYd3bs86gjRMEv1VadRPev+iaphuqlGxFaTdOeUolbIstMzwoKTKes1lb30WVUPmVIOLraddfjbnaslcLD0mObdMvTE5L62fGl4sfbY51+aSGUo7Nd2c1DgsPQqp66iG5x+3SnMIomUbqAy6uhx5iBkmceuphjCXINqUc4df8d0xwopgmJmvrRqCL8isJTPLQv2QFioMttqznmp4XN493dQyFdmcndd2RqQWqAaf1lwNn2s3tQxBsuMoA3nbxAiOHvyTeaCGkczUBWEUxGBSHVgZNTyu8oOI9nyezkHdhqS13JGT7Cw9UZteRQlMz5VQQwiCSFqPzCMHS7ASSIbBn1OQ6CmpFKQqM9NcMTWEo70XP55qH6BGMFwl2GTJz20msg1SZdeTeQ2pBeqxWvBqqGG/3N/e2trafvHTK+28atgTNUjVNFkoJE6gxCvLwoB8G9+bV0GNo73trY0AT5A3E0G0m+m2yYtmQWgak4VA8/3EG2tk25Fj9Z46KQSGleNVUcN+uRFqQRU5e10lMYSzpzhtPRkA+uokGJISqFKLt3ANcihhiiJUDCu8UFkNNSZuEbF/6dLZ7Z9f+WqkioJ225u4GHMPUvAgO2xYHrfEQadie9A2LXKIN7uhJ/TodVN4gbASarzc2t5I4anh6/ELL1Ehu6Uxrkaz6NN50c8kYpIbRklqj0jotFVyZFWkcd91nUOdXt+2I11XQI03HC28lXIp4NffOAvFJpfGiqx3d/pOf2dM5xXdlVTit88WVakZZjSKappqmO61J8Wd5auxl1wjhN+JGmd/8NKU6A5dsVRVtegcjUmArLOX7JNyaFNNvrAgKm1m7ktX44jrGWSh+GpUuVkK87JJROzmtCPKzPsdepie2C0j3km12LM68SmDp0bmk1zZ44qx8SfR4uyvrH6OxE5XtAwxsekORMn03UZRRJPZXVyT6acm7p6Fruy/AcV7mTz7SZ5McY2zS39P++9uw5Bk00eWpAbHhztu73A88ujFzLhd3SC9Rk4qpXXGidZzPMkPm6vG/lvfLf6Z2btZdweDgVvnXCNM/ad+N7eIV/wWhafG/tvbr6e6xUfLPmdzfTuHW3ycvEtssF6K8u+yx7REYmpsb717v+wBLZX32xO32Dta9miWzvt9P2XzcpX/uVuEHL3b23sHtwAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAABYV/4D45ysX1tqUQsAAAAASUVORK5CYII=" class="logo" alt="Stori Logo" /> -->
-          <!-- data:image/svg+xml;base64,PHN2ZyB3aWR0aD0iMTU0IiBoZWlnaHQ9IjQ4IiB2aWV3Qm94PSIwIDAgMTU0IDQ4IiBmaWxsPSJub25lIiB4bWxucz0iaHR0cDovL3d3dy53My5vcmcvMjAwMC9zdmciPgo8cGF0aCBkPSJNNTQuOTc5MiAzNi44MjQxQzU0Ljk3OTIgMzYuMjUzNiA1NS4xMzQ5IDM1LjczNDggNTUuNDk4IDM1LjIxNjFDNTUuODYxIDM0LjY5NzQgNTYuMjc2IDM0LjQzODEgNTYuNzk0NyAzNC40MzgxQzU3LjE1NzggMzQuNDM4MSA1Ny42MjQ2IDM0LjY5NzQgNTguMjQ3MSAzNS4yMTYxQzU4Ljg2OTUgMzUuNzM0OCA1OS44MDMyIDM2LjI1MzYgNjAuOTk2MiAzNi43NzIzQzYyLjE4OTMgMzcuMjkxIDYzLjU4OTggMzcuNTUwMyA2NS4xOTc3IDM3LjU1MDNDNjcuMzI0NCAzNy41NTAzIDY4Ljg4MDYgMzcuMTg3MiA2OS44MTQyIDM2LjQwOTJDNzAuNzQ3OSAzNS42MzExIDcxLjI2NjYgMzQuNjQ1NiA3MS4yNjY2IDMzLjUwNDRDNzEuMjY2NiAzMi4xMDM5IDcwLjc0NzkgMzAuOTYyOCA2OS42NTg2IDMwLjEzMjhDNjguNTY5MyAyOS4zMDI5IDY3LjI3MjYgMjguNjgwNSA2NS43NjgzIDI4LjIxMzZDNjQuMjEyMiAyNy43OTg3IDYyLjcwOCAyNy4zMzE4IDYxLjE1MTggMjYuODEzMUM1OS41OTU3IDI2LjI5NDQgNTguMjk5IDI1LjQxMjYgNTcuMjYxNiAyNC4yMTk2QzU2LjIyNDEgMjMuMDI2NiA1NS42NTM2IDIxLjQxODYgNTUuNjUzNiAxOS40NDc1QzU1LjY1MzYgMTcuMDYxNSA1Ni41MzU0IDE0Ljk4NjYgNTguMjQ3MSAxMy4yMjNDNTkuOTU4OCAxMS40NTk0IDYyLjYwNDIgMTAuNTc3NiA2Ni4xMzE0IDEwLjU3NzZDNjguMzYxOCAxMC41Nzc2IDcwLjQzNjcgMTAuOTQwNyA3Mi4zMDQgMTEuNjE1Qzc0LjE3MTQgMTIuMjg5NCA3NS4xMDUgMTMuMDY3NCA3NS4xMDUgMTMuOTQ5MkM3NS4xMDUgMTQuNDY3OSA3NC44OTc1IDE1LjAzODUgNzQuNDgyNiAxNS42NjFDNzQuMDY3NiAxNi4yODM0IDczLjYwMDggMTYuNTk0NiA3Mi45NzgzIDE2LjU5NDZDNzIuODIyNyAxNi41OTQ2IDcxLjk5MjggMTYuMjgzNCA3MC41NDA0IDE1LjY2MUM2OS4wODggMTUuMDM4NSA2Ny42MzU3IDE0LjcyNzMgNjYuMTgzMyAxNC43MjczQzY0LjIxMjIgMTQuNzI3MyA2Mi43NTk4IDE1LjE5NDEgNjEuODI2MiAxNi4xMjc4QzYwLjg5MjUgMTcuMDYxNSA2MC4zNzM4IDE4LjA5ODkgNjAuMzczOCAxOS4yNEM2MC4zNzM4IDIwLjQzMyA2MC44OTI1IDIxLjM2NjcgNjEuOTgxOCAyMi4wOTI5QzYzLjAxOTIgMjIuNzY3MiA2NC4zNjc4IDIzLjMzNzggNjUuOTIzOSAyMy43MDA5QzY3LjQ4IDI0LjA2NCA2OS4wMzYyIDI0LjU4MjcgNzAuNTQwNCAyNS4xMDE0QzcyLjA5NjUgMjUuNjcyIDczLjM5MzMgMjYuNjA1NiA3NC40MzA3IDI3Ljk1NDNDNzUuNDY4MSAyOS4zMDI5IDc2LjAzODcgMzEuMDY2NSA3Ni4wMzg3IDMzLjE5MzJDNzYuMDM4NyAzNS43ODY3IDc1LjEwNSAzNy44NjE1IDczLjIzNzcgMzkuMzY1OEM3MS4zNzAzIDQwLjg3IDY4LjcyNDkgNDEuNjQ4MSA2NS40MDUyIDQxLjY0ODFDNjIuNTAwNSA0MS42NDgxIDYwLjA2MjYgNDEuMTI5NCA1Ny45ODc3IDQwLjA5MkM1NS45NjQ4IDM5LjA1NDYgNTQuOTc5MiAzNy45NjUzIDU0Ljk3OTIgMzYuODI0MVoiIGZpbGw9IiMzODQ5NjciLz4KPHBhdGggZD0iTTgwLjEzNjQgMzEuNTMzM1YzLjQxOTQ3QzgwLjEzNjQgMi45MDA3NyA4MC4zOTU3IDIuNDg1OCA4MC45NjYzIDIuMTIyNzFDODEuNTM2OSAxLjc1OTYyIDgyLjEwNzQgMS42MDQgODIuNzI5OSAxLjYwNEM4My40MDQyIDEuNjA0IDg0LjAyNjYgMS44MTE0OSA4NC41OTcyIDIuMTIyNzFDODUuMTY3OCAyLjQ4NTggODUuNDI3MSAyLjkwMDc3IDg1LjQyNzEgMy40MTk0N1YxMC44ODg4SDkzLjQ2NzFDOTMuOTMzOSAxMC44ODg4IDk0LjI5NyAxMS4wOTYzIDk0LjYwODIgMTEuNTExM0M5NC45MTk1IDExLjkyNjIgOTUuMDc1MSAxMi40NDQ5IDk1LjA3NTEgMTIuOTYzN0M5NS4wNzUxIDEzLjUzNDIgOTQuOTE5NSAxNC4wMDExIDk0LjYwODIgMTQuNDE2Qzk0LjI5NyAxNC44MzEgOTMuOTMzOSAxNS4wMzg1IDkzLjQ2NzEgMTUuMDM4NUg4NS40MjcxVjMxLjM3NzdDODUuNDI3MSAzMy4xOTMyIDg1Ljg0MjEgMzQuNDg5OSA4Ni42MjAyIDM1LjIxNjFDODcuMzk4MiAzNS45NDIzIDg4Ljc5ODcgMzYuMzA1NCA5MC43MTc5IDM2LjMwNTRIOTIuNjg5QzkzLjQxNTIgMzYuMzA1NCA5My45ODU4IDM2LjUxMjkgOTQuNDAwOCAzNi45Nzk3Qzk0LjgxNTcgMzcuNDQ2NiA5NS4wMjMyIDM4LjAxNzEgOTUuMDIzMiAzOC42OTE0Qzk1LjAyMzIgMzkuMzY1OCA5NC44MTU3IDM5LjkzNjMgOTQuNDAwOCA0MC40MDMyQzkzLjk4NTggNDAuODcgOTMuNDE1MiA0MS4xMjk0IDkyLjc0MDkgNDEuMTI5NEg5MC43Njk4QzgzLjY2MzUgNDEuMTgxMiA4MC4xMzY0IDM3Ljk2NTMgODAuMTM2NCAzMS41MzMzWiIgZmlsbD0iIzM4NDk2NyIvPgo8cGF0aCBkPSJNOTYuOTQyNCAyOS4zMDNWMjIuNzY3M0M5Ni45NDI0IDE5LjQ5OTUgOTguMTg3MyAxNi42NDY2IDEwMC42NzcgMTQuMjA4N0MxMDMuMTY3IDExLjc3MDggMTA2LjEyMyAxMC41MjU5IDEwOS40OTUgMTAuNTI1OUMxMTIuODY3IDEwLjUyNTkgMTE1Ljg3NSAxMS43MTg5IDExOC4zNjUgMTQuMTU2OEMxMjAuODU1IDE2LjU5NDcgMTIyLjE1MSAxOS40NDc2IDEyMi4xNTEgMjIuNzY3M1YyOS4zMDNDMTIyLjE1MSAzMi41MTkgMTIwLjkwNyAzNS40MjM3IDExOC4zNjUgMzcuOTEzNUMxMTUuODIzIDQwLjQwMzMgMTEyLjg2NyA0MS43MDAxIDEwOS41NDcgNDEuNzAwMUMxMDYuMTc1IDQxLjcwMDEgMTAzLjI3MSA0MC40NTUyIDEwMC43MjkgMzcuOTY1NEM5OC4xODczIDM1LjQyMzcgOTYuOTQyNCAzMi41NzA5IDk2Ljk0MjQgMjkuMzAzWk0xMDIuMjMzIDI5LjI1MTFDMTAyLjIzMyAzMS4yMjIyIDEwMi45NTkgMzIuOTg1OCAxMDQuNDEyIDM0LjU0MTlDMTA1Ljg2NCAzNi4wNDYyIDEwNy41NzYgMzYuODI0MiAxMDkuNDk1IDM2LjgyNDJDMTExLjUxOCAzNi44MjQyIDExMy4yMyAzNi4wNDYyIDExNC42ODIgMzQuNDkwMUMxMTYuMTM0IDMyLjkzNCAxMTYuODYxIDMxLjIyMjIgMTE2Ljg2MSAyOS4yNTExVjIyLjgxOTJDMTE2Ljg2MSAyMC45IDExNi4xMzQgMTkuMTg4MyAxMTQuNjgyIDE3LjY4NEMxMTMuMjMgMTYuMTc5OCAxMTEuNTE4IDE1LjQwMTcgMTA5LjQ5NSAxNS40MDE3QzEwNy40NzIgMTUuNDAxNyAxMDUuNzYgMTYuMTc5OCAxMDQuMzYgMTcuNjg0QzEwMi45MDcgMTkuMTg4MyAxMDIuMjMzIDIwLjkgMTAyLjIzMyAyMi44MTkyVjI5LjI1MTFaIiBmaWxsPSIjMzg0OTY3Ii8+CjxwYXRoIGQ9Ik0xMjcuMTMxIDM5LjI2MjJWMTIuNzU2M0MxMjcuMTMxIDEyLjE4NTcgMTI3LjM5IDExLjc3MDggMTI3Ljg1NyAxMS40MDc3QzEyOC4zMjQgMTEuMDQ0NiAxMjguOTk4IDEwLjg4OSAxMjkuNzI1IDEwLjg4OUMxMzAuMzk5IDEwLjg4OSAxMzAuOTcgMTEuMDQ0NiAxMzEuNDM2IDExLjQwNzdDMTMxLjkwMyAxMS43NzA4IDEzMi4xNjMgMTIuMTg1NyAxMzIuMTYzIDEyLjc1NjNWMTUuODE2N0MxMzIuOTQxIDE0LjM2NDMgMTM0LjAzIDEzLjExOTQgMTM1LjUzNCAxMi4wODJDMTM3LjAzOCAxMS4wNDQ2IDEzOC42OTggMTAuNTI1OSAxNDAuNTE0IDEwLjUyNTlIMTQyLjY5MkMxNDMuMjYzIDEwLjUyNTkgMTQzLjczIDEwLjc4NTIgMTQ0LjE0NSAxMS4yNTIxQzE0NC41NiAxMS43NzA4IDE0NC43NjcgMTIuMzQxMyAxNDQuNzY3IDEyLjk2MzhDMTQ0Ljc2NyAxMy41ODYyIDE0NC41NiAxNC4xNTY4IDE0NC4xNDUgMTQuNjIzN0MxNDMuNzMgMTUuMDkwNSAxNDMuMjYzIDE1LjM0OTggMTQyLjY5MiAxNS4zNDk4SDE0MC41MTRDMTM4LjMzNSAxNS4zNDk4IDEzNi40NjggMTYuMjMxNiAxMzQuODYgMTcuOTQzNEMxMzMuMjUyIDE5LjcwNyAxMzIuNDIyIDIxLjkzNzQgMTMyLjQyMiAyNC42ODY1VjM5LjIxMDNDMTMyLjQyMiAzOS42NzcxIDEzMi4xNjMgNDAuMDkyMSAxMzEuNjQ0IDQwLjUwNzFDMTMxLjEyNSA0MC45MjIgMTMwLjUwMyA0MS4xMjk1IDEyOS43NzcgNDEuMTI5NUMxMjkuMDUgNDEuMTI5NSAxMjguNDI4IDQwLjkyMiAxMjcuOTA5IDQwLjU1ODlDMTI3LjMzOSA0MC4xOTU4IDEyNy4xMzEgMzkuNzI5IDEyNy4xMzEgMzkuMjYyMloiIGZpbGw9IiMzODQ5NjciLz4KPHBhdGggZD0iTTE0OC40NSA2LjY4NzQzQzE0Ny43NzYgNi4wNjQ5OCAxNDcuNDY0IDUuMzM4OCAxNDcuNDY0IDQuNTYwNzRDMTQ3LjQ2NCAzLjczMDgxIDE0Ny43NzYgMy4wNTY0OSAxNDguMzk4IDIuNDM0MDVDMTQ5LjAyIDEuODYzNDcgMTQ5Ljc5OSAxLjU1MjI1IDE1MC43ODQgMS41NTIyNUMxNTEuNjY2IDEuNTUyMjUgMTUyLjQ0NCAxLjg2MzQ3IDE1My4wNjYgMi40MzQwNUMxNTMuNjg5IDMuMDA0NjIgMTU0IDMuNzMwODEgMTU0IDQuNTYwNzRDMTU0IDUuMzkwNjcgMTUzLjY4OSA2LjA2NDk4IDE1My4wNjYgNi42ODc0M0MxNTIuNDQ0IDcuMzA5ODggMTUxLjY2NiA3LjYyMTEgMTUwLjc4NCA3LjYyMTFDMTQ5LjkwMiA3LjYyMTEgMTQ5LjEyNCA3LjMwOTg4IDE0OC40NSA2LjY4NzQzWk0xNDguMTM5IDM5LjI2MjFWMTIuNzU2M0MxNDguMTM5IDEyLjE4NTcgMTQ4LjM5OCAxMS43NzA3IDE0OC45MTcgMTEuNDA3NkMxNDkuNDM1IDExLjA0NDYgMTUwLjA1OCAxMC44ODg5IDE1MC43ODQgMTAuODg4OUMxNTEuNTYyIDEwLjg4ODkgMTUyLjE4NSAxMS4wNDQ2IDE1Mi43MDMgMTEuNDA3NkMxNTMuMjIyIDExLjc3MDcgMTUzLjQ4MSAxMi4xODU3IDE1My40ODEgMTIuNzU2M1YzOS4yNjIxQzE1My40ODEgMzkuNzI5IDE1My4yMjIgNDAuMTQzOSAxNTIuNzAzIDQwLjU1ODlDMTUyLjE4NSA0MC45NzM5IDE1MS41NjIgNDEuMTgxMyAxNTAuODM2IDQxLjE4MTNDMTUwLjExIDQxLjE4MTMgMTQ5LjQ4NyA0MC45NzM5IDE0OC45NjkgNDAuNjEwOEMxNDguMzk4IDQwLjE5NTggMTQ4LjEzOSAzOS43MjkgMTQ4LjEzOSAzOS4yNjIxWiIgZmlsbD0iIzM4NDk2NyIvPgo8cGF0aCBkPSJNMjguNjI4OSAzLjYyNzAyQzI5Ljc3MDEgNi41ODM2NCAyOC4zMTc3IDkuOTU1MjIgMjUuMzYxMSAxMS4wOTY0TDguNDUxMjcgMTcuNzg3N0M1LjQ5NDY1IDE4LjkyODggMi4xNzQ5MyAxNy40NzY1IDAuOTgxOTExIDE0LjUxOThDLTAuMjExMTExIDExLjU2MzIgMS4yOTMxMyA4LjE5MTYzIDQuMjQ5NzYgNy4wNTA0N0wyMS4xNTk2IDAuNDExMDQzQzI0LjExNjIgLTAuNzgxOTc5IDI3LjQ4NzggMC43MjIyNjYgMjguNjI4OSAzLjYyNzAyWiIgZmlsbD0iIzAwRjVFQiIvPgo8cGF0aCBkPSJNMTIuNTQ5MSA0My45MzA1QzExLjQwNzkgNDAuOTczOCAxMi44NjAzIDM3LjYwMjMgMTUuODE2OSAzNi40NjExTDMyLjcyNjcgMjkuODIxN0MzNS42ODM0IDI4LjY4MDUgMzkuMDU1IDMwLjEzMjkgNDAuMTk2MSAzMy4wODk1QzQxLjMzNzMgMzYuMDQ2MSAzOS44ODQ5IDM5LjQxNzcgMzYuOTI4MyA0MC41NTg5TDIwLjAxODUgNDcuMTQ2NEMxNy4xMTM3IDQ4LjMzOTUgMTMuNzQyMSA0Ni44MzUyIDEyLjU0OTEgNDMuOTMwNVoiIGZpbGw9IiNGRjhDRDkiLz4KPHBhdGggZD0iTTAuOTgxODM5IDE0LjUxOTlDMi4xMjI5OSAxNy40NzY1IDUuNDk0NTggMTguOTI4OSA4LjQ1MTIgMTcuNzg3N0w5Ljg1MTcgMTcuMjY5QzkuNjQ0MjIgMTYuOTA1OSA5LjQzNjc0IDE2LjQ5MDkgOS4yODExMyAxNi4wNzZDNy4yMDYzMSAxMC43ODUyIDkuNzk5ODMgNC44NzE5NCAxNS4wMzg4IDIuNzk3MTJMNC4yNDk2OCA3LjA1MDVDMS4yOTMwNiA4LjE5MTY2IC0wLjE1OTMxMyAxMS41NjMyIDAuOTgxODM5IDE0LjUxOTlaIiBmaWxsPSIjNzhBQ0Y4Ii8+CjxwYXRoIGQ9Ik0zMS45NDg3IDMxLjUzMzVDMzQuMDIzNSAzNi43NzI0IDMxLjQzIDQyLjczNzYgMjYuMTkxIDQ0Ljc2MDVMMzYuOTgwMSA0MC41MDcxQzM5LjkzNjcgMzkuMzY2IDQxLjM4OTEgMzUuOTk0NCA0MC4yNDggMzMuMDM3OEMzOS4xMDY4IDMwLjA4MTEgMzUuNzM1MiAyOC42Mjg4IDMyLjc3ODYgMjkuNzY5OUwzMS4zNzgxIDMwLjI4ODZDMzEuNTg1NiAzMC43MDM2IDMxLjc5MzEgMzEuMTE4NiAzMS45NDg3IDMxLjUzMzVaIiBmaWxsPSIjQkE2QkVCIi8+CjxwYXRoIGQ9Ik00MC4wOTIzIDI3LjUzOTNDMzguNjkxOCAyNC42ODY0IDM3LjE4NzYgMjMuMjg1OSAzNC42OTc4IDIxLjc4MTdDMzMuMjk3MyAyMC45NTE3IDI3LjU5MTUgMTkuMTM2MyAyMS41NzQ1IDE3LjMyMDhDMTQuNTcyIDE1LjE0MjIgNi42ODc2OCAxMi42NTI0IDUuMTgzNDMgMTEuOTI2M0MyLjMzMDU1IDEwLjYyOTUgMi4wNzEyIDguOTE3NzYgMy4wMDQ4NyA3Ljc3NjYxQy0wLjI2Mjk3NCA5Ljc5OTU2IC0wLjgzMzU1IDE2LjA3NTkgMS4xMzc1MyAyMC4xMjE4QzIuNTM4MDQgMjIuOTc0NyA0LjA0MjI4IDI0LjM3NTIgNi41MzIwNyAyNS44Nzk0QzcuOTMyNTcgMjYuNzA5NCAxMy42MzgzIDI4LjUyNDggMTkuNjU1MyAzMC4zNDAzQzI2LjY1NzggMzIuNTE4OSAzNC41NDIyIDM1LjA2MDUgMzYuMDQ2NCAzNS43MzQ4QzM4Ljg5OTMgMzcuMDMxNiAzOS4xNTg2IDM4Ljc0MzMgMzguMjI1IDM5Ljg4NDVDNDEuNDkyOCAzNy44NjE1IDQyLjA2MzQgMzEuNTg1MiA0MC4wOTIzIDI3LjUzOTNaIiBmaWxsPSIjQTlGRjk1Ii8+Cjwvc3ZnPgo= -->
-          <img src='https://finnovating.s3.eu-central-1.amazonaws.com/companies/company_26535/main_logo_26535.png' alt="logo"/>
-          <h1>Transaction Summary</h1>
-      </div>
-      <p>Total Balance: {{total_balance}}</p>
-      <p>Average credit amount: {{average_credit}}</p>
-      <p>Average debit amount: {{average_debit}}</p>
-      {{monthly_summaries}}
-
-      <!-- Add more placeholders and dynamic content as needed -->
-  </body>
-  </html>
-  """
-  template = Template(email_template_str)
+  # Per-stage timings are emitted as one metrics record per invocation when
+  # METRICS_ENABLED is set; otherwise the stage wrappers below are no-ops
+  metrics = Metrics.from_env(dimensions={'FunctionName': getattr(context, 'function_name', 'process_transactions')})
+  try:
+    with metrics.stage('invocation'):
+      return handle_event(event, running_type, metrics)
+  finally:
+    metrics.emit()
+
+def s3_records(event):
+  """Returns (message id, S3 record) pairs for every uploaded object of an
+  S3 event, or of the S3 notifications carried by an SQS batch (message id
+  None for direct S3 records), and the ids of SQS messages that could not
+  be read."""
+  records, unreadable = [], []
+  for record in event.get('Records', []):
+    if 's3' in record:
+      records.append((None, record))
+      continue
+    try:
+      body = json.loads(record['body'])
+      records.extend((record['messageId'], s3_record) for s3_record in body.get('Records', []))
+    except (KeyError, TypeError, ValueError) as e:
+      logging.error(f"Unreadable message {record.get('messageId')}: {e}")
+      unreadable.append(record.get('messageId'))
+  return records, unreadable
+
+def handle_event(event, running_type, metrics):
+  records, unreadable = s3_records(event)
+  ingest_mode = event.get('ingest_mode', os.getenv('INGEST_MODE', 'stream'))
+  # The files of an event are processed on up to RECORD_WORKERS threads,
+  # each with its own metrics added to the invocation's afterwards (so stage
+  # times are summed over the files). The parallel mode forks worker
+  # processes, which is not safe from several threads, so it goes one file
+  # at a time.
+  workers = 1 if ingest_mode == 'parallel' else int(os.getenv('RECORD_WORKERS', 4))
+  # one send rate for every file of the invocation, however many run at once
+  email_bucket = TokenBucket(float(os.getenv('EMAIL_SEND_RATE', 14)))
+
+  def handle(record, record_metrics):
+    try:
+      return handle_record(event, record, running_type, record_metrics, email_bucket)
+    except Exception as e:
+      logging.error(f"Error processing {record['s3']['object']['key']}", exc_info=e)
+      return e
+
+  if len(records) <= 1 or workers <= 1:
+    outcomes = [handle(record, metrics) for _, record in records]
+  else:
+    children = [metrics.child() for _ in records]
+    with ThreadPoolExecutor(max_workers=min(workers, len(records))) as executor:
+      outcomes = list(executor.map(handle, [record for _, record in records], children))
+    for child in children:
+      metrics.merge(child)
+
+  failed_messages = set(unreadable)
+  for (message_id, _), outcome in zip(records, outcomes):
+    if isinstance(outcome, Exception):
+      if message_id is None:
+        # direct S3 invocations have no partial failures: fail the event and
+        # let the retry skip the files the manifest marks as processed
+        raise outcome
+      failed_messages.add(message_id)
+
+  if len(outcomes) == 1 and not failed_messages:
+    response = outcomes[0]
+  else:
+    processed = sum(1 for outcome in outcomes if not isinstance(outcome, Exception))
+    response = {'statusCode': 200, 'body': f'Processed {processed} of {len(outcomes)} files.'}
+  # SQS partial batch response: only the failed messages are delivered again
+  response['batchItemFailures'] = [{'itemIdentifier': message_id} for message_id in sorted(failed_messages)]
+  return response
+
+def handle_record(event, record, running_type, metrics, email_bucket=None):
   # Create an instance of the DynamoDBManager
   dynamo_db_manager = DynamoDBManager(os.getenv('DYNAMODB_TRANSACTIONS_TABLE_NAME'))  
-  # Extract bucket name and file key from the Lambda event
-  bucket_name = event['Records'][0]['s3']['bucket']['name']
-  file_key = event['Records'][0]['s3']['object']['key']
+  # Extract bucket name and file key from the S3 record
+  bucket_name = record['s3']['bucket']['name']
+  file_key = record['s3']['object']['key']
+
+  # In prod each object version is claimed in the manifest table first, so a
+  # redelivered S3 event does not save the rows or send the emails twice
+  manifest_table_name = os.getenv('DYNAMODB_MANIFEST_TABLE_NAME')
+  manifest_manager = DynamoDBManager(manifest_table_name) if running_type == 'prod' and manifest_table_name else None
+  # the object version also marks the aggregate items the file was added to,
+  # so a retry of the file does not add it twice
+  object_id = object_version_id(record) if running_type == 'prod' else None
+  if manifest_manager:
+    with metrics.stage('claim_file'):
+      claimed = manifest_manager.claim_processing(object_id)
+    if not claimed:
+      return {
+          'statusCode': 200,
+          'body': f'File {file_key} was already processed.'
+      }
+  try:
+    response = process_file(event, running_type, dynamo_db_manager, bucket_name, file_key, metrics,
+                            object_size=record['s3']['object'].get('size'), email_bucket=email_bucket,
+                            file_id=object_id)
+  except Exception:
+    if manifest_manager:
+      # release the claim so a retry can process the file
+      manifest_manager.delete_item({'id': object_id})
+    raise
+  if manifest_manager:
+    manifest_manager.mark_processed(object_id)
+  return response
+
+def process_file(event, running_type, dynamo_db_manager, bucket_name, file_key, metrics, object_size=None,
+                 email_bucket=None, file_id=None):
+  ingest_mode = event.get('ingest_mode', os.getenv('INGEST_MODE', 'stream'))
+  aggregation_backend = event.get('aggregation_backend', os.getenv('AGGREGATION_BACKEND', 'python'))
+  # Files larger than SPILL_THRESHOLD_BYTES (the size comes with the S3
+  # event) are grouped on disk: the rows are partitioned by account into
+  # temp files that are summarized and emailed one partition at a time, so
+  # memory no longer grows with the number of accounts of the file
+  if ingest_mode == 'stream' and object_size and object_size > int(os.getenv('SPILL_THRESHOLD_BYTES', 256 * 1024 * 1024)):
+    ingest_mode = 'partitioned'
+  spill = None
+  if ingest_mode == 'partitioned':
+    from partitioned_ingest import DEFAULT_PARTITIONS, PartitionSpill
+    spill = PartitionSpill(int(os.getenv('SPILL_PARTITIONS', DEFAULT_PARTITIONS)), os.getenv('SPILL_DIR'))
+  try:
+    return ingest_file(ingest_mode, aggregation_backend, running_type, dynamo_db_manager, bucket_name, file_key,
+                       metrics, spill, email_bucket, file_id)
+  finally:
+    if spill:
+      spill.close()
+
+def ingest_file(ingest_mode, aggregation_backend, running_type, dynamo_db_manager, bucket_name, file_key, metrics, spill,
+                email_bucket=None, file_id=None):
+  writer = None
+  index = None
+  index_table_name = os.getenv('DYNAMODB_TRANSACTION_INDEX_TABLE_NAME')
+  if running_type == 'prod' and index_table_name:
+    from transaction_index import TransactionIndex
+    index = TransactionIndex(DynamoDBManager(index_table_name), dynamo_db_manager)
+  # The ingest modules (and numpy, multiprocessing) are imported by the
+  # branch that uses them, so a cold start only loads what the event needs
+  if ingest_mode == 'parallel':
+    # Parse byte ranges of the object in worker processes; in prod each worker
+    # also saves its own rows, so only per-account summaries come back (and,
+    # with a transaction index, the ids the worker found new)
+    from parallel_ingest import summarize_s3_file_parallel
+    workers = int(os.getenv('INGEST_WORKERS', 0)) or None
+    table_name = os.getenv('DYNAMODB_TRANSACTIONS_TABLE_NAME') if running_type == 'prod' else None
+    with metrics.stage('parallel_ingest'):
+      account_summaries = summarize_s3_file_parallel(bucket_name, file_key, workers=workers, table_name=table_name,
+                                                     backend=aggregation_backend, index=index)
+  elif spill and (running_type != 'prod' or index):
+    # With a transaction index the rows are deduplicated and saved one
+    # partition at a time (see saved_partitions), so only the index filters
+    # of one partition's accounts are in memory
+    lines = metrics.timed('s3_read', stream_s3_file(bucket_name, file_key))
+    with metrics.stage('partition'):
+      for transaction in iter_transactions(lines):
+        spill.add(transaction)
+  elif running_type == 'prod':
+    # Stream the file from S3 and summarize each row while a background stage
+    # saves it, so no per-account row lists are kept in memory and the writes
+    # overlap the parsing instead of following it. The read, parse
+    # and aggregate stages run interleaved, each one is charged the time
+    # spent producing its rows
+    account_summaries = {}
+    lines = metrics.timed('s3_read', stream_s3_file(bucket_name, file_key))
+    if spill:
+      # the summaries are built from the partitions once the file is read
+      transactions = metrics.timed('parse', iter_transactions(lines))
+      transactions = metrics.timed('partition', spill.spill(transactions))
+    elif aggregation_backend == 'numpy' and not index:
+      from numpy_backend import iter_summarized_transactions
+      transactions = metrics.timed('parse_aggregate', iter_summarized_transactions(account_summaries, lines))
+    else:
+      transactions = metrics.timed('parse', iter_transactions(lines))
+      if index:
+        # transaction ids already stored by an earlier file are skipped, so
+        # they are neither saved again nor counted in the summaries
+        transactions = metrics.timed('dedup', index.iter_new(transactions))
+      transactions = metrics.timed('aggregate', accumulate_summaries(account_summaries, transactions))
+    # The rows wait for the writer as 1000-row TransactionBatch chunks, which
+    # take a fraction of the memory of their dicts
+    write_workers = int(os.getenv('DYNAMODB_WRITE_WORKERS', 8))
+    writer = BackgroundStage(
+      lambda batches: dynamo_db_manager.save_transactions((row for batch in batches for row in batch), workers=write_workers),
+      maxsize=int(os.getenv('PIPELINE_QUEUE_SIZE', 64)), chunk_size=1, name='save-transactions')
+    rows = 0
+    try:
+      for batch in iter_transaction_batches(transactions):
+        writer.put(batch)
+        rows += len(batch)
+      writer.close()
+    except Exception:
+      writer.cancel()
+      raise
+    # The writes overlap the reading, parsing and aggregation of the file but
+    # not the emails: every row must be stored before the first email goes
+    # out, since an email sent ahead of a failed write would be sent again
+    # by the retry. Only the writes that outlasted the parsing are charged
+    # here
+    with metrics.stage('save_transactions'):
+      stats = writer.join()
+    if stats['items'] != rows:
+      raise RuntimeError(f"Saved {stats['items']} of the {rows} transactions of {file_key}")
+  else:
+    lines = metrics.timed('s3_read', stream_s3_file(bucket_name, file_key))
+    with metrics.stage('parse_aggregate'):
+      if aggregation_backend == 'numpy':
+        from numpy_backend import summarize_transactions_numpy
+        account_summaries = summarize_transactions_numpy(lines)
+      else:
+        account_summaries = summarize_transactions(lines)
+
+  # Monthly rollups (count, credit and debit sums, balance change per account
+  # and month) are written in the background while the emails go out; like
+  # the aggregates, each item takes a file's totals only once
+  rollups_table_name = os.getenv('DYNAMODB_ROLLUPS_TABLE_NAME')
+  rollups_manager = DynamoDBManager(rollups_table_name) if running_type == 'prod' and rollups_table_name else None
+  rollup_workers = int(os.getenv('DYNAMODB_WRITE_WORKERS', 8))
+  rollups = None
+
+  if spill and index:
+    summary_partitions = saved_partitions(spill, index, dynamo_db_manager, metrics)
+  elif spill:
+    summarize = summarize_transactions
+    if aggregation_backend == 'numpy':
+      from numpy_backend import summarize_transactions_numpy as summarize
+    summary_partitions = metrics.timed('summarize_partition', spill.summaries(summarize))
+  else:
+    summary_partitions = [account_summaries]
+  try:
+    # each partition is done, rollups included, before the next one starts,
+    # since saved_partitions commits its index on the way to the next one
+    for account_summaries in summary_partitions:
+      if rollups_manager:
+        rollups = BackgroundStage(
+          lambda pairs: rollups_manager.update_monthly_rollups(pairs, workers=rollup_workers, file_id=file_id),
+          name='monthly-rollups')
+        for pair in account_summaries.items():
+          rollups.put(pair)
+        rollups.close()
+      failed_accounts = send_summaries(account_summaries, running_type, metrics, email_bucket, file_id)
+      if rollups:
+        with metrics.stage('monthly_rollups'):
+          rollups.join()
+      if failed_accounts:
+        # Fail the file (its claim is released, or its SQS message reported)
+        # so the accounts get their email on the retry; nothing of this
+        # partition is committed to the index, and the aggregates and rollups
+        # it already added are not added again
+        raise RuntimeError(f"The summary emails of {len(failed_accounts)} accounts of {file_key} were not sent: "
+                           f"{', '.join(failed_accounts[:10])}")
+  except Exception:
+    if rollups:
+      rollups.cancel()
+    raise
+  if index:
+    if not spill:
+      # the index is committed once the file is done, so a retry after a
+      # failed email does not skip the rows it covers
+      with metrics.stage('index_commit'):
+        index.commit()
+    logging.info(f"Transaction index stats for {file_key}: {index.stats}")
 
-  # Read the file content from S3
-  file_content = read_s3_file(bucket_name, file_key)
-  
-  # process transacitons
-  transactions = parse_transactions(file_content)
-  transactions_by_account = defaultdict(list)
-  for transaction in transactions:
-    transactions_by_account[transaction['accountId']].append(transaction)
-  
-  # process transactions for each account and send an email
-  for account_id, account_transactions in transactions_by_account.items():
-    # Calculate summaries
-    total_balance = calculate_balance(account_transactions)
-    transactions_by_month = calculate_transactions_by_month(account_transactions)
-    overall_averages = calculate_overall_averages(account_transactions)
-    
-    monthly_summaries_html = format_monthly_summaries(transactions_by_month)
-
-    html_content = template.render({
-      'total_balance': "{:.2f}".format(total_balance),
-      'average_credit': "{:.2f}".format(overall_averages['average_credit']),
-      'average_debit': "{:.2f}".format(overall_averages['average_debit']),
-      'monthly_summaries': monthly_summaries_html
-    })
-    # Send email
-    if running_type == 'prod':
-      recipient_email = get_email(account_id)
-    else :
-      recipient_email = os.getenv('RECIPIENT_EMAIL')
-    email_manager = EmailManager(os.getenv('SENDER_EMAIL'), os.getenv('AWS_REGION'), running_type=running_type)
-    
-    if recipient_email:
-      email_manager.send_email(recipient_email,"Your Transaction Summary", html_content)
-  
-  
-  if running_type == 'prod':
-    dynamo_db_manager = DynamoDBManager(os.getenv('DYNAMODB_TRANSACTIONS_TABLE_NAME'))
-    dynamo_db_manager.save_transactions(transactions)
   # return message to confirm processing
   return {
       'statusCode': 200,
       'body': 'Successfully processed transactions and sent summary email.'
   }
+
+def saved_partitions(spill, index, dynamo_db_manager, metrics):
+  """Yields the summaries of the new rows of each partition of `spill` once
+  they are saved. The index of a partition is committed, and its filters
+  dropped, when the caller asks for the next partition: a retry after a
+  failure in a later partition skips the rows, aggregates and emails of the
+  partitions already done."""
+  from partitioned_ingest import SPILL_FIELDNAMES
+  write_workers = int(os.getenv('DYNAMODB_WRITE_WORKERS', 8))
+  for lines in spill.iter_partitions():
+    account_summaries = {}
+    transactions = metrics.timed('dedup', index.iter_new(iter_transactions(lines, SPILL_FIELDNAMES)))
+    with metrics.stage('save_transactions'):
+      dynamo_db_manager.save_transactions(accumulate_summaries(account_summaries, transactions), workers=write_workers)
+    yield account_summaries
+    with metrics.stage('index_commit'):
+      index.commit()
+    index.evict()
+
+def send_summaries(account_summaries, running_type, metrics, email_bucket=None, file_id=None):
+  # Running per-account aggregates are only kept in prod; each file adds its
+  # own totals so lifetime figures never need a rescan of old transactions.
+  # The totals of `file_id` are only added once, so a retried file (or
+  # partition) does not count them twice. Returns the accounts whose email
+  # could not be sent
+  aggregates_table_name = os.getenv('DYNAMODB_AGGREGATES_TABLE_NAME')
+  aggregates_manager = DynamoDBManager(aggregates_table_name) if running_type == 'prod' and aggregates_table_name else None
+
+  # One SES client for every email of the invocation. With the bulk delivery
+  # the per-account data is sent to a stored SES template 50 recipients at a
+  # time instead of one SendEmail call per account
+  email_manager = EmailManager(os.getenv('SENDER_EMAIL'), os.getenv('AWS_REGION'), running_type=running_type)
+  bulk_delivery = running_type == 'prod' and os.getenv('EMAIL_DELIVERY', 'single') == 'bulk'
+  bulk_destinations = []
+  messages = []
+  # the account of each destination and message, in the same order
+  bulk_accounts = []
+  message_accounts = []
+  if not bulk_delivery:
+    # Compiled once per container and reused by warm invocations; the bulk
+    # delivery renders on SES and never loads jinja2
+    template = get_registry().get(os.getenv('TEMPLATE_PATH', SUMMARY_TEMPLATE), os.getenv('EMAIL_LOCALE'))
+  if running_type == 'prod':
+    # every recipient is looked up up front in a few batched reads
+    with metrics.stage('get_email'):
+      recipient_emails = get_emails(list(account_summaries))
+    logging.info(f"Account email cache: {account_emails.stats()}")
+  try:
+    # send the summary email of each account
+    for account_id, summary in account_summaries.items():
+      aggregate = None
+      if aggregates_manager:
+        with metrics.stage('update_aggregate'):
+          aggregate = aggregates_manager.update_account_aggregate(account_id, summary, file_id=file_id)
+      with metrics.stage('render'):
+        email_data = summary_figures(summary)
+        if aggregate:
+          email_data.update(lifetime_figures(aggregate))
+        if not bulk_delivery:
+          html_content = template.render(email_data)
+      # Send email
+      if running_type == 'prod':
+        recipient_email = recipient_emails.get(str(account_id))
+      else :
+        recipient_email = os.getenv('RECIPIENT_EMAIL')
+    
+      if recipient_email and bulk_delivery:
+        bulk_destinations.append((recipient_email, ses_template_data(email_data)))
+        bulk_accounts.append(str(account_id))
+      elif recipient_email:
+        messages.append((recipient_email, "Your Transaction Summary", html_content))
+        message_accounts.append(str(account_id))
+
+    failed_accounts = []
+
+    if messages:
+      # sent concurrently, within the SES send rate shared by the files of
+      # the invocation
+      dispatcher = EmailDispatcher(email_manager, workers=int(os.getenv('EMAIL_WORKERS', 8)),
+                                   rate=float(os.getenv('EMAIL_SEND_RATE', 14)), bucket=email_bucket)
+      with metrics.stage('send_email'):
+        outcomes = dispatcher.dispatch(messages)
+      for outcome in outcomes:
+        metrics.observe('email_latency', outcome['seconds'])
+      failed_accounts.extend(account for account, outcome in zip(message_accounts, outcomes) if outcome['status'] != 'sent')
+      logging.info(f"Sent {len(outcomes) - len(failed_accounts)} summary emails, {len(failed_accounts)} failed")
+    if bulk_destinations:
+      with metrics.stage('send_bulk_email'):
+        results = email_manager.send_bulk_templated_email(os.getenv('SES_TEMPLATE_NAME', 'transaction_summary'), bulk_destinations)
+      failed = sum(1 for result in results if result['Status'] != 'Success')
+      logging.info(f"Sent {len(results) - failed} summary emails in bulk, {failed} failed")
+      # permanent rejections (e.g. an invalid address) would fail every retry
+      # as well, only the destinations SES could not serve are sent again
+      failed_accounts.extend(account for account, result in zip(bulk_accounts, results)
+                             if result['Status'] in RETRYABLE_BULK_STATUSES)
+    return failed_accounts
+  finally:
+    # ends the pooled SMTP sessions of the local delivery
+    email_manager.close()
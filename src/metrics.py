@@ -0,0 +1,227 @@
+import contextlib
+import json
+import os
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import config
+
+NAMESPACE = 'TransactionApi'
+# CloudWatch rejects an Embedded Metric Format metric with more values.
+MAX_VALUES_PER_METRIC = 100
+
+# Shared no-op context manager handed out when metrics are disabled.
+_NULL_STAGE = contextlib.nullcontext()
+
+
+class ListSink:
+    """Metrics sink that keeps the emitted records in memory, for tests and
+    local runs."""
+
+    def __init__(self):
+        self.records: List[Dict] = []
+
+    def __call__(self, record: Dict):
+        self.records.append(record)
+
+def stdout_sink(record: Dict):
+    """Prints the record as one JSON line; CloudWatch Logs picks up Embedded
+    Metric Format records from the Lambda output."""
+    print(json.dumps(record, default=str), flush=True)
+
+class _StageStats:
+    __slots__ = ('seconds', 'count', 'peak_bytes')
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.count = 0
+        self.peak_bytes = 0
+
+class Metrics:
+    """
+    Per-invocation timing, call counts and peak traced memory of named stages.
+
+    Stages may nest and may be charged per item of an iterator, so a
+    streaming pipeline whose stages run interleaved still gets separate
+    figures: each stage is charged its own time only, excluding the time of
+    the stages it pulls from. `emit` writes everything as one CloudWatch
+    Embedded Metric Format record.
+
+    When `enabled` is False every method is a no-op; `stage` hands out a
+    shared null context and `timed` returns the iterable unchanged.
+
+    Parameters
+    ----------
+    enabled : bool
+        Whether to record anything at all.
+    trace_memory : bool
+        Whether to track peak memory per stage with tracemalloc, which slows
+        allocation-heavy code down noticeably.
+    sink : Optional[Callable[[Dict], None]]
+        Receives the record built by `emit`, defaults to `stdout_sink`.
+    dimensions : Optional[Dict[str, str]]
+        CloudWatch dimensions of the metrics.
+    """
+
+    def __init__(self, enabled: bool = True, trace_memory: bool = False,
+                 sink: Optional[Callable[[Dict], None]] = None,
+                 dimensions: Optional[Dict[str, str]] = None):
+        self.enabled = enabled
+        self.trace_memory = trace_memory and enabled
+        self.sink = sink or stdout_sink
+        self.dimensions = dimensions or {}
+        self.stages: Dict[str, _StageStats] = {}
+        self.observations: Dict[str, List[float]] = {}
+        # [start, child seconds, child peak bytes] of each running stage
+        self._frames: List[List[float]] = []
+        self._started_tracing = False
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    @classmethod
+    def from_env(cls, sink: Optional[Callable[[Dict], None]] = None,
+                 dimensions: Optional[Dict[str, str]] = None) -> 'Metrics':
+        """Builds the metrics from the METRICS_ENABLED and METRICS_TRACE_MEMORY
+        environment variables, both off by default."""
+        enabled = os.getenv('METRICS_ENABLED', 'false').lower() == 'true'
+        trace_memory = os.getenv('METRICS_TRACE_MEMORY', 'false').lower() == 'true'
+        return cls(enabled=enabled, trace_memory=trace_memory, sink=sink, dimensions=dimensions)
+
+    def child(self) -> 'Metrics':
+        """
+        Metrics for work running on another thread, to be added back with
+        `merge`. Children never trace memory, since tracemalloc peaks are
+        process wide and cannot be told apart per thread.
+        """
+        return Metrics(enabled=self.enabled, sink=self.sink, dimensions=self.dimensions)
+
+    def merge(self, other: 'Metrics'):
+        """Adds the stage times, counts and observations of `other`."""
+        for name, other_stats in other.stages.items():
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = _StageStats()
+            stats.seconds += other_stats.seconds
+            stats.count += other_stats.count
+            stats.peak_bytes = max(stats.peak_bytes, other_stats.peak_bytes)
+        for name, observed in other.observations.items():
+            self.observations.setdefault(name, []).extend(observed)
+
+    def _enter(self):
+        if self.trace_memory:
+            if self._frames:
+                parent = self._frames[-1]
+                parent[2] = max(parent[2], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self._frames.append([time.perf_counter(), 0.0, 0])
+
+    def _exit(self, name: str):
+        start, child_seconds, child_peak = self._frames.pop()
+        elapsed = time.perf_counter() - start
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = _StageStats()
+        stats.seconds += elapsed - child_seconds
+        stats.count += 1
+        peak = 0
+        if self.trace_memory:
+            peak = max(child_peak, tracemalloc.get_traced_memory()[1])
+            stats.peak_bytes = max(stats.peak_bytes, peak)
+        if self._frames:
+            parent = self._frames[-1]
+            parent[1] += elapsed
+            parent[2] = max(parent[2], peak)
+
+    @contextlib.contextmanager
+    def _stage(self, name: str):
+        self._enter()
+        try:
+            yield
+        finally:
+            self._exit(name)
+
+    def stage(self, name: str):
+        """Context manager charging the time spent in its block to `name`."""
+        if not self.enabled:
+            return _NULL_STAGE
+        return self._stage(name)
+
+    def timed(self, name: str, iterable: Iterable) -> Iterable:
+        """Charges the time spent producing each item of `iterable` to `name`."""
+        if not self.enabled:
+            return iterable
+        return self._timed(name, iter(iterable))
+
+    def _timed(self, name: str, iterator: Iterator) -> Iterator:
+        while True:
+            self._enter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._exit(name)
+            yield item
+
+    def observe(self, name: str, value: float):
+        """Records one value of a distribution, such as a per-account latency."""
+        if self.enabled:
+            self.observations.setdefault(name, []).append(value)
+
+    def _document(self, definitions: List[Dict], values: Dict) -> Dict:
+        return {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': NAMESPACE,
+                    'Dimensions': [list(self.dimensions)],
+                    'Metrics': definitions
+                }]
+            },
+            **self.dimensions,
+            **values
+        }
+
+    def records(self) -> List[Dict]:
+        """
+        Builds the Embedded Metric Format records of everything measured.
+
+        The first record has the stages and up to `MAX_VALUES_PER_METRIC`
+        values of each observation; the values past that go into further
+        records of at most `MAX_VALUES_PER_METRIC` values per metric.
+        """
+        definitions, values = [], {}
+        for name, stats in self.stages.items():
+            definitions.append({'Name': f'{name}_time', 'Unit': 'Milliseconds'})
+            definitions.append({'Name': f'{name}_count', 'Unit': 'Count'})
+            values[f'{name}_time'] = round(stats.seconds * 1000, 3)
+            values[f'{name}_count'] = stats.count
+            if self.trace_memory:
+                definitions.append({'Name': f'{name}_peak_memory', 'Unit': 'Bytes'})
+                values[f'{name}_peak_memory'] = stats.peak_bytes
+        records = []
+        start = 0
+        while True:
+            for name, observed in self.observations.items():
+                chunk = observed[start:start + MAX_VALUES_PER_METRIC]
+                if chunk:
+                    definitions.append({'Name': name, 'Unit': 'Milliseconds'})
+                    values[name] = [round(value * 1000, 3) for value in chunk]
+            if records and not definitions:
+                return records
+            records.append(self._document(definitions, values))
+            definitions, values = [], {}
+            start += MAX_VALUES_PER_METRIC
+
+    def emit(self):
+        """Sends the records to the sink and stops memory tracing if it was
+        started by these metrics."""
+        if not self.enabled:
+            return
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        for record in self.records():
+            self.sink(record)
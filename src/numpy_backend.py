@@ -0,0 +1,275 @@
+import csv
+import re
+from datetime import datetime
+from decimal import Decimal
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from util import AccountSummary, _amount_units, _parse_date
+import config
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed when the 'numpy' backend is selected
+    np = None
+
+# Rows converted to arrays at a time; bounds the memory held by one chunk.
+CHUNK_ROWS = 100_000
+
+# Amounts made only of a sign, digits and at most two decimals can go through
+# float64 and back to integer cents exactly; anything else (sub-cent amounts,
+# exponents, underscores, nan, ...) is parsed with Decimal instead.
+_PLAIN_AMOUNT_CHARS = str.maketrans('', '', '0123456789+-. \t\r\n')
+_SUB_CENT = re.compile(r'\.\d{3}')
+_MAX_EXACT_UNITS = 2 ** 50
+# Totals switch from int64 to Python ints before they could get this large.
+_INT64_HEADROOM = 2 ** 62
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("The numpy aggregation backend requires numpy to be installed")
+
+def _iter_chunks(lines: Iterable[str], fieldnames: Optional[List[str]],
+                 chunk_rows: int) -> Iterator[Tuple[List[str], List[str]]]:
+    lines = iter(lines)
+    if fieldnames is None:
+        header = next(lines, None)
+        if header is None:
+            return
+        fieldnames = next(csv.reader([header], delimiter=';'))
+    while True:
+        chunk = list(islice(lines, chunk_rows))
+        if not chunk:
+            return
+        yield fieldnames, chunk
+
+def _split_columns(lines: List[str], fieldnames: List[str],
+                   names: Tuple[str, ...] = ('AccountId', 'Date', 'Transaction')) -> Tuple[List[str], ...]:
+    # Returns the columns called `names`. Unquoted files with the
+    # expected number of fields per line are split in one go; anything else
+    # goes through the csv module.
+    width = len(fieldnames)
+    text = ';'.join(lines)
+    fields = text.split(';')
+    if '"' in text or len(fields) != width * len(lines):
+        rows = [row for row in csv.reader(lines, delimiter=';') if row]
+        fields = [row[i] for row in rows for i in range(width)]
+    return tuple(fields[fieldnames.index(name)::width] for name in names)
+
+def _parse_months(date_strings: List[str], year: int):
+    # Only the distinct dates are parsed; invalid dates map to 0.
+    months = {}
+    for value in set(date_strings):
+        date_str = value.title()
+        try:
+            months[value] = _parse_date(date_str, year).month
+        except ValueError as e:
+            print(f"Error parsing date {date_str}: {e}")
+            months[value] = 0
+    return np.fromiter(map(months.__getitem__, date_strings), dtype=np.int64, count=len(date_strings))
+
+def _parse_units(amount_strings: List[str]) -> Tuple:
+    # Returns the amounts as an int64 array of units and their scale.
+    text = '\n'.join(amount_strings)
+    if not text.translate(_PLAIN_AMOUNT_CHARS) and not _SUB_CENT.search(text):
+        try:
+            values = np.fromiter(map(float, amount_strings), dtype=np.float64, count=len(amount_strings))
+        except ValueError:
+            values = None
+        if values is not None:
+            units = np.rint(values * 100)
+            if np.all(np.abs(units) < _MAX_EXACT_UNITS):
+                return units.astype(np.int64), 2
+    parsed = [_amount_units(amount) for amount in amount_strings]
+    scale = max(2, max(decimals for _, decimals in parsed))
+    units = [units * 10 ** (scale - decimals) for units, decimals in parsed]
+    try:
+        return np.array(units, dtype=np.int64), scale
+    except OverflowError:
+        return np.array(units, dtype=object), scale
+
+# Columns of _Accumulator.totals
+_BALANCE, _CREDIT_UNITS, _CREDIT_COUNT, _DEBIT_UNITS, _DEBIT_COUNT = range(5)
+_UNIT_COLUMNS = [_BALANCE, _CREDIT_UNITS, _DEBIT_UNITS]
+
+class _Accumulator:
+    # Per-account totals of a whole file, one row per account code; codes are
+    # assigned in first-seen order.
+
+    def __init__(self):
+        self.codes: Dict[str, int] = {}
+        self.scale = 2
+        self.totals = np.zeros((1024, 5), dtype=np.int64)
+        self.month_counts = np.zeros((1024, 13), dtype=np.int64)
+        # credit and debit units per account and month; never larger than
+        # the totals, so they share their dtype
+        self.month_credit_units = np.zeros((1024, 13), dtype=np.int64)
+        self.month_debit_units = np.zeros((1024, 13), dtype=np.int64)
+
+    def _to_object(self):
+        self.totals = self.totals.astype(object)
+        self.month_credit_units = self.month_credit_units.astype(object)
+        self.month_debit_units = self.month_debit_units.astype(object)
+
+    def _ensure_headroom(self, factor: int, added: int = 0):
+        # Exact results beat speed: fall back to Python ints if an int64
+        # total could overflow.
+        if self.totals.dtype != object and int(np.abs(self.totals).max()) * factor + added >= _INT64_HEADROOM:
+            self._to_object()
+
+    def _code_accounts(self, accounts: List[str]):
+        for account_id in dict.fromkeys(accounts):
+            if account_id not in self.codes:
+                self.codes[account_id] = len(self.codes)
+        if len(self.codes) > len(self.totals):
+            capacity = max(len(self.codes), 2 * len(self.totals))
+            self.totals = np.concatenate([self.totals, np.zeros((capacity - len(self.totals), 5), dtype=self.totals.dtype)])
+            self.month_counts = np.concatenate([self.month_counts, np.zeros((capacity - len(self.month_counts), 13), dtype=np.int64)])
+            self.month_credit_units = np.concatenate([self.month_credit_units, np.zeros((capacity - len(self.month_credit_units), 13), dtype=self.month_credit_units.dtype)])
+            self.month_debit_units = np.concatenate([self.month_debit_units, np.zeros((capacity - len(self.month_debit_units), 13), dtype=self.month_debit_units.dtype)])
+        return np.fromiter(map(self.codes.__getitem__, accounts), dtype=np.int64, count=len(accounts))
+
+    def add_chunk(self, lines: List[str], fieldnames: List[str], year: int):
+        self.add_columns(*_split_columns(lines, fieldnames), year)
+
+    def add_columns(self, accounts: List[str], dates: List[str], amounts: List[str], year: int):
+        months = _parse_months(dates, year)
+        valid = months != 0
+        if not valid.all():
+            keep = valid.tolist()
+            accounts = [account for account, ok in zip(accounts, keep) if ok]
+            amounts = [amount for amount, ok in zip(amounts, keep) if ok]
+            months = months[valid]
+        if not accounts:
+            return
+        units, scale = _parse_units(amounts)
+        if scale > self.scale:
+            factor = 10 ** (scale - self.scale)
+            self._ensure_headroom(factor)
+            self.totals[:, _UNIT_COLUMNS] *= factor
+            self.month_credit_units *= factor
+            self.month_debit_units *= factor
+            self.scale = scale
+        elif scale < self.scale:
+            factor = 10 ** (self.scale - scale)
+            if units.dtype != object and int(np.abs(units).max()) * factor >= _INT64_HEADROOM:
+                units = units.astype(object)
+            units *= factor
+        if units.dtype == object:
+            self._to_object()
+        else:
+            self._ensure_headroom(1, int(np.abs(units).max()) * len(units))
+        codes = self._code_accounts(accounts)
+
+        credits = units > 0
+        debits = units < 0
+        np.add.at(self.totals, (codes, _BALANCE), units)
+        np.add.at(self.totals, (codes[credits], _CREDIT_UNITS), units[credits])
+        np.add.at(self.totals, (codes[credits], _CREDIT_COUNT), 1)
+        np.add.at(self.totals, (codes[debits], _DEBIT_UNITS), units[debits])
+        np.add.at(self.totals, (codes[debits], _DEBIT_COUNT), 1)
+        np.add.at(self.month_counts, (codes, months), 1)
+        np.add.at(self.month_credit_units, (codes[credits], months[credits]), units[credits])
+        np.add.at(self.month_debit_units, (codes[debits], months[debits]), units[debits])
+
+    def summaries(self) -> Dict[str, AccountSummary]:
+        summaries = {}
+        totals, month_counts = self.totals.tolist(), self.month_counts.tolist()
+        month_credit_units, month_debit_units = self.month_credit_units.tolist(), self.month_debit_units.tolist()
+        for account_id, code in self.codes.items():
+            summary = summaries[account_id] = AccountSummary()
+            summary.scale = self.scale
+            (summary.balance_units, summary.credit_units, summary.credit_count,
+             summary.debit_units, summary.debit_count) = totals[code]
+            summary.month_counts = month_counts[code]
+            summary.month_credit_units = month_credit_units[code]
+            summary.month_debit_units = month_debit_units[code]
+        return summaries
+
+def summarize_transactions_numpy(lines: Iterable[str], fieldnames: Optional[List[str]] = None,
+                                 chunk_rows: int = CHUNK_ROWS) -> Dict[str, AccountSummary]:
+    """
+    Summarizes CSV lines per account with vectorized NumPy reductions.
+
+    Gives the same results as `util.summarize_transactions`. Lines are
+    converted to column arrays `chunk_rows` at a time, account ids are
+    factorized into integer codes and balance, credit and debit sums and
+    counts and monthly counts are updated for all accounts of a chunk with
+    grouped reductions.
+
+    Parameters
+    ----------
+    lines : Iterable[str]
+        CSV lines, starting with the header unless `fieldnames` is given.
+    fieldnames : Optional[List[str]]
+        Column names to use when `lines` has no header row.
+    chunk_rows : int
+        Number of rows converted to arrays at a time.
+
+    Returns
+    -------
+    Dict[str, AccountSummary]
+        Summaries keyed by account id, in first-seen order.
+    """
+    _require_numpy()
+    accumulator = _Accumulator()
+    year = datetime.now().year
+    for chunk_fieldnames, chunk in _iter_chunks(lines, fieldnames, chunk_rows):
+        accumulator.add_chunk(chunk, chunk_fieldnames, year)
+    return accumulator.summaries()
+
+def _iter_chunk_transactions(ids: List[str], accounts: List[str], dates: List[str], amounts: List[str],
+                             year: int) -> Iterator[Dict]:
+    # Builds the rows of a chunk from its columns, which are already split;
+    # rows with an invalid date (reported by _parse_months) are left out.
+    parsed_dates = {}
+    for value in set(dates):
+        try:
+            parsed_dates[value] = _parse_date(value, year)
+        except ValueError:
+            parsed_dates[value] = None
+    for transaction_id, account_id, date_str, amount in zip(ids, accounts, dates, amounts):
+        date = parsed_dates[date_str]
+        if date is not None:
+            yield {'id': transaction_id, 'accountId': account_id, 'date': date, 'transaction': Decimal(amount)}
+
+def iter_summarized_transactions(summaries: Dict[str, AccountSummary], lines: Iterable[str],
+                                 fieldnames: Optional[List[str]] = None,
+                                 chunk_rows: int = CHUNK_ROWS) -> Iterator[Dict]:
+    """
+    NumPy counterpart of `util.accumulate_summaries`.
+
+    Summarizes each chunk of `lines` with NumPy and then yields its
+    transaction dictionaries, so the rows can be saved in the same pass over
+    the file. `summaries` is filled in once the rows are exhausted.
+
+    Parameters
+    ----------
+    summaries : Dict[str, AccountSummary]
+        Summaries keyed by account id, updated in place.
+    lines : Iterable[str]
+        CSV lines, starting with the header unless `fieldnames` is given.
+    fieldnames : Optional[List[str]]
+        Column names to use when `lines` has no header row.
+    chunk_rows : int
+        Number of rows converted to arrays at a time.
+
+    Yields
+    ------
+    Dict
+        The parsed transactions, as `util.iter_transactions` yields them.
+    """
+    _require_numpy()
+    accumulator = _Accumulator()
+    year = datetime.now().year
+    for chunk_fieldnames, chunk in _iter_chunks(lines, fieldnames, chunk_rows):
+        ids, accounts, dates, amounts = _split_columns(chunk, chunk_fieldnames,
+                                                       ('Id', 'AccountId', 'Date', 'Transaction'))
+        accumulator.add_columns(accounts, dates, amounts, year)
+        yield from _iter_chunk_transactions(ids, accounts, dates, amounts, year)
+    for account_id, summary in accumulator.summaries().items():
+        if account_id in summaries:
+            summaries[account_id].merge(summary)
+        else:
+            summaries[account_id] = summary
@@ -0,0 +1,254 @@
+import csv
+import logging
+import multiprocessing
+import os
+import traceback
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from aws_clients import get_client, reset as reset_aws_clients
+from dynamodb_manager import DynamoDBManager
+from transaction_index import TransactionIndex
+from util import (AccountSummary, accumulate_summaries, detect_compression, iter_lines, iter_transactions,
+                  stream_s3_file, summarize_transactions)
+from numpy_backend import iter_summarized_transactions, summarize_transactions_numpy
+import config
+
+# Ranges smaller than this are not worth a process of their own.
+MIN_RANGE_BYTES = 8 * 1024 * 1024
+
+
+def plan_byte_ranges(size: int, parts: int) -> List[Tuple[int, int]]:
+    """
+    Splits an object of `size` bytes into contiguous byte ranges.
+
+    Parameters
+    ----------
+    size : int
+        Size of the object in bytes.
+    parts : int
+        Desired number of ranges.
+
+    Returns
+    -------
+    List[Tuple[int, int]]
+        Half-open ``(start, end)`` ranges covering ``[0, size)``.
+    """
+    if size <= 0:
+        return []
+    step = -(-size // max(1, min(parts, size)))
+    return [(start, min(start + step, size)) for start in range(0, size, step)]
+
+def iter_range_lines(s3, bucket: str, key: str, start: int, end: int,
+                     chunk_size: int = 64 * 1024) -> Iterator[str]:
+    """
+    Streams the lines that begin inside the byte range ``[start, end)``.
+
+    Range boundaries are moved forward to the next newline: a line that
+    starts before `start` belongs to the previous range, and the line that
+    starts before `end` is read to completion even if it crosses `end`.
+
+    Parameters
+    ----------
+    s3 : botocore.client.S3
+        S3 client used for the ranged GET.
+    bucket : str
+        The name of the S3 bucket.
+    key : str
+        The key of the file in the S3 bucket.
+    start : int
+        First byte of the range.
+    end : int
+        One past the last byte of the range.
+    chunk_size : int
+        Number of bytes to read from the body per call.
+
+    Yields
+    ------
+    str
+        Each line owned by the range, without its line terminator.
+    """
+    # Start one byte early so that a line beginning exactly at `start` is
+    # recognised: everything up to the first newline belongs to the
+    # previous range.
+    line_start = start - 1 if start else 0
+    skip_first = start > 0
+    obj = s3.get_object(Bucket=bucket, Key=key, Range=f'bytes={line_start}-')
+    body = obj['Body']
+    pending = b''
+    try:
+        while skip_first or line_start < end:
+            chunk = body.read(chunk_size)
+            if not chunk:
+                if pending and not skip_first:
+                    yield pending.decode('utf-8').rstrip('\r')
+                return
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                if skip_first:
+                    skip_first = False
+                elif line_start < end:
+                    yield line.decode('utf-8').rstrip('\r')
+                else:
+                    return
+                line_start += len(line) + 1
+    finally:
+        body.close()
+
+def _read_fieldnames(s3, bucket: str, key: str) -> List[str]:
+    obj = s3.get_object(Bucket=bucket, Key=key, Range='bytes=0-')
+    body = obj['Body']
+    try:
+        header = next(iter_lines(body))
+    finally:
+        body.close()
+    return next(csv.reader([header], delimiter=';'))
+
+def merge_summaries(into: Dict[str, AccountSummary], other: Dict[str, AccountSummary]) -> Dict[str, AccountSummary]:
+    """
+    Merges the per-account summaries of a later range into `into`.
+
+    Accounts keep their first-seen order, so merging ranges in file order
+    gives the same ordering as a single pass over the file.
+    """
+    for account_id, summary in other.items():
+        if account_id in into:
+            into[account_id].merge(summary)
+        else:
+            into[account_id] = summary
+    return into
+
+def summarize_range(bucket: str, key: str, start: int, end: int, fieldnames: List[str],
+                    table_name: Optional[str] = None, backend: str = 'python',
+                    index: Optional[TransactionIndex] = None) -> Dict[str, AccountSummary]:
+    """
+    Summarizes the rows of one byte range per account.
+
+    When `table_name` is given the parsed rows are also saved to that
+    DynamoDB table, so no row has to be sent back to the parent process.
+    `backend` is either 'python' or 'numpy'. With an `index` the rows it
+    already has are neither saved nor summarized; its new ids are not
+    committed.
+    """
+    s3 = get_client('s3')
+    lines = iter_range_lines(s3, bucket, key, start, end)
+    if start == 0:
+        next(lines, None)  # header
+    return _summarize_lines(lines, fieldnames, table_name, backend, index)
+
+def _summarize_lines(lines: Iterator[str], fieldnames: Optional[List[str]], table_name: Optional[str],
+                     backend: str, index: Optional[TransactionIndex] = None) -> Dict[str, AccountSummary]:
+    if not table_name:
+        if backend == 'numpy':
+            return summarize_transactions_numpy(lines, fieldnames)
+        return summarize_transactions(lines, fieldnames)
+    summaries = {}
+    if index:
+        # rows are deduplicated before they are summarized, which the numpy
+        # backend cannot do since it summarizes whole chunks
+        transactions = accumulate_summaries(summaries, index.iter_new(iter_transactions(lines, fieldnames)))
+    elif backend == 'numpy':
+        transactions = iter_summarized_transactions(summaries, lines, fieldnames)
+    else:
+        transactions = accumulate_summaries(summaries, iter_transactions(lines, fieldnames))
+    DynamoDBManager(table_name).save_transactions(transactions, workers=int(os.getenv('DYNAMODB_WRITE_WORKERS', 8)))
+    return summaries
+
+def _range_worker(connection, index_table_name, bucket, key, start, end, fieldnames, table_name, backend):
+    # clients inherited through fork share the parent's sockets
+    reset_aws_clients()
+    try:
+        # each worker checks its rows with an index of its own and sends the
+        # new ids back, the parent merges and commits them
+        index = None
+        if index_table_name:
+            index = TransactionIndex(DynamoDBManager(index_table_name), DynamoDBManager(table_name))
+        summaries = summarize_range(bucket, key, start, end, fieldnames, table_name, backend, index)
+        connection.send(('ok', (summaries, index.changes() if index else None)))
+    except Exception:
+        connection.send(('error', traceback.format_exc()))
+    finally:
+        connection.close()
+
+def _run_in_processes(jobs: List[Tuple], index_table_name: Optional[str] = None) -> List[Tuple]:
+    # multiprocessing.Pool and ProcessPoolExecutor need /dev/shm, which Lambda
+    # does not provide, so use plain processes and pipes. Returns the
+    # summaries and index changes of every job.
+    processes, receivers = [], []
+    for job in jobs:
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_range_worker, args=(sender, index_table_name, *job))
+        process.start()
+        sender.close()
+        processes.append(process)
+        receivers.append(receiver)
+    try:
+        results = []
+        for (_, _, start, end, *_), receiver in zip(jobs, receivers):
+            status, payload = receiver.recv()
+            if status == 'error':
+                raise RuntimeError(f"Error processing bytes {start}-{end}: {payload}")
+            results.append(payload)
+        return results
+    except BaseException:
+        for process in processes:
+            process.terminate()
+        raise
+    finally:
+        for process in processes:
+            process.join()
+
+def summarize_s3_file_parallel(bucket: str, key: str, workers: Optional[int] = None,
+                               table_name: Optional[str] = None, backend: str = 'python',
+                               min_range_bytes: int = MIN_RANGE_BYTES,
+                               index: Optional[TransactionIndex] = None) -> Dict[str, AccountSummary]:
+    """
+    Parses an S3 object in parallel byte ranges and aggregates it per account.
+
+    Parameters
+    ----------
+    bucket : str
+        The name of the S3 bucket.
+    key : str
+        The key of the file in the S3 bucket.
+    workers : Optional[int]
+        Maximum number of worker processes, defaults to the number of CPUs.
+    table_name : Optional[str]
+        DynamoDB table the workers save the parsed rows to, if any.
+    backend : str
+        Aggregation backend of the workers, 'python' or 'numpy'.
+    min_range_bytes : int
+        Smallest range handed to a worker; small files are parsed in-process.
+    index : Optional[TransactionIndex]
+        Index of the ids already saved to `table_name`: those rows are
+        skipped, like in the single-process ingest. The new ids of every
+        worker are merged into it; committing it is left to the caller.
+
+    Returns
+    -------
+    Dict[str, AccountSummary]
+        Per-account summaries in first-seen order.
+    """
+    s3 = get_client('s3')
+    head = s3.head_object(Bucket=bucket, Key=key)
+    size = head['ContentLength']
+    if size == 0:
+        return {}
+    if detect_compression(key, head.get('ContentEncoding')):
+        # A compressed stream cannot be entered at an arbitrary byte, so the
+        # object is decompressed and parsed in a single pass.
+        logging.info(f"Processing compressed {key} ({size} bytes) in-process")
+        return _summarize_lines(stream_s3_file(bucket, key), None, table_name, backend, index)
+    fieldnames = _read_fieldnames(s3, bucket, key)
+    parts = min(workers or os.cpu_count() or 1, size // min_range_bytes)
+    jobs = [(bucket, key, start, end, fieldnames, table_name, backend) for start, end in plan_byte_ranges(size, parts)]
+    logging.info(f"Processing {key} ({size} bytes) in {len(jobs)} byte ranges")
+    if len(jobs) == 1:
+        return summarize_range(*jobs[0], index=index)
+    index_table_name = index.index_manager.table.table_name if index and table_name else None
+    merged = {}
+    for summaries, changes in _run_in_processes(jobs, index_table_name):
+        merge_summaries(merged, summaries)
+        if changes:
+            index.merge(changes)
+    return merged
@@ -0,0 +1,147 @@
+import csv
+import os
+import tempfile
+import zlib
+from typing import Callable, Dict, Iterable, Iterator, Optional, TextIO
+
+from util import MONTH_ABBREVIATIONS, AccountSummary, summarize_transactions
+
+# Spilled rows keep the columns of the uploaded file, so a partition is read
+# back like any file.
+SPILL_FIELDNAMES = ['Id', 'AccountId', 'Date', 'Transaction']
+DEFAULT_PARTITIONS = 64
+
+
+def partition_of(account_id: str, partitions: int) -> int:
+    """
+    Returns the partition of an account.
+
+    CRC32 instead of `hash`, which is salted per process, so the partition
+    of an account is the same in every run.
+    """
+    return zlib.crc32(account_id.encode()) % partitions
+
+class PartitionSpill:
+    """
+    Groups transactions by account on disk instead of in memory.
+
+    Rows are hash-partitioned by account id into compact temporary files,
+    which are then summarized one at a time: memory use depends on the
+    accounts of one partition rather than on the size of the file. Use it
+    as a context manager, or call `close`, to remove the files.
+
+    Parameters
+    ----------
+    partitions : int
+        Number of partition files.
+    directory : Optional[str]
+        Where the temporary directory is created, the system default
+        (``/tmp`` in Lambda) if None.
+    buffer_size : int
+        Write buffer of each partition file, in bytes.
+    """
+
+    def __init__(self, partitions: int = DEFAULT_PARTITIONS, directory: Optional[str] = None,
+                 buffer_size: int = 64 * 1024):
+        self.partitions = partitions
+        self.buffer_size = buffer_size
+        self.rows = 0
+        self._directory = tempfile.TemporaryDirectory(prefix='transactions-', dir=directory)
+        self._files = [None] * partitions
+        self._writers = [None] * partitions
+
+    def _path(self, partition: int) -> str:
+        return os.path.join(self._directory.name, f'{partition:04d}.csv')
+
+    def add(self, transaction: Dict):
+        """Writes a transaction dictionary, as produced by `iter_transactions`."""
+        account_id = transaction['accountId']
+        partition = partition_of(account_id, self.partitions)
+        writer = self._writers[partition]
+        if writer is None:
+            self._files[partition] = open(self._path(partition), 'w', newline='', buffering=self.buffer_size)
+            # quoted by the csv module, so ids with ';', '"' or newlines read back intact
+            writer = self._writers[partition] = csv.writer(self._files[partition], delimiter=';')
+        date = transaction['date']
+        writer.writerow((transaction['id'], account_id, f"{MONTH_ABBREVIATIONS[date.month - 1]}-{date.day}",
+                         transaction['transaction']))
+        self.rows += 1
+
+    def spill(self, transactions: Iterable[Dict]) -> Iterator[Dict]:
+        """
+        Writes each transaction and passes it on, so rows can be spilled
+        while they are consumed elsewhere (e.g. saved to DynamoDB).
+
+        Parameters
+        ----------
+        transactions : Iterable[Dict]
+            Transaction dictionaries.
+
+        Yields
+        ------
+        Dict
+            The same transactions.
+        """
+        for transaction in transactions:
+            self.add(transaction)
+            yield transaction
+
+    def iter_partitions(self) -> Iterator[TextIO]:
+        """
+        Ends the writes and opens the partitions one at a time.
+
+        Each partition file is closed and deleted when the next one is
+        requested. Every account is in exactly one partition.
+
+        Yields
+        ------
+        TextIO
+            The CSV lines of one partition, without a header; read them with
+            ``fieldnames=SPILL_FIELDNAMES``.
+        """
+        self._close_files()
+        for partition in range(self.partitions):
+            path = self._path(partition)
+            if not os.path.exists(path):
+                continue
+            with open(path, newline='') as spill_file:
+                yield spill_file
+            os.remove(path)
+
+    def summaries(self, summarize: Callable[..., Dict[str, AccountSummary]] = summarize_transactions
+                  ) -> Iterator[Dict[str, AccountSummary]]:
+        """
+        Ends the writes and summarizes the partitions one at a time.
+
+        Parameters
+        ----------
+        summarize : Callable
+            Summarizes CSV lines given the `fieldnames` keyword, such as
+            `summarize_transactions` or `summarize_transactions_numpy`.
+
+        Yields
+        ------
+        Dict[str, AccountSummary]
+            The summaries of the accounts of one partition; every account is
+            in exactly one of them.
+        """
+        for spill_file in self.iter_partitions():
+            yield summarize(spill_file, fieldnames=SPILL_FIELDNAMES)
+
+    def _close_files(self):
+        for spill_file in self._files:
+            if spill_file is not None:
+                spill_file.close()
+        self._files = [None] * self.partitions
+        self._writers = [None] * self.partitions
+
+    def close(self):
+        """Removes the partition files."""
+        self._close_files()
+        self._directory.cleanup()
+
+    def __enter__(self) -> 'PartitionSpill':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
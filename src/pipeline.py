@@ -0,0 +1,95 @@
+import queue
+import threading
+import config
+
+_DONE = object()
+_CANCELLED = object()
+
+
+class StageCancelled(Exception):
+  """Raised inside a BackgroundStage consumer when the producer gave up."""
+
+class BackgroundStage:
+  """Runs `consumer(items)` in a thread while the caller is still producing
+  the items, so a slow sink (e.g. the DynamoDB writes) overlaps the work
+  that follows it instead of adding to it.
+
+  Items are handed over in chunks of `chunk_size` through a queue of at most
+  `maxsize` chunks; `put` blocks while the queue is full, so a slow consumer
+  slows the producer down instead of piling rows up in memory. An error of
+  the consumer is raised by the next `put` (or by `join`), and `cancel` makes
+  the consumer stop with StageCancelled."""
+
+  def __init__(self, consumer, maxsize=64, chunk_size=100, name='background-stage'):
+    self.consumer = consumer
+    self.chunk_size = chunk_size
+    self.queue = queue.Queue(maxsize)
+    self.result = None
+    self.error = None
+    self._chunk = []
+    self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+    self._thread.start()
+
+  def _items(self):
+    while True:
+      chunk = self.queue.get()
+      if chunk is _DONE:
+        return
+      if chunk is _CANCELLED:
+        raise StageCancelled()
+      yield from chunk
+
+  def _run(self):
+    try:
+      self.result = self.consumer(self._items())
+    except BaseException as e:
+      self.error = e
+
+  def _put(self, chunk):
+    while True:
+      if self.error is not None:
+        raise self.error
+      if not self._thread.is_alive():
+        raise RuntimeError(f"{self._thread.name} stopped before its input ended")
+      try:
+        self.queue.put(chunk, timeout=0.05)
+        return
+      except queue.Full:
+        continue
+
+  def put(self, item):
+    self._chunk.append(item)
+    if len(self._chunk) >= self.chunk_size:
+      chunk, self._chunk = self._chunk, []
+      self._put(chunk)
+
+  def close(self):
+    """Ends the input; the consumer keeps going until it drained the queue."""
+    if self._chunk:
+      chunk, self._chunk = self._chunk, []
+      self._put(chunk)
+    self._put(_DONE)
+
+  def join(self):
+    """Waits for the consumer and returns its result or raises its error."""
+    self._thread.join()
+    if self.error is not None:
+      raise self.error
+    return self.result
+
+  def cancel(self):
+    """Drops the queued items and stops the consumer. Its error, if any, is
+    not raised, since the caller is already handling one of its own."""
+    self._chunk = []
+    while self._thread.is_alive():
+      try:
+        while True:
+          self.queue.get_nowait()
+      except queue.Empty:
+        pass
+      try:
+        self.queue.put(_CANCELLED, timeout=0.05)
+        break
+      except queue.Full:
+        continue
+    self._thread.join()
@@ -0,0 +1,75 @@
+import os
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+import config
+
+if TYPE_CHECKING:
+    from jinja2 import Template
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+SUMMARY_TEMPLATE = 'summary_email.html'
+
+
+class TemplateRegistry:
+    """
+    Compiles email templates once and hands out the compiled objects.
+
+    Templates are looked up per locale: ``summary_email.html`` with locale
+    ``es`` resolves to ``summary_email.es.html`` when that file exists and
+    to ``summary_email.html`` otherwise. Compiled templates are kept for the
+    life of the registry, so a module-level registry is reused by every warm
+    invocation of the same Lambda container. With `bytecode_cache_dir` the
+    compiled code is also written to disk, which lets new containers sharing
+    that directory skip the compilation.
+
+    Parameters
+    ----------
+    templates_dir : str
+        Directory the templates are loaded from.
+    bytecode_cache_dir : Optional[str]
+        Directory for Jinja's on-disk bytecode cache, created if missing.
+    """
+
+    def __init__(self, templates_dir: str = TEMPLATES_DIR, bytecode_cache_dir: Optional[str] = None):
+        # jinja2 is imported here rather than at module level, so importing
+        # the lambda does not pay for it
+        from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
+        bytecode_cache = None
+        if bytecode_cache_dir:
+            os.makedirs(bytecode_cache_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
+        self.environment = Environment(
+            loader=FileSystemLoader(templates_dir),
+            bytecode_cache=bytecode_cache,
+            autoescape=select_autoescape(['html']),
+            # templates never change inside a running container
+            auto_reload=False,
+            trim_blocks=True,
+            lstrip_blocks=True,
+        )
+        self._templates: Dict[Tuple[str, Optional[str]], 'Template'] = {}
+
+    def get(self, name: str, locale: Optional[str] = None) -> 'Template':
+        """Returns the compiled template `name` for `locale`."""
+        key = (name, locale)
+        template = self._templates.get(key)
+        if template is None:
+            candidates = [name]
+            if locale:
+                base, extension = os.path.splitext(name)
+                candidates.insert(0, f'{base}.{locale}{extension}')
+            template = self._templates[key] = self.environment.select_template(candidates)
+        return template
+
+    def render(self, name: str, data: Dict, locale: Optional[str] = None) -> str:
+        return self.get(name, locale).render(data)
+
+_registry: Optional[TemplateRegistry] = None
+
+def get_registry() -> TemplateRegistry:
+    """Returns the registry of this process, created on first use with the
+    TEMPLATE_BYTECODE_CACHE_DIR environment variable."""
+    global _registry
+    if _registry is None:
+        _registry = TemplateRegistry(bytecode_cache_dir=os.getenv('TEMPLATE_BYTECODE_CACHE_DIR'))
+    return _registry
@@ -0,0 +1,161 @@
+import hashlib
+from itertools import islice
+import logging
+from boto3.dynamodb.types import Binary
+import config
+
+# 32768 bits with 7 hashes keep false positives around 1% up to ~3,400 ids
+# per account; past that they only cost extra verification reads.
+BLOOM_SIZE_BYTES = 4096
+BLOOM_HASHES = 7
+MAX_COMMIT_ATTEMPTS = 5
+
+
+class BloomFilter:
+  """Fixed-size Bloom filter of transaction ids, using double hashing over
+  one blake2b digest."""
+
+  def __init__(self, data=None, size_bytes=BLOOM_SIZE_BYTES, hashes=BLOOM_HASHES):
+    self.bits = bytearray(data) if data is not None else bytearray(size_bytes)
+    self.hashes = hashes
+
+  def _positions(self, value):
+    digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+    first = int.from_bytes(digest[:8], 'little')
+    step = int.from_bytes(digest[8:], 'little') | 1
+    size = len(self.bits) * 8
+    return [(first + i * step) % size for i in range(self.hashes)]
+
+  def add(self, value):
+    for position in self._positions(value):
+      self.bits[position >> 3] |= 1 << (position & 7)
+
+  def __contains__(self, value):
+    return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+  def update(self, other):
+    """Adds every id of `other`, a filter of the same size."""
+    self.bits = bytearray(a | b for a, b in zip(self.bits, other.bits))
+
+
+class TransactionIndex:
+  """Per-account index of already ingested transaction ids.
+
+  Each account has a Bloom filter item in the index table. Ids the filter has
+  never seen are new for sure; ids it reports as seen are checked against the
+  transactions table in batches, so a false positive never drops a row.
+  Rows are read in blocks of `load_batch_size`; the filters of the accounts
+  of a block that are not loaded yet are read in batches of 100 before the
+  block is checked, and written back by `commit` once the new rows are
+  saved."""
+
+  def __init__(self, index_manager, transactions_manager, lookup_batch_size=100, load_batch_size=1000):
+    self.index_manager = index_manager
+    self.transactions_manager = transactions_manager
+    self.lookup_batch_size = lookup_batch_size
+    self.load_batch_size = load_batch_size
+    self._filters = {}
+    self._changed = set()
+    self.stats = {'new': 0, 'duplicates': 0, 'lookups': 0}
+
+  @staticmethod
+  def _from_item(item):
+    if item:
+      return BloomFilter(item['bloom'].value, hashes=int(item['hashes'])), int(item['version'])
+    return BloomFilter(), 0
+
+  def _load(self, account_id):
+    return self._from_item(self.index_manager.get_item({'id': account_id}))
+
+  def _load_many(self, account_ids):
+    missing = [account_id for account_id in dict.fromkeys(account_ids) if account_id not in self._filters]
+    if missing:
+      items = self.index_manager.batch_get_items([{'id': account_id} for account_id in missing])
+      found = {item['id']: item for item in items}
+      for account_id in missing:
+        self._filters[account_id] = self._from_item(found.get(account_id))
+
+  def _filter(self, account_id):
+    if account_id not in self._filters:
+      self._filters[account_id] = self._load(account_id)
+    return self._filters[account_id][0]
+
+  def _verify(self, candidates):
+    # Keep only the candidates the transactions table does not have yet.
+    self.stats['lookups'] += 1
+    stored = self.transactions_manager.batch_get_items([{'id': transaction['id']} for transaction in candidates])
+    stored_ids = {item['id'] for item in stored}
+    for transaction in candidates:
+      if transaction['id'] in stored_ids:
+        self.stats['duplicates'] += 1
+      else:
+        yield from self._accept(transaction)
+
+  def _accept(self, transaction):
+    self._filters[transaction['accountId']][0].add(transaction['id'])
+    self._changed.add(transaction['accountId'])
+    self.stats['new'] += 1
+    yield transaction
+
+  def iter_new(self, transactions):
+    """Yields only the transactions whose id was not ingested before."""
+    candidates = []
+    transactions = iter(transactions)
+    while True:
+      block = list(islice(transactions, self.load_batch_size))
+      if not block:
+        break
+      self._load_many(transaction['accountId'] for transaction in block)
+      for transaction in block:
+        if transaction['id'] not in self._filter(transaction['accountId']):
+          yield from self._accept(transaction)
+          continue
+        candidates.append(transaction)
+        if len(candidates) == self.lookup_batch_size:
+          yield from self._verify(candidates)
+          candidates = []
+    if candidates:
+      yield from self._verify(candidates)
+
+  def commit(self):
+    """Writes the filters of the accounts that got new ids. A concurrent
+    update of the same account is merged in (filters union cleanly) and the
+    write retried."""
+    for account_id in self._changed:
+      bloom, version = self._filters[account_id]
+      for _ in range(MAX_COMMIT_ATTEMPTS):
+        item = {'id': account_id, 'bloom': Binary(bytes(bloom.bits)), 'hashes': bloom.hashes}
+        if self.index_manager.save_versioned_item(item, version):
+          self._filters[account_id] = (bloom, version + 1)
+          break
+        stored, version = self._load(account_id)
+        bloom.update(stored)
+      else:
+        logging.error(f"Could not update the transaction index of account {account_id}")
+    self._changed.clear()
+
+  def changes(self):
+    """Returns the filters of the accounts that got new ids, with their
+    versions, and the stats, for `merge` into another index of the same
+    tables (e.g. from a worker process)."""
+    return {'filters': {account_id: self._filters[account_id] for account_id in self._changed}, 'stats': dict(self.stats)}
+
+  def merge(self, changes):
+    """Adds the new ids and stats of another index, as returned by its
+    `changes`, so that `commit` writes them. The older of two versions of an
+    account is kept, which makes `commit` merge in anything stored since."""
+    for account_id, (bloom, version) in changes['filters'].items():
+      if account_id in self._filters:
+        own, own_version = self._filters[account_id]
+        own.update(bloom)
+        self._filters[account_id] = (own, min(version, own_version))
+      else:
+        self._filters[account_id] = (bloom, version)
+      self._changed.add(account_id)
+    for name, value in changes['stats'].items():
+      self.stats[name] += value
+
+  def evict(self):
+    """Drops the filters loaded so far, e.g. once the accounts of one
+    partition of a file are done. Filters with uncommitted ids are kept."""
+    self._filters = {account_id: loaded for account_id, loaded in self._filters.items() if account_id in self._changed}
@@ -1,13 +1,91 @@
-from collections import defaultdict
-import locale
-import boto3
+from array import array
+from collections import Counter, defaultdict
+import codecs
+from functools import lru_cache
+from aws_clients import get_client
 from decimal import Decimal
 from datetime import datetime
 import csv
-from typing import List, Dict
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 import config
 
-locale.setlocale(locale.LC_TIME, 'es_ES')
+# Month names of the files and the emails, in Spanish. They used to come
+# from the es_ES locale, which had to be installed and was set for the
+# whole process at import time.
+MONTH_ABBREVIATIONS = ('ene', 'feb', 'mar', 'abr', 'may', 'jun', 'jul', 'ago', 'sep', 'oct', 'nov', 'dic')
+MONTH_NAMES = ('enero', 'febrero', 'marzo', 'abril', 'mayo', 'junio',
+               'julio', 'agosto', 'septiembre', 'octubre', 'noviembre', 'diciembre')
+_MONTH_NUMBERS = {abbreviation: month for month, abbreviation in enumerate(MONTH_ABBREVIATIONS, 1)}
+_MONTH_NUMBERS['sept'] = 9
+
+def month_name(month: int) -> str:
+    """Returns the name of a month number, 1 being January."""
+    return MONTH_NAMES[month - 1]
+
+# Extensions of the compressed uploads, used when the object has no
+# Content-Encoding.
+COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.gzip': 'gzip', '.zst': 'zstd', '.zstd': 'zstd'}
+_CONTENT_ENCODINGS = {'gzip': 'gzip', 'x-gzip': 'gzip', 'zstd': 'zstd'}
+
+
+def detect_compression(key: str, content_encoding: Optional[str] = None) -> Optional[str]:
+    """
+    Tells how an S3 object is compressed.
+
+    Parameters
+    ----------
+    key : str
+        The key of the file in the S3 bucket.
+    content_encoding : Optional[str]
+        The Content-Encoding of the object, which takes precedence over
+        the extension of `key`.
+
+    Returns
+    -------
+    Optional[str]
+        'gzip', 'zstd', or None for a plain file.
+    """
+    compression = _CONTENT_ENCODINGS.get((content_encoding or '').strip().lower())
+    if compression:
+        return compression
+    for extension, compression in COMPRESSION_EXTENSIONS.items():
+        if key.lower().endswith(extension):
+            return compression
+    return None
+
+def decompressing_stream(stream: BinaryIO, compression: Optional[str]) -> BinaryIO:
+    """
+    Wraps a byte stream so reads return decompressed bytes.
+
+    The data is decompressed as it is read, one ``read(size)`` at a time,
+    so the decompressed file is never held in memory.
+
+    Parameters
+    ----------
+    stream : BinaryIO
+        Any object with a ``read(size)`` method, e.g. an S3 ``StreamingBody``.
+    compression : Optional[str]
+        'gzip', 'zstd' (needs the optional zstandard package), or None to
+        return `stream` itself.
+
+    Returns
+    -------
+    BinaryIO
+        A stream of the decompressed bytes.
+    """
+    if compression is None:
+        return stream
+    # imported on demand so plain files do not pay for them at cold start
+    if compression == 'gzip':
+        import gzip
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ValueError("zstd files need the zstandard package") from e
+        return zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True)
+    raise ValueError(f"Unsupported compression: {compression}")
 
 def read_s3_file(bucket: str, key: str) -> str:
     """
@@ -23,14 +101,125 @@ def read_s3_file(bucket: str, key: str) -> str:
     Returns
     -------
     str
-        The content of the file as a string.
+        The content of the file as a string, decompressed if the object is
+        gzip or zstd compressed.
     """
-    s3 = boto3.client('s3')
+    s3 = get_client('s3')
     obj = s3.get_object(Bucket=bucket, Key=key)
     print('bucket:____', bucket)  # For debugging
     print('key:____', key)  # For debugging
     print("obj['Body']:", obj['Body'])  # For debugging
-    return obj['Body'].read().decode('utf-8')
+    compression = detect_compression(key, obj.get('ContentEncoding'))
+    return decompressing_stream(obj['Body'], compression).read().decode('utf-8')
+
+def iter_lines(stream: BinaryIO, chunk_size: int = 64 * 1024) -> Iterator[str]:
+    """
+    Incrementally decodes a UTF-8 byte stream into lines.
+
+    Only one chunk (plus the partial line carried over from the previous
+    chunk) is held in memory at a time. A leading BOM is dropped.
+
+    Parameters
+    ----------
+    stream : BinaryIO
+        Any object with a ``read(size)`` method, e.g. an S3 ``StreamingBody``.
+    chunk_size : int
+        Number of bytes to read per call.
+
+    Yields
+    ------
+    str
+        Each line without its line terminator.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    pending = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        text = pending + decoder.decode(chunk, final=not chunk)
+        if not chunk:
+            break
+        lines = text.splitlines(True)
+        # The last piece may be an incomplete line (or a '\r' whose '\n' is
+        # in the next chunk), so keep it for the next round.
+        pending = lines.pop() if lines else ''
+        for line in lines:
+            yield line.rstrip('\r\n')
+    for line in text.splitlines():
+        yield line
+
+def stream_s3_file(bucket: str, key: str, chunk_size: int = 64 * 1024) -> Iterator[str]:
+    """
+    Streams a file from an S3 bucket line by line.
+
+    Unlike `read_s3_file`, the object is never held in memory as a whole.
+    Gzip and zstd objects, told apart by their Content-Encoding or
+    extension, are decompressed on the fly.
+
+    Parameters
+    ----------
+    bucket : str
+        The name of the S3 bucket.
+    key : str
+        The key of the file in the S3 bucket.
+    chunk_size : int
+        Number of bytes to read from the body per call.
+
+    Yields
+    ------
+    str
+        Each line of the file.
+    """
+    s3 = get_client('s3')
+    obj = s3.get_object(Bucket=bucket, Key=key)
+    body = obj['Body']
+    stream = decompressing_stream(body, detect_compression(key, obj.get('ContentEncoding')))
+    try:
+        yield from iter_lines(stream, chunk_size)
+    finally:
+        body.close()
+
+@lru_cache(maxsize=1024)
+def _parse_date(date_str: str, year: int) -> datetime:
+    # Dates only carry month and day ('jul-23'), so a file has at most a few
+    # hundred distinct values; cache them instead of parsing every row.
+    month, separator, day = date_str.partition('-')
+    month = _MONTH_NUMBERS.get(month.lower())
+    if month is None or not separator or not day.isdigit() or len(day) > 2:
+        raise ValueError(f"time data {date_str!r} does not match format 'mmm-dd'")
+    return datetime(year, month, int(day))
+
+def iter_transactions(lines: Iterable[str], fieldnames: Optional[List[str]] = None) -> Iterator[Dict]:
+    """
+    Lazily parses CSV lines into transaction dictionaries.
+
+    Parameters
+    ----------
+    lines : Iterable[str]
+        CSV lines, starting with the header unless `fieldnames` is given.
+    fieldnames : Optional[List[str]]
+        Column names to use when `lines` has no header row, e.g. a chunk
+        taken from the middle of a file.
+
+    Yields
+    ------
+    Dict
+        One transaction per valid row.
+    """
+    reader = csv.DictReader(lines, fieldnames=fieldnames, delimiter=';')
+    for row in reader:
+
+        date_str = row['Date']
+        try:
+            date_parsed = _parse_date(date_str, datetime.now().year)
+        except ValueError as e:
+            print(f"Error parsing date {date_str}: {e}")
+            continue
+        yield {
+            'id': row['Id'],
+            'accountId': row['AccountId'],
+            'date': date_parsed,
+            'transaction': Decimal(row['Transaction'])
+        }
 
 def parse_transactions(csv_content: str) -> List[Dict]:
     """
@@ -48,34 +237,395 @@ def parse_transactions(csv_content: str) -> List[Dict]:
     """
     if csv_content.startswith('\ufeff'):
         csv_content = csv_content[1:]
-    transactions = []
-    reader = csv.DictReader(csv_content.splitlines(),delimiter=';')
+    return list(iter_transactions(csv_content.splitlines()))
+
+def _amount_units(amount: Union[str, Decimal]) -> Tuple[int, int]:
+    # Splits an amount into an integer number of units and its decimal places,
+    # e.g. '+10.1' -> (101, 1), without going through Decimal for plain input.
+    if isinstance(amount, str):
+        whole, _, fraction = amount.strip().partition('.')
+        if not fraction or fraction.isdigit():
+            try:
+                return int(whole + fraction), len(fraction)
+            except ValueError:
+                pass
+        amount = Decimal(amount)
+    exponent = amount.as_tuple().exponent
+    if not isinstance(exponent, int):
+        raise ValueError(f"Invalid transaction amount: {amount}")
+    decimals = max(0, -exponent)
+    return int(amount.scaleb(decimals)), decimals
+
+class TransactionBatch:
+    """
+    Compact struct-of-arrays container of transactions.
+
+    Amounts are integers in units of ``10 ** -scale`` (cents unless a row
+    needs more decimals), account ids are interned, dates are packed as
+    ``month * 32 + day`` (the CSV carries no year) and transaction ids share
+    one UTF-8 buffer. A row takes a few tens of bytes instead of the ~400 of
+    a dictionary holding a `datetime` and a `Decimal`.
+
+    The `calculate_*` functions accept a batch wherever they accept a list
+    of transactions, and iterating it yields the usual dictionaries.
+    """
+
+    def __init__(self, year: Optional[int] = None):
+        self.year = year or datetime.now().year
+        self.scale = 2
+        self.amounts = array('q')
+        self.dates = array('H')
+        self.accounts = array('I')
+        self.account_ids: List[str] = []
+        self._account_index: Dict[str, int] = {}
+        self._id_bytes = bytearray()
+        self._id_ends = array('Q')
+
+    @classmethod
+    def from_transactions(cls, transactions: Iterable[Dict], year: Optional[int] = None) -> 'TransactionBatch':
+        """Builds a batch from transaction dictionaries."""
+        batch = cls(year)
+        for transaction in transactions:
+            batch.append_transaction(transaction)
+        return batch
+
+    def __len__(self) -> int:
+        return len(self.amounts)
+
+    def append(self, transaction_id: str, account_id: str, month_day: int, units: int, decimals: int = 2):
+        """
+        Appends one row.
+
+        Parameters
+        ----------
+        transaction_id : str
+            The transaction id.
+        account_id : str
+            The account id.
+        month_day : int
+            ``month * 32 + day``.
+        units : int
+            The amount in units of ``10 ** -decimals``.
+        decimals : int
+            Decimal places of `units`; the whole batch is rescaled if it
+            is finer than the current scale.
+        """
+        if decimals > self.scale:
+            factor = 10 ** (decimals - self.scale)
+            rescaled = [amount * factor for amount in self.amounts]
+            try:
+                self.amounts = array('q', rescaled)
+            except OverflowError:
+                self.amounts = rescaled
+            self.scale = decimals
+        amount = units * 10 ** (self.scale - decimals)
+        try:
+            self.amounts.append(amount)
+        except OverflowError:
+            # exact results beat compactness: amounts beyond int64 turn the
+            # column into a list of Python ints
+            self.amounts = list(self.amounts)
+            self.amounts.append(amount)
+        index = self._account_index.get(account_id)
+        if index is None:
+            index = self._account_index[account_id] = len(self.account_ids)
+            self.account_ids.append(account_id)
+        self._id_bytes += transaction_id.encode('utf-8')
+        self._id_ends.append(len(self._id_bytes))
+        self.accounts.append(index)
+        self.dates.append(month_day)
+
+    def append_transaction(self, transaction: Dict):
+        """Appends a transaction dictionary as produced by `iter_transactions`."""
+        units, decimals = _amount_units(transaction['transaction'])
+        date = transaction['date']
+        self.append(transaction['id'], transaction['accountId'], date.month * 32 + date.day, units, decimals)
+
+    def __iter__(self) -> Iterator[Dict]:
+        start = 0
+        for end, account, month_day, amount in zip(self._id_ends, self.accounts, self.dates, self.amounts):
+            yield {
+                'id': self._id_bytes[start:end].decode('utf-8'),
+                'accountId': self.account_ids[account],
+                'date': datetime(self.year, month_day >> 5, month_day & 31),
+                'transaction': Decimal(amount).scaleb(-self.scale)
+            }
+            start = end
+
+def _iter_rows(lines: Iterable[str], fieldnames: Optional[List[str]], year: int) -> Iterator[Tuple]:
+    # Yields (id, account id, date, amount units, amount decimals) for every
+    # valid CSV row without creating a dictionary or a Decimal.
+    reader = csv.reader(lines, delimiter=';')
+    if fieldnames is None:
+        fieldnames = next(reader, None)
+        if fieldnames is None:
+            return
+    columns = None
     for row in reader:
-        
-        date_str = row['Date'].title()  # Convert 'jul' to 'Jul' to match %b expectation
+        if not row:
+            continue
+        if columns is None:
+            # Like csv.DictReader, only complain about missing columns once
+            # there is a row to read them from.
+            columns = [fieldnames.index(name) for name in ('Id', 'AccountId', 'Date', 'Transaction')]
+            id_column, account_column, date_column, amount_column = columns
+        date_str = row[date_column].title()
         try:
-            date_parsed = datetime.strptime(date_str, '%b-%d')
-            current_year = datetime.now().year
-            date_parsed = date_parsed.replace(year=current_year)
+            date_parsed = _parse_date(date_str, year)
         except ValueError as e:
             print(f"Error parsing date {date_str}: {e}")
             continue
-        transaction = {
-            'id': row['Id'],
-            'accountId': row['AccountId'],
-            'date': date_parsed,
-            'transaction': Decimal(row['Transaction'])
+        units, decimals = _amount_units(row[amount_column])
+        yield row[id_column], row[account_column], date_parsed, units, decimals
+
+def parse_transaction_batches(lines: Iterable[str], fieldnames: Optional[List[str]] = None,
+                              year: Optional[int] = None) -> Dict[str, TransactionBatch]:
+    """
+    Parses CSV lines into one `TransactionBatch` per account.
+
+    No dictionary, `datetime` or `Decimal` is created per row.
+
+    Parameters
+    ----------
+    lines : Iterable[str]
+        CSV lines, starting with the header unless `fieldnames` is given.
+    fieldnames : Optional[List[str]]
+        Column names to use when `lines` has no header row.
+    year : Optional[int]
+        Year of the transactions, defaults to the current year.
+
+    Returns
+    -------
+    Dict[str, TransactionBatch]
+        Batches keyed by account id, in first-seen order.
+    """
+    year = year or datetime.now().year
+    batches = {}
+    for transaction_id, account_id, date, units, decimals in _iter_rows(lines, fieldnames, year):
+        batch = batches.get(account_id)
+        if batch is None:
+            batch = batches[account_id] = TransactionBatch(year)
+        batch.append(transaction_id, account_id, date.month * 32 + date.day, units, decimals)
+    return batches
+
+def iter_transaction_batches(transactions: Iterable[Dict], rows: int = 1000) -> Iterator[TransactionBatch]:
+    """
+    Packs transaction dictionaries into batches of `rows` transactions.
+
+    Used to hand rows over between pipeline stages: a queued batch takes a
+    fraction of the memory of its dictionaries, and iterating it gives them
+    back unchanged (amounts as equal `Decimal` values).
+
+    Parameters
+    ----------
+    transactions : Iterable[Dict]
+        Transaction dictionaries, as produced by `iter_transactions`.
+    rows : int
+        Number of transactions per batch.
+
+    Yields
+    ------
+    TransactionBatch
+        Batches of up to `rows` transactions, in the order given.
+    """
+    batch = None
+    for transaction in transactions:
+        if batch is None:
+            batch = TransactionBatch(transaction['date'].year)
+        batch.append_transaction(transaction)
+        if len(batch) >= rows:
+            yield batch
+            batch = None
+    if batch is not None:
+        yield batch
+
+def _units_to_decimal(units: int, scale: int) -> Decimal:
+    return Decimal(units).scaleb(-scale)
+
+class AccountSummary:
+    """
+    Running per-account aggregate updated once per transaction.
+
+    Keeps the balance, credit and debit sums and counts as integer units of
+    ``10 ** -scale``, and the number of transactions and the credit and debit
+    sums of each month indexed by month number, so an account can be
+    summarized without keeping its rows. Summaries of different parts of a
+    file can be combined with `merge`.
+    """
+
+    __slots__ = ('scale', 'balance_units', 'credit_units', 'credit_count',
+                 'debit_units', 'debit_count', 'month_counts',
+                 'month_credit_units', 'month_debit_units')
+
+    def __init__(self):
+        self.scale = 2
+        self.balance_units = 0
+        self.credit_units = 0
+        self.credit_count = 0
+        self.debit_units = 0
+        self.debit_count = 0
+        self.month_counts = [0] * 13
+        self.month_credit_units = [0] * 13
+        self.month_debit_units = [0] * 13
+
+    def _rescale(self, scale: int):
+        factor = 10 ** (scale - self.scale)
+        self.balance_units *= factor
+        self.credit_units *= factor
+        self.debit_units *= factor
+        self.month_credit_units = [units * factor for units in self.month_credit_units]
+        self.month_debit_units = [units * factor for units in self.month_debit_units]
+        self.scale = scale
+
+    def add(self, units: int, decimals: int, month: int):
+        """
+        Adds one transaction.
+
+        Parameters
+        ----------
+        units : int
+            The amount in units of ``10 ** -decimals``.
+        decimals : int
+            Decimal places of `units`.
+        month : int
+            Month number of the transaction, 1 to 12.
+        """
+        if decimals > self.scale:
+            self._rescale(decimals)
+        units *= 10 ** (self.scale - decimals)
+        self.balance_units += units
+        if units > 0:
+            self.credit_units += units
+            self.credit_count += 1
+            self.month_credit_units[month] += units
+        elif units < 0:
+            self.debit_units += units
+            self.debit_count += 1
+            self.month_debit_units[month] += units
+        self.month_counts[month] += 1
+
+    def add_transaction(self, transaction: Dict):
+        """Adds a transaction dictionary as produced by `iter_transactions`."""
+        units, decimals = _amount_units(transaction['transaction'])
+        self.add(units, decimals, transaction['date'].month)
+
+    def merge(self, other: 'AccountSummary') -> 'AccountSummary':
+        """Adds the totals of `other` to this summary."""
+        if other.scale > self.scale:
+            self._rescale(other.scale)
+        factor = 10 ** (self.scale - other.scale)
+        self.balance_units += other.balance_units * factor
+        self.credit_units += other.credit_units * factor
+        self.credit_count += other.credit_count
+        self.debit_units += other.debit_units * factor
+        self.debit_count += other.debit_count
+        for month, count in enumerate(other.month_counts):
+            self.month_counts[month] += count
+            self.month_credit_units[month] += other.month_credit_units[month] * factor
+            self.month_debit_units[month] += other.month_debit_units[month] * factor
+        return self
+
+    @property
+    def balance(self) -> Decimal:
+        """The total balance, as `calculate_balance` returns it."""
+        return _units_to_decimal(self.balance_units, self.scale)
+
+    @property
+    def credit_total(self) -> Decimal:
+        """The sum of all credits."""
+        return _units_to_decimal(self.credit_units, self.scale)
+
+    @property
+    def debit_total(self) -> Decimal:
+        """The sum of all debits."""
+        return _units_to_decimal(self.debit_units, self.scale)
+
+    def overall_averages(self) -> Dict:
+        """The credit and debit averages, as `calculate_overall_averages` returns them."""
+        return {
+            'average_credit': _units_to_decimal(self.credit_units, self.scale) / self.credit_count if self.credit_count else 0,
+            'average_debit': _units_to_decimal(self.debit_units, self.scale) / self.debit_count if self.debit_count else 0
         }
-        transactions.append(transaction)
-    return transactions
 
-def calculate_balance(transactions: List[Dict]) -> Decimal:
+    def monthly_totals(self) -> Iterator[Tuple[int, int, Decimal, Decimal]]:
+        """
+        Yields the month number, transaction count, credit sum and debit sum
+        of every month with transactions, in calendar order. The balance
+        change of a month is its credit sum plus its debit sum.
+        """
+        for month, count in enumerate(self.month_counts):
+            if count:
+                yield (month, count, _units_to_decimal(self.month_credit_units[month], self.scale),
+                       _units_to_decimal(self.month_debit_units[month], self.scale))
+
+    def transactions_by_month(self) -> Dict[str, int]:
+        """
+        Transactions per month in calendar order, with month names as keys.
+
+        Names are formatted here, once per month with transactions, rather
+        than once per row.
+        """
+        return {
+            month_name(month): count
+            for month, count in enumerate(self.month_counts) if count
+        }
+
+def accumulate_summaries(summaries: Dict[str, AccountSummary], transactions: Iterable[Dict]) -> Iterator[Dict]:
+    """
+    Adds each transaction to the `AccountSummary` of its account and passes
+    it on, so rows can be summarized while they are consumed elsewhere
+    (e.g. saved to DynamoDB) in a single pass.
+
+    Parameters
+    ----------
+    summaries : Dict[str, AccountSummary]
+        Summaries keyed by account id, updated in place.
+    transactions : Iterable[Dict]
+        Transaction dictionaries.
+
+    Yields
+    ------
+    Dict
+        The same transactions.
+    """
+    for transaction in transactions:
+        summary = summaries.get(transaction['accountId'])
+        if summary is None:
+            summary = summaries[transaction['accountId']] = AccountSummary()
+        summary.add_transaction(transaction)
+        yield transaction
+
+def summarize_transactions(lines: Iterable[str], fieldnames: Optional[List[str]] = None) -> Dict[str, AccountSummary]:
+    """
+    Summarizes CSV lines per account in a single pass.
+
+    Parameters
+    ----------
+    lines : Iterable[str]
+        CSV lines, starting with the header unless `fieldnames` is given.
+    fieldnames : Optional[List[str]]
+        Column names to use when `lines` has no header row.
+
+    Returns
+    -------
+    Dict[str, AccountSummary]
+        Summaries keyed by account id, in first-seen order.
+    """
+    summaries = {}
+    for _, account_id, date, units, decimals in _iter_rows(lines, fieldnames, datetime.now().year):
+        summary = summaries.get(account_id)
+        if summary is None:
+            summary = summaries[account_id] = AccountSummary()
+        summary.add(units, decimals, date.month)
+    return summaries
+
+def calculate_balance(transactions: Union[List[Dict], TransactionBatch]) -> Decimal:
     """
     Calculates the total balance from a list of transactions.
 
     Parameters
     ----------
-    transactions : List[Dict]
+    transactions : Union[List[Dict], TransactionBatch]
         A list of transactions.
 
     Returns
@@ -83,6 +633,8 @@ def calculate_balance(transactions: List[Dict]) -> Decimal:
     Decimal
         The total balance.
     """
+    if isinstance(transactions, TransactionBatch):
+        return _units_to_decimal(sum(transactions.amounts), transactions.scale)
     total_balance = sum([transaction['transaction'] for transaction in transactions])
     return total_balance
 
@@ -92,7 +644,7 @@ def calculate_overall_averages(transactions):
 
     Parameters
     ----------
-    transactions : List[Dict]
+    transactions : Union[List[Dict], TransactionBatch]
         A list of transactions.
 
     Returns
@@ -100,6 +652,15 @@ def calculate_overall_averages(transactions):
     Dict
         A dictionary containing monthly averages of credit and debit transactions.
     """
+    if isinstance(transactions, TransactionBatch):
+        credits = [amount for amount in transactions.amounts if amount > 0]
+        debits = [amount for amount in transactions.amounts if amount < 0]
+        scale = transactions.scale
+        return {
+            'average_credit': _units_to_decimal(sum(credits), scale) / len(credits) if credits else 0,
+            'average_debit': _units_to_decimal(sum(debits), scale) / len(debits) if debits else 0
+        }
+
     monthly_credits = defaultdict(list)
     monthly_debits = defaultdict(list)
 
@@ -125,13 +686,13 @@ def calculate_overall_averages(transactions):
         'average_debit': average_debit
     }
 
-def calculate_transactions_by_month(transactions: List[Dict]) -> Dict[str, int]:
+def calculate_transactions_by_month(transactions: Union[List[Dict], TransactionBatch]) -> Dict[str, int]:
     """
     Counts the number of transactions per month.
 
     Parameters
     ----------
-    transactions : List[Dict]
+    transactions : Union[List[Dict], TransactionBatch]
         A list of transactions.
 
     Returns
@@ -139,9 +700,13 @@ def calculate_transactions_by_month(transactions: List[Dict]) -> Dict[str, int]:
     Dict[str, int]
         A dictionary with month names as keys and transaction counts as values.
     """
+    if isinstance(transactions, TransactionBatch):
+        counts = Counter(month_day >> 5 for month_day in transactions.dates)
+        return {month_name(month): count for month, count in counts.items()}
+
     transactions_by_month = {}
     for transaction in transactions:
-        month = transaction['date'].strftime('%B')
+        month = month_name(transaction['date'].month)
         transactions_by_month[month] = transactions_by_month.get(month, 0) + 1
         # month = date.strftime('%B')
 
@@ -56,13 +56,23 @@ resource "aws_lambda_function" "process_transactions" {
   filename         = "../src/lambda_function.zip"
   source_code_hash = filebase64sha256("../src/lambda_function.py")
   timeout          = 30
+  # /tmp holds the partition files of the large uploads
+  ephemeral_storage {
+    size = 2048
+  }
   environment {
     variables = {
-      bucket                           = aws_s3_bucket.transaction_bucket.bucket
-      DYNAMODB_TRANSACTIONS_TABLE_NAME = aws_dynamodb_table.transactions.name
-      DYNAMODB_ACCOUNTS_TABLE_NAME     = aws_dynamodb_table.accounts.name
-      SENDER_EMAIL                     = aws_ses_email_identity.email_identity.email
-      TEMPLATE_PATH                    = "email_template.html"
+      bucket                                = aws_s3_bucket.transaction_bucket.bucket
+      DYNAMODB_TRANSACTIONS_TABLE_NAME      = aws_dynamodb_table.transactions.name
+      DYNAMODB_ACCOUNTS_TABLE_NAME          = aws_dynamodb_table.accounts.name
+      DYNAMODB_AGGREGATES_TABLE_NAME        = aws_dynamodb_table.account_aggregates.name
+      DYNAMODB_ROLLUPS_TABLE_NAME           = aws_dynamodb_table.monthly_rollups.name
+      DYNAMODB_MANIFEST_TABLE_NAME          = aws_dynamodb_table.processed_files.name
+      DYNAMODB_TRANSACTION_INDEX_TABLE_NAME = aws_dynamodb_table.transaction_index.name
+      SENDER_EMAIL                          = aws_ses_email_identity.email_identity.email
+      SES_TEMPLATE_NAME                     = aws_ses_template.transaction_summary.name
+      TEMPLATE_PATH                         = "summary_email.html"
+      TEMPLATE_BYTECODE_CACHE_DIR           = "/tmp/jinja_bytecode"
     }
   }
 }
@@ -95,6 +105,26 @@ resource "aws_dynamodb_table" "transactions" {
     name = "id"
     type = "S"
   }
+
+  attribute {
+    name = "accountId"
+    type = "S"
+  }
+
+  attribute {
+    name = "date"
+    type = "S"
+  }
+
+  # transactions of an account in date order, read by query_transactions
+  global_secondary_index {
+    name            = "account_date"
+    hash_key        = "accountId"
+    range_key       = "date"
+    projection_type = "ALL"
+    read_capacity   = 5
+    write_capacity  = 5
+  }
 }
 
 # dynamo table for storing accounts
@@ -111,11 +141,80 @@ resource "aws_dynamodb_table" "accounts" {
   }
 }
 
+# dynamo table for the running per-account aggregates
+resource "aws_dynamodb_table" "account_aggregates" {
+  name           = "account_aggregates"
+  billing_mode   = "PROVISIONED"
+  hash_key       = "id"
+  read_capacity  = 5
+  write_capacity = 5
+
+  attribute {
+    name = "id"
+    type = "S"
+  }
+}
+
+# dynamo table with the per-account monthly rollups, updated on every file in prod
+resource "aws_dynamodb_table" "monthly_rollups" {
+  name           = "monthly_rollups"
+  billing_mode   = "PROVISIONED"
+  hash_key       = "accountId"
+  range_key      = "month"
+  read_capacity  = 5
+  write_capacity = 5
+
+  attribute {
+    name = "accountId"
+    type = "S"
+  }
+
+  attribute {
+    name = "month"
+    type = "S"
+  }
+}
+
+# dynamo table with the S3 object versions already processed
+resource "aws_dynamodb_table" "processed_files" {
+  name           = "processed_files"
+  billing_mode   = "PROVISIONED"
+  hash_key       = "id"
+  read_capacity  = 5
+  write_capacity = 5
+
+  attribute {
+    name = "id"
+    type = "S"
+  }
+}
+
+# dynamo table with a bloom filter of the stored transaction ids per account
+resource "aws_dynamodb_table" "transaction_index" {
+  name           = "transaction_index"
+  billing_mode   = "PROVISIONED"
+  hash_key       = "id"
+  read_capacity  = 5
+  write_capacity = 5
+
+  attribute {
+    name = "id"
+    type = "S"
+  }
+}
+
 # ses email for notification
 resource "aws_ses_email_identity" "email_identity" {
   email = "ulkevinb@gmail.com"
 }
 
+# ses template used by the bulk email delivery
+resource "aws_ses_template" "transaction_summary" {
+  name    = "transaction_summary"
+  subject = "Your Transaction Summary"
+  html    = file("../src/templates/summary_email.ses.html")
+}
+
 resource "aws_lambda_permission" "allow_s3_invocation" {
   statement_id  = "AllowExecutionFromS3Bucket"
   action        = "lambda:InvokeFunction"
@@ -162,6 +261,7 @@ resource "aws_iam_policy" "lambda_policy" {
         Action = [
           "dynamodb:PutItem",
           "dynamodb:GetItem",
+          "dynamodb:BatchGetItem",
           "dynamodb:BatchWriteItem",
           "dynamodb:Update*",
           "dynamodb:Delete*",
@@ -171,13 +271,19 @@ resource "aws_iam_policy" "lambda_policy" {
         Effect = "Allow",
         Resource = [
           "arn:aws:dynamodb:${var.aws_region}:${var.aws_account_id}:table/accounts",
-          "arn:aws:dynamodb:${var.aws_region}:${var.aws_account_id}:table/transactions"
+          "arn:aws:dynamodb:${var.aws_region}:${var.aws_account_id}:table/transactions",
+          "arn:aws:dynamodb:${var.aws_region}:${var.aws_account_id}:table/transactions/index/account_date",
+          "arn:aws:dynamodb:${var.aws_region}:${var.aws_account_id}:table/account_aggregates",
+          "arn:aws:dynamodb:${var.aws_region}:${var.aws_account_id}:table/monthly_rollups",
+          "arn:aws:dynamodb:${var.aws_region}:${var.aws_account_id}:table/processed_files",
+          "arn:aws:dynamodb:${var.aws_region}:${var.aws_account_id}:table/transaction_index"
         ]
       },
       {
         Action = [
           "ses:SendEmail",
-          "ses:SendRawEmail"
+          "ses:SendRawEmail",
+          "ses:SendBulkTemplatedEmail"
         ],
         Effect   = "Allow",
         Resource = "*"
@@ -0,0 +1,46 @@
+from src.account_cache import MISSING, TTLCache
+
+
+class FakeClock:
+  def __init__(self):
+    self.now = 0.0
+
+  def __call__(self):
+    return self.now
+
+
+def test_ttl_and_counters():
+  clock = FakeClock()
+  cache = TTLCache(ttl=10, negative_ttl=2, clock=clock)
+  cache.put('1', 'one@example.com')
+  cache.put('2', MISSING)
+  assert cache.get('1') == 'one@example.com'
+  assert cache.get('2', 'default') is MISSING
+  assert cache.get('3', 'default') == 'default'
+
+  clock.now = 5
+  # negative entries expire sooner
+  assert cache.get('2', 'default') == 'default'
+  assert cache.get('1') == 'one@example.com'
+  clock.now = 11
+  assert cache.get('1') is None
+  assert cache.stats() == {'hits': 3, 'misses': 3, 'size': 0}
+
+
+def test_lru_eviction():
+  cache = TTLCache(maxsize=2)
+  cache.put('1', 'a')
+  cache.put('2', 'b')
+  cache.get('1')
+  cache.put('3', 'c')
+  assert cache.get('2') is None
+  assert cache.get('1') == 'a' and cache.get('3') == 'c'
+
+
+def test_invalidate():
+  cache = TTLCache()
+  cache.put('1', MISSING)
+  cache.invalidate('1')
+  cache.invalidate('unknown')
+  assert cache.get('1', 'default') == 'default'
+  assert len(cache) == 0
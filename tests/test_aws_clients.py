@@ -0,0 +1,85 @@
+import json
+import os
+import threading
+import boto3
+import pytest
+from moto import mock_aws
+from unittest.mock import patch
+from src.lambda_function import lambda_handler
+import aws_clients
+
+
+@pytest.fixture
+def aws_credentials(monkeypatch):
+  monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+  monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+  monkeypatch.setenv('AWS_REGION', 'us-east-1')
+
+def test_get_client_is_shared(aws_credentials):
+  client = aws_clients.get_client('s3')
+  assert aws_clients.get_client('s3') is client
+  assert aws_clients.get_client('s3', region_name='us-east-1') is client
+  assert aws_clients.get_client('s3', region_name='eu-west-1') is not client
+  assert client.meta.config.max_pool_connections == aws_clients.client_config().max_pool_connections
+  assert aws_clients.get_resource('dynamodb') is aws_clients.get_resource('dynamodb')
+
+def test_get_resource_is_per_thread(aws_credentials):
+  resource = aws_clients.get_resource('dynamodb')
+  others = []
+  thread = threading.Thread(target=lambda: others.append(aws_clients.get_resource('dynamodb')))
+  thread.start()
+  thread.join()
+  assert others[0] is not resource
+  aws_clients.reset()
+  assert aws_clients.get_resource('dynamodb') is not resource
+
+def test_reset_forgets_clients(aws_credentials):
+  client = aws_clients.get_client('s3')
+  aws_clients.reset()
+  assert aws_clients.get_client('s3') is not client
+
+def test_get_client_creates_one_client_across_threads(aws_credentials):
+  barrier = threading.Barrier(8)
+  clients = []
+
+  def get():
+    barrier.wait()
+    clients.append(aws_clients.get_client('ses'))
+
+  with patch('boto3.client', wraps=boto3.client) as factory:
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+  assert factory.call_count == 1
+  assert len({id(client) for client in clients}) == 1
+
+def test_warm_invocation_creates_no_clients(aws_credentials):
+  event = {
+    'Records': [{
+      's3': {
+        'bucket': {'name': 'stori-challenge-transaction-bucket'},
+        'object': {'key': 'uploads/stori_challenge_123.csv'}
+      }
+    }],
+    'running_type': 'local'
+  }
+  with mock_aws(), patch('src.lambda_function.EmailManager'), patch('src.lambda_function.DynamoDBManager'), \
+       patch('src.lambda_function.get_email', return_value='test@example.com'):
+    s3 = boto3.resource('s3', region_name='us-east-1')
+    s3.create_bucket(Bucket='stori-challenge-transaction-bucket')
+    s3.Object('stori-challenge-transaction-bucket', 'uploads/stori_challenge_123.csv').put(Body=json.dumps({'test': 'data'}))
+
+    assert lambda_handler(event, None)['statusCode'] == 200
+    with patch('boto3.client', wraps=boto3.client) as client_factory, \
+         patch('boto3.resource', wraps=boto3.resource) as resource_factory:
+      assert lambda_handler(event, None)['statusCode'] == 200
+  assert client_factory.call_count == 0
+  assert resource_factory.call_count == 0
+
+def test_error_code():
+  from botocore.exceptions import ClientError
+  error = ClientError({'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'failed'}}, 'PutItem')
+  assert aws_clients.error_code(error) == 'ConditionalCheckFailedException'
+  assert aws_clients.error_code(ValueError('not an AWS error')) is None
@@ -3,8 +3,11 @@ from unittest.mock import PropertyMock, call, patch, MagicMock
 from botocore.stub import Stubber
 import boto3
 from src.dynamodb_manager import DynamoDBManager
-from datetime import datetime
+from src.util import AccountSummary
+from decimal import Decimal
+from datetime import date, datetime
 from moto import mock_aws
+from botocore.exceptions import ClientError
 
 @pytest.fixture
 def dynamodb_stub():
@@ -19,7 +22,7 @@ def dynamodb_stub():
 @pytest.fixture
 def dynamodb_manager():
   """Fixture to create a DynamoDBManager instance with a mocked DynamoDB table."""
-  with patch('src.dynamodb_manager.boto3.resource') as mock_resource:
+  with patch('boto3.resource') as mock_resource:
     mock_table = MagicMock()
     mock_resource.return_value.Table.return_value = mock_table
     yield DynamoDBManager('transactions'), mock_table
@@ -41,21 +44,42 @@ def dynamodb_manager():
 
 def test_save_transactions(dynamodb_manager):
   dynamodb_manager_instance, mock_table = dynamodb_manager
-  mock_batch_writer = MagicMock()
-  mock_table.batch_writer.return_value = mock_batch_writer  # Mock batch_writer to return your mock_batch_writer
+  mock_table.table_name = 'transactions'
+  batch_write_item = dynamodb_manager_instance.dynamodb.meta.client.batch_write_item
+  batch_write_item.return_value = {'UnprocessedItems': {}}
 
-  transactions = [
-      {"id": "1", "accountId": "1", "date": datetime.now().isoformat(), "transanction": "+20.5"},
-      {"id": "2", "accountId": "1", "date": datetime.now().isoformat(), "transanction": "-2.5"}
-  ]
-  dynamodb_manager_instance.save_transactions(transactions)
-  expected_calls = [
-    call.__enter__().put_item(Item=transactions[0]),
-    call.__enter__().put_item(Item=transactions[1]),
-  ]
-  actual_calls = mock_batch_writer.mock_calls[1:-1]  # Exclude __enter__ and __exit__ calls
+  date = datetime(2024, 7, 15)
+  transactions = [{"id": str(i), "accountId": "1", "date": date, "transanction": "+20.5"} for i in range(60)]
+  stats = dynamodb_manager_instance.save_transactions(iter(transactions), workers=3)
+
+  assert (stats['items'], stats['batches'], stats['retries']) == (60, 3, 0)
+  written = [request['PutRequest']['Item'] for c in batch_write_item.call_args_list for request in c.kwargs['RequestItems']['transactions']]
+  assert sorted(len(c.kwargs['RequestItems']['transactions']) for c in batch_write_item.call_args_list) == [10, 25, 25]
+  assert sorted(item['id'] for item in written) == sorted(str(i) for i in range(60))
+  assert all(item['date'] == '2024-07-15T00:00:00' for item in written)
+  # the caller's rows are left alone
+  assert transactions[0]['date'] == date
+
+def test_save_transactions_retries_unprocessed_items(dynamodb_manager):
+  dynamodb_manager_instance, mock_table = dynamodb_manager
+  mock_table.table_name = 'transactions'
+  batch_write_item = dynamodb_manager_instance.dynamodb.meta.client.batch_write_item
+  unprocessed = {'transactions': [{'PutRequest': {'Item': {'id': '2'}}}]}
+  batch_write_item.side_effect = [{'UnprocessedItems': unprocessed}, {'UnprocessedItems': {}}]
+
+  stats = dynamodb_manager_instance.save_transactions([{'id': '1'}, {'id': '2'}], backoff_seconds=0)
+
+  assert (stats['items'], stats['batches'], stats['retries']) == (2, 1, 1)
+  assert batch_write_item.call_args_list[1].kwargs['RequestItems'] == unprocessed
+
+def test_save_transactions_gives_up(dynamodb_manager):
+  dynamodb_manager_instance, mock_table = dynamodb_manager
+  mock_table.table_name = 'transactions'
+  unprocessed = {'transactions': [{'PutRequest': {'Item': {'id': '1'}}}]}
+  dynamodb_manager_instance.dynamodb.meta.client.batch_write_item.return_value = {'UnprocessedItems': unprocessed}
+  with pytest.raises(RuntimeError):
+    dynamodb_manager_instance.save_transactions([{'id': '1'}], max_retries=2, backoff_seconds=0)
 
-  assert actual_calls == expected_calls, "Transactions were not saved as expected"
 # def test_save_transactions(dynamodb_manager):
 #   dynamodb_manager_instance, mock_table = dynamodb_manager
 #   transactions = [
@@ -112,3 +136,255 @@ def test_save_account(dynamodb_manager):
   # response = dynamodb_manager.save_account(account_id, email)
   # assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
   # dynamodb_stub.put_item.assert_called_once_with(Item={"id": account_id, "email": email})
+
+
+@pytest.fixture
+def aggregates_table():
+  with mock_aws():
+    dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+    dynamodb.create_table(
+      TableName='account_aggregates',
+      KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+      AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
+      ProvisionedThroughput={'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1}
+    )
+    with patch.dict('os.environ', {'AWS_REGION': 'us-east-1'}):
+      yield DynamoDBManager('account_aggregates')
+
+def test_update_account_aggregate(aggregates_table):
+  summary = AccountSummary()
+  summary.add(1010, 2, 7)
+  summary.add(-82, 1, 7)
+  summary.add(5, 3, 8)
+
+  first = aggregates_table.update_account_aggregate('1', summary, year=2024)
+  assert first['balance'] == Decimal('1.905')
+  assert first['count_2024_07'] == 2
+
+  second = aggregates_table.update_account_aggregate('1', summary, year=2024)
+  assert second == {
+    'id': '1',
+    'balance': Decimal('3.81'),
+    'credit_total': Decimal('20.21'),
+    'credit_count': 4,
+    'debit_total': Decimal('-16.4'),
+    'debit_count': 2,
+    'count_2024_07': 4,
+    'count_2024_08': 2,
+  }
+
+
+@pytest.fixture
+def moto_table():
+  with mock_aws():
+    dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+    dynamodb.create_table(
+      TableName='processed_files',
+      KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+      AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
+      ProvisionedThroughput={'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1}
+    )
+    with patch.dict('os.environ', {'AWS_REGION': 'us-east-1'}):
+      yield DynamoDBManager('processed_files')
+
+def test_claim_processing(moto_table):
+  assert moto_table.claim_processing('bucket/file.csv#etag')
+  assert not moto_table.claim_processing('bucket/file.csv#etag')
+  moto_table.mark_processed('bucket/file.csv#etag')
+  assert not moto_table.claim_processing('bucket/file.csv#etag', lease_seconds=-1)
+  assert moto_table.get_item({'id': 'bucket/file.csv#etag'})['status'] == 'processed'
+
+def test_claim_processing_expired_lease(moto_table):
+  assert moto_table.claim_processing('bucket/file.csv#etag', lease_seconds=-10)
+  assert moto_table.claim_processing('bucket/file.csv#etag')
+
+def test_batch_get_items(moto_table):
+  for i in range(150):
+    moto_table.table.put_item(Item={'id': str(i)})
+  items = moto_table.batch_get_items([{'id': str(i)} for i in range(140, 160)] + [{'id': '3'}])
+  assert sorted(item['id'] for item in items) == ['140', '141', '142', '143', '144', '145', '146', '147', '148', '149', '3']
+  assert len(moto_table.batch_get_items([{'id': str(i)} for i in range(150)])) == 150
+
+def test_save_versioned_item(moto_table):
+  assert moto_table.save_versioned_item({'id': '1', 'value': 'a'}, 0)
+  assert not moto_table.save_versioned_item({'id': '1', 'value': 'b'}, 0)
+  assert moto_table.save_versioned_item({'id': '1', 'value': 'c'}, 1)
+  assert moto_table.get_item({'id': '1'}) == {'id': '1', 'value': 'c', 'version': 2}
+
+def test_batch_get_items_retries_unprocessed_keys(dynamodb_manager):
+  manager, mock_table = dynamodb_manager
+  mock_table.table_name = 'accounts'
+  client = manager.dynamodb.meta.client
+  keys = [{'id': str(i)} for i in range(250)] + [{'id': '0'}]
+
+  def batch_get_item(RequestItems):
+    requested = RequestItems['accounts']['Keys']
+    # the first call of every batch leaves its last two keys unprocessed
+    if len(requested) > 2:
+      return {'Responses': {'accounts': requested[:-2]}, 'UnprocessedKeys': {'accounts': {'Keys': requested[-2:]}}}
+    return {'Responses': {'accounts': requested}, 'UnprocessedKeys': {}}
+
+  client.batch_get_item.side_effect = batch_get_item
+  with patch('src.dynamodb_manager.time.sleep') as sleep:
+    items = manager.batch_get_items(keys, workers=3)
+  assert sorted(int(item['id']) for item in items) == list(range(250))
+  assert client.batch_get_item.call_count == 6
+  assert sleep.call_count == 3
+
+def test_batch_get_items_gives_up(dynamodb_manager):
+  manager, mock_table = dynamodb_manager
+  mock_table.table_name = 'accounts'
+  manager.dynamodb.meta.client.batch_get_item.return_value = {
+    'Responses': {}, 'UnprocessedKeys': {'accounts': {'Keys': [{'id': '1'}]}}}
+  with patch('src.dynamodb_manager.time.sleep'), pytest.raises(RuntimeError):
+    manager.batch_get_items([{'id': '1'}], max_retries=2)
+
+
+def test_create_items_retries_conflicts(dynamodb_manager):
+  dynamodb_manager_instance, mock_table = dynamodb_manager
+  mock_table.table_name = 'accounts'
+  transact_write_items = dynamodb_manager_instance.dynamodb.meta.client.transact_write_items
+  cancelled = ClientError({'Error': {'Code': 'TransactionCanceledException'},
+                           'CancellationReasons': [{'Code': 'None'}, {'Code': 'ConditionalCheckFailed'}, {'Code': 'TransactionConflict'}]},
+                          'TransactWriteItems')
+  transact_write_items.side_effect = [cancelled, {}]
+  items = [{'id': '1'}, {'id': '2'}, {'id': '3'}]
+  with patch('src.dynamodb_manager.time.sleep') as sleep:
+    assert dynamodb_manager_instance.create_items(items) == ['created', 'exists', 'created']
+  sleep.assert_called_once()
+  retried = transact_write_items.call_args_list[1].kwargs['TransactItems']
+  assert [item['Put']['Item']['id'] for item in retried] == ['1', '3']
+  assert retried[0]['Put']['ConditionExpression'] == 'attribute_not_exists(id)'
+
+def test_create_items_gives_up(dynamodb_manager):
+  dynamodb_manager_instance, mock_table = dynamodb_manager
+  mock_table.table_name = 'accounts'
+  dynamodb_manager_instance.dynamodb.meta.client.transact_write_items.side_effect = ClientError(
+    {'Error': {'Code': 'TransactionCanceledException'}, 'CancellationReasons': [{'Code': 'ThrottlingError'}]}, 'TransactWriteItems')
+  with patch('src.dynamodb_manager.time.sleep'):
+    assert dynamodb_manager_instance.create_items([{'id': '1'}], max_attempts=3) == ['error']
+  assert dynamodb_manager_instance.dynamodb.meta.client.transact_write_items.call_count == 3
+
+
+@pytest.fixture
+def transactions_table():
+  with mock_aws():
+    dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+    dynamodb.create_table(
+      TableName='transactions',
+      KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+      AttributeDefinitions=[{'AttributeName': name, 'AttributeType': 'S'} for name in ('id', 'accountId', 'date')],
+      GlobalSecondaryIndexes=[{
+        'IndexName': 'account_date',
+        'KeySchema': [{'AttributeName': 'accountId', 'KeyType': 'HASH'}, {'AttributeName': 'date', 'KeyType': 'RANGE'}],
+        'Projection': {'ProjectionType': 'ALL'}
+      }],
+      BillingMode='PAY_PER_REQUEST'
+    )
+    with patch.dict('os.environ', {'AWS_REGION': 'us-east-1'}):
+      manager = DynamoDBManager('transactions')
+      manager.save_transactions([
+        {'id': str(i), 'accountId': str(i % 2), 'date': datetime(2024, 6 + i % 3, 1 + i), 'transaction': Decimal(i)}
+        for i in range(24)
+      ])
+      yield manager
+
+def test_query_transactions(transactions_table):
+  july = list(transactions_table.query_transactions('0', date(2024, 7, 1), date(2024, 8, 1)))
+  assert [item['id'] for item in july] == ['4', '10', '16', '22']
+  assert july[0] == {'id': '4', 'accountId': '0', 'date': '2024-07-05T00:00:00', 'transaction': Decimal(4)}
+  # the end bound is exclusive, also when an item falls right on it
+  assert [item['id'] for item in transactions_table.query_transactions('0', '2024-07-05T00:00:00', '2024-07-11T00:00:00')] == ['4']
+  assert len(list(transactions_table.query_transactions('1', start=date(2024, 8, 1)))) == 4
+  assert len(list(transactions_table.query_transactions('1', end=date(2024, 7, 1)))) == 4
+  assert list(transactions_table.query_transactions('2')) == []
+
+def test_query_transactions_pages(transactions_table):
+  with patch.object(transactions_table.table, 'query', wraps=transactions_table.table.query) as query:
+    items = list(transactions_table.query_transactions('1', columns=('date', 'transaction'), page_size=5))
+  assert len(items) == 12
+  assert [item['date'] for item in items] == sorted(item['date'] for item in items)
+  assert all(set(item) == {'date', 'transaction'} for item in items)
+  assert query.call_count == 3
+
+
+def test_update_account_aggregate_applies_a_file_once(aggregates_table):
+  summary = AccountSummary()
+  summary.add(1010, 2, 7)
+  summary.add(-82, 1, 8)
+
+  first = aggregates_table.update_account_aggregate('1', summary, year=2024, file_id='uploads/a.csv#abc')
+  # a retried file finds its marker and is not counted again
+  replayed = aggregates_table.update_account_aggregate('1', summary, year=2024, file_id='uploads/a.csv#abc')
+  assert replayed == first
+  assert replayed['balance'] == Decimal('1.9')
+  assert len(replayed['applied_files']) == 1
+
+  other = aggregates_table.update_account_aggregate('1', summary, year=2024, file_id='uploads/b.csv#def')
+  assert other['balance'] == Decimal('3.8')
+  assert other['credit_count'] == 2
+  assert len(other['applied_files']) == 2
+
+
+@pytest.fixture
+def rollups_table():
+  with mock_aws():
+    dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+    dynamodb.create_table(
+      TableName='monthly_rollups',
+      KeySchema=[{'AttributeName': 'accountId', 'KeyType': 'HASH'}, {'AttributeName': 'month', 'KeyType': 'RANGE'}],
+      AttributeDefinitions=[{'AttributeName': 'accountId', 'AttributeType': 'S'}, {'AttributeName': 'month', 'AttributeType': 'S'}],
+      BillingMode='PAY_PER_REQUEST'
+    )
+    with patch.dict('os.environ', {'AWS_REGION': 'us-east-1'}):
+      yield DynamoDBManager('monthly_rollups')
+
+def test_monthly_rollups(rollups_table):
+  summary = AccountSummary()
+  summary.add(1010, 2, 7)
+  summary.add(-82, 1, 7)
+  summary.add(5, 3, 8)
+  other = AccountSummary()
+  other.add(100, 2, 1)
+
+  assert rollups_table.update_monthly_rollups([('1', summary), ('2', other)], year=2024, workers=4) == 3
+  # a second file adds to the same items
+  rollups_table.update_monthly_rollups([('1', summary)], year=2024)
+
+  assert rollups_table.get_monthly_rollups('1') == [
+    {'accountId': '1', 'month': '2024-07', 'count': 4, 'credit_total': Decimal('20.2'),
+     'debit_total': Decimal('-16.4'), 'balance': Decimal('3.8')},
+    {'accountId': '1', 'month': '2024-08', 'count': 2, 'credit_total': Decimal('0.01'),
+     'debit_total': Decimal('0'), 'balance': Decimal('0.01')},
+  ]
+  assert [item['month'] for item in rollups_table.get_monthly_rollups('1', start_month='2024-08')] == ['2024-08']
+  assert [item['month'] for item in rollups_table.get_monthly_rollups('1', end_month='2024-07')] == ['2024-07']
+  assert rollups_table.get_monthly_rollups('3') == []
+
+def test_monthly_rollups_replay_a_file_after_a_failure(rollups_table):
+  summaries = []
+  for account_id in ('1', '2', '3'):
+    summary = AccountSummary()
+    summary.add(1010, 2, 7)
+    summary.add(-82, 1, 8)
+    summaries.append((account_id, summary))
+  update_rollup = rollups_table._update_rollup
+  calls = []
+
+  def failing_update(*update):
+    calls.append(update)
+    if len(calls) == 4:
+      raise RuntimeError('throttled')
+    return update_rollup(*update)
+
+  with patch.object(rollups_table, '_update_rollup', side_effect=failing_update):
+    with pytest.raises(RuntimeError, match='throttled'):
+      rollups_table.update_monthly_rollups(summaries, year=2024, file_id='uploads/a.csv#abc')
+  # the retry only adds the three items the first attempt did not reach
+  assert rollups_table.update_monthly_rollups(summaries, year=2024, file_id='uploads/a.csv#abc') == 3
+  assert rollups_table.update_monthly_rollups(summaries, year=2024, file_id='uploads/a.csv#abc') == 0
+
+  for account_id in ('1', '2', '3'):
+    items = rollups_table.get_monthly_rollups(account_id)
+    assert [(item['month'], item['count'], item['balance']) for item in items] == [
+      ('2024-07', 1, Decimal('10.1')), ('2024-08', 1, Decimal('-8.2'))]
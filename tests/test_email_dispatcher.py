@@ -0,0 +1,76 @@
+import smtplib
+import threading
+import time
+import pytest
+from botocore.exceptions import ClientError
+from unittest.mock import MagicMock
+from src.email_dispatcher import EmailDispatcher, TokenBucket
+
+
+class FakeClock:
+  def __init__(self):
+    self.now = 0.0
+
+  def __call__(self):
+    return self.now
+
+  def sleep(self, seconds):
+    self.now += seconds
+
+def throttling_error():
+  return ClientError({'Error': {'Code': 'Throttling', 'Message': 'Maximum sending rate exceeded.'}}, 'SendEmail')
+
+
+def test_token_bucket_rate():
+  clock = FakeClock()
+  bucket = TokenBucket(10, capacity=5, clock=clock, sleep=clock.sleep)
+  for _ in range(25):
+    bucket.acquire()
+  # a burst of 5, then 20 more at 10 per second
+  assert clock.now == pytest.approx(2.0)
+
+
+def test_dispatch_is_concurrent():
+  active, peak, lock = [0], [0], threading.Lock()
+
+  def send_email(recipient, subject, html_body):
+    with lock:
+      active[0] += 1
+      peak[0] = max(peak[0], active[0])
+    time.sleep(0.05)
+    with lock:
+      active[0] -= 1
+    return {'MessageId': recipient}
+
+  manager = MagicMock()
+  manager.send_email.side_effect = send_email
+  messages = [(f"{i}@example.com", 'Subject', '<p>body</p>') for i in range(16)]
+  start = time.perf_counter()
+  outcomes = EmailDispatcher(manager, workers=8, rate=1000).dispatch(messages)
+  assert time.perf_counter() - start < 0.5
+  assert peak[0] > 1
+  assert [outcome['message_id'] for outcome in outcomes] == [recipient for recipient, _, _ in messages]
+  assert all(outcome['status'] == 'sent' and outcome['attempts'] == 1 for outcome in outcomes)
+
+
+def test_dispatch_retries_throttling_only():
+  manager = MagicMock()
+  calls = {}
+
+  def send_email(recipient, subject, html_body):
+    calls[recipient] = calls.get(recipient, 0) + 1
+    if recipient == 'throttled@example.com' and calls[recipient] < 3:
+      raise throttling_error()
+    if recipient == 'busy@example.com':
+      raise smtplib.SMTPResponseException(421, b'try later')
+    if recipient == 'bad@example.com':
+      raise ClientError({'Error': {'Code': 'MessageRejected', 'Message': 'Email address is not verified.'}}, 'SendEmail')
+    return {'MessageId': 'id'}
+
+  manager.send_email.side_effect = send_email
+  dispatcher = EmailDispatcher(manager, workers=2, rate=1000, max_attempts=3, backoff_seconds=0.001)
+  outcomes = dispatcher.dispatch([(recipient, 'Subject', 'body') for recipient in
+                                  ('throttled@example.com', 'bad@example.com', 'busy@example.com')])
+
+  assert [(outcome['status'], outcome['attempts']) for outcome in outcomes] == [('sent', 3), ('failed', 1), ('failed', 3)]
+  assert 'not verified' in outcomes[1]['error']
@@ -1,8 +1,13 @@
 import pytest
 from botocore.stub import Stubber
 import boto3
-from src.email_manager import EmailManager
+from src.email_manager import EmailManager, SMTPPool
 import os
+import json
+import smtplib
+import socket
+import socketserver
+import threading
 from unittest.mock import patch, MagicMock, ANY
 
 
@@ -70,7 +75,6 @@ def test_send_email_ses(email_manager_ses, ses_client_stub, recipient, subject,
     stubber.assert_no_pending_responses()  # Verify all expected responses were used
 
 
-
 def test_send_email_smtp(email_manager_smtp, recipient, subject, html_body):
   with patch('smtplib.SMTP') as mock_smtp:
     mock_server = MagicMock()
@@ -85,5 +89,172 @@ def test_send_email_smtp(email_manager_smtp, recipient, subject, html_body):
     mock_server.starttls.assert_called_once()
     mock_server.login.assert_called_once_with('user', 'password')
     mock_server.sendmail.assert_called_once_with(email_manager_smtp.sender, recipient, ANY)
+    # the session stays open for the next message until close()
+    mock_server.quit.assert_not_called()
+    email_manager_smtp.close()
     mock_server.quit.assert_called_once()
 
+
+def bulk_request(sender, recipients):
+  return {
+    'Source': sender,
+    'Template': 'transaction_summary',
+    'DefaultTemplateData': '{}',
+    'Destinations': [{
+      'Destination': {'ToAddresses': [recipient]},
+      'ReplacementTemplateData': json.dumps({'total_balance': recipient.split('@')[0]})
+    } for recipient in recipients]
+  }
+
+def test_send_bulk_templated_email(email_manager_ses, ses_client_stub):
+  _, stubber = ses_client_stub
+  recipients = [f"{i}@example.com" for i in range(120)]
+  destinations = [(recipient, {'total_balance': recipient.split('@')[0]}) for recipient in recipients]
+  # 120 destinations go out in chunks of 50, 50 and 20
+  for chunk in (recipients[:50], recipients[50:100], recipients[100:]):
+    statuses = [{'Status': 'Success', 'MessageId': recipient} for recipient in chunk]
+    if chunk[0] == '0@example.com':
+      statuses[3] = {'Status': 'TransientFailure', 'Error': 'try again'}
+      statuses[4] = {'Status': 'MessageRejected', 'Error': 'rejected'}
+    stubber.add_response('send_bulk_templated_email', {'Status': statuses}, bulk_request(email_manager_ses.sender, chunk))
+  # only the transient failure is sent again
+  stubber.add_response('send_bulk_templated_email', {'Status': [{'Status': 'Success', 'MessageId': 'retried'}]},
+                       bulk_request(email_manager_ses.sender, ['3@example.com']))
+
+  with stubber:
+    results = email_manager_ses.send_bulk_templated_email('transaction_summary', destinations, backoff_seconds=0)
+    stubber.assert_no_pending_responses()
+
+  assert len(results) == 120
+  assert results[3] == {'Status': 'Success', 'MessageId': 'retried'}
+  assert results[4]['Status'] == 'MessageRejected'
+  assert results[119] == {'Status': 'Success', 'MessageId': '119@example.com'}
+
+
+def test_send_bulk_templated_email_gives_up(email_manager_ses, ses_client_stub):
+  _, stubber = ses_client_stub
+  for _ in range(2):
+    stubber.add_response('send_bulk_templated_email', {'Status': [{'Status': 'Failed', 'Error': 'down'}]},
+                         bulk_request(email_manager_ses.sender, ['1@example.com']))
+  with stubber:
+    results = email_manager_ses.send_bulk_templated_email('transaction_summary', [('1@example.com', {'total_balance': '1'})],
+                                                          max_attempts=2, backoff_seconds=0)
+    stubber.assert_no_pending_responses()
+  assert results == [{'Status': 'Failed', 'Error': 'down'}]
+
+
+
+class SMTPStubHandler(socketserver.StreamRequestHandler):
+  """Minimal SMTP server session: accepts every message and records it."""
+
+  def reply(self, line):
+    self.wfile.write(line.encode() + b'\r\n')
+
+  def handle(self):
+    server = self.server
+    server.connections += 1
+    self.reply('220 stub ready')
+    while True:
+      line = self.rfile.readline().decode().strip()
+      if not line:
+        return
+      command = line.split(' ')[0].upper()
+      if command in ('EHLO', 'HELO'):
+        self.reply('250 stub')
+      elif command == 'DATA':
+        self.reply('354 end with .')
+        while self.rfile.readline().strip() != b'.':
+          pass
+        server.messages += 1
+        self.reply('250 queued')
+        if server.drop_after_message:
+          server.drop_after_message = False
+          return
+      elif command == 'RCPT' and any(address in line for address in server.refused):
+        self.reply('550 no such user')
+      elif command == 'QUIT':
+        server.quits += 1
+        self.reply('221 bye')
+        return
+      else:
+        self.reply('250 ok')
+
+@pytest.fixture
+def smtp_stub():
+  server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SMTPStubHandler)
+  server.daemon_threads = True
+  server.connections = server.messages = server.quits = 0
+  server.drop_after_message = False
+  server.refused = set()
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  yield server
+  server.shutdown()
+  server.server_close()
+
+def test_smtp_pool_reuses_connections(smtp_stub):
+  pool = SMTPPool('127.0.0.1', smtp_stub.server_address[1], starttls=False)
+  for i in range(5):
+    pool.sendmail('sender@example.com', f'{i}@example.com', 'Subject: test\r\n\r\nbody')
+  pool.close()
+  assert (smtp_stub.connections, smtp_stub.messages, smtp_stub.quits) == (1, 5, 1)
+
+def test_smtp_pool_reconnects_dropped_connections(smtp_stub):
+  pool = SMTPPool('127.0.0.1', smtp_stub.server_address[1], starttls=False)
+  smtp_stub.drop_after_message = True
+  pool.sendmail('sender@example.com', 'a@example.com', 'Subject: test\r\n\r\nbody')
+  pool.sendmail('sender@example.com', 'b@example.com', 'Subject: test\r\n\r\nbody')
+  pool.close()
+  assert (smtp_stub.connections, smtp_stub.messages, smtp_stub.quits) == (2, 2, 1)
+
+def test_smtp_pool_reconnects_timed_out_connections(smtp_stub):
+  pool = SMTPPool('127.0.0.1', smtp_stub.server_address[1], starttls=False)
+  stale = MagicMock()
+  stale.noop.side_effect = socket.timeout('timed out')
+  pool._idle.put(stale)
+  pool.sendmail('sender@example.com', 'a@example.com', 'Subject: test\r\n\r\nbody')
+  pool.close()
+  stale.close.assert_called_once()
+  stale.sendmail.assert_not_called()
+  assert (smtp_stub.connections, smtp_stub.messages) == (1, 1)
+
+def test_smtp_pool_keeps_the_session_of_a_refused_recipient(smtp_stub):
+  pool = SMTPPool('127.0.0.1', smtp_stub.server_address[1], starttls=False)
+  smtp_stub.refused.add('unknown@example.com')
+  for _ in range(3):
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+      pool.sendmail('sender@example.com', 'unknown@example.com', 'Subject: test\r\n\r\nbody')
+  pool.sendmail('sender@example.com', 'a@example.com', 'Subject: test\r\n\r\nbody')
+  pool.close()
+  # no reconnect and no second attempt of the refused messages
+  assert (smtp_stub.connections, smtp_stub.messages, smtp_stub.quits) == (1, 1, 1)
+
+def test_smtp_pool_does_not_resend_after_a_broken_send(smtp_stub):
+  pool = SMTPPool('127.0.0.1', smtp_stub.server_address[1], starttls=False)
+  broken = MagicMock()
+  broken.noop.return_value = (250, b'ok')
+  broken.sendmail.side_effect = socket.timeout('timed out')
+  pool._idle.put(broken)
+  with pytest.raises(socket.timeout):
+    pool.sendmail('sender@example.com', 'a@example.com', 'Subject: test\r\n\r\nbody')
+  pool.close()
+  broken.sendmail.assert_called_once()
+  broken.close.assert_called_once()
+  assert smtp_stub.connections == 0
+
+def test_smtp_pool_is_created_once_across_threads(email_manager_smtp):
+  barrier = threading.Barrier(8)
+  pools = []
+
+  def get():
+    barrier.wait()
+    pools.append(email_manager_smtp._smtp_pool())
+
+  with patch('src.email_manager.SMTPPool') as pool_class:
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+  assert pool_class.call_count == 1
+  assert len({id(pool) for pool in pools}) == 1
@@ -1,60 +1,63 @@
-# import os
-# import pytest
-# from moto import mock_aws
-# import boto3
-# from src.lambda_account import lambda_handler
-# from botocore.exceptions import ClientError
-
-# @pytest.fixture(scope='function')
-# def aws_credentials():
-#     """Mocked AWS Credentials for moto."""
-
-# @pytest.fixture(scope='function')
-# def dynamodb(aws_credentials):
-#     with mock_aws():
-#         yield boto3.resource('dynamodb', region_name='us-east-1')
-
-# @pytest.fixture(scope='function')
-# def create_table(dynamodb):
-#     table = dynamodb.create_table(
-#         TableName='accounts',
-#         KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
-#         AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
-#         ProvisionedThroughput={'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1}
-#     )
-#     return table
-
-# def test_create_account_success(create_table):
-#     """Test successful account creation."""
-#     event = {'body': '{"id": "1", "email": "test@example.com"}'}
-#     response = lambda_handler(event, None)
-#     assert response['statusCode'] == 201
-#     assert 'Account created successfully' in response['body']
-    
-#     # Verify that account is in the table
-#     table = create_table
-#     try:
-#         response = table.get_item(Key={'id': '1'})
-#         item = response['Item']
-#         assert item['email'] == 'test@example.com'
-#     except ClientError as e:
-#         pytest.fail(f"DynamoDB get_item raised an exception: {e}")
-
-# def test_create_account_existing_account(create_table):
-#     """Test creating an account that already exists."""
-#     table = create_table
-#     table.put_item(Item={'id': '1', 'email': 'test@example.com'})
-#     event = {'body': '{"id": "1", "email": "test@example.com"}'}
-    
-#     response = lambda_handler(event, None)
-#     assert response['statusCode'] == 409
-#     assert 'Account already exists' in response['body']
-
-# def test_create_account_invalid_payload(create_table):
-#     """Test account creation with an invalid payload."""
-#     event = {'body': 'not a json'}
-#     response = lambda_handler(event, None)
-#     assert response['statusCode'] == 400
-#     assert 'Invalid request body' in response['body']
-
-# # More test cases as needed...
+import json
+import pytest
+from moto import mock_aws
+import boto3
+from unittest.mock import patch
+from src.lambda_account import lambda_handler
+
+
+@pytest.fixture
+def accounts_table(monkeypatch):
+  monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+  monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+  monkeypatch.setenv('AWS_REGION', 'us-east-1')
+  with mock_aws(), patch('src.lambda_account.DYNAMODB_ACCOUNTS_TABLE_NAME', 'accounts'):
+    dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+    yield dynamodb.create_table(
+      TableName='accounts',
+      KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+      AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
+      BillingMode='PAY_PER_REQUEST'
+    )
+
+def test_create_account_success(accounts_table):
+  response = lambda_handler({'body': '{"id": "1", "email": "test@example.com"}'}, None)
+  assert response == {'statusCode': 201, 'body': 'Account created successfully'}
+  assert accounts_table.get_item(Key={'id': '1'})['Item']['email'] == 'test@example.com'
+
+def test_create_account_existing_account(accounts_table):
+  accounts_table.put_item(Item={'id': '1', 'email': 'old@example.com'})
+  response = lambda_handler({'body': '{"id": "1", "email": "test@example.com"}'}, None)
+  assert response == {'statusCode': 409, 'body': 'Account already exists'}
+  # the existing account is left alone
+  assert accounts_table.get_item(Key={'id': '1'})['Item']['email'] == 'old@example.com'
+
+def test_create_account_invalid_payload(accounts_table):
+  assert lambda_handler({'body': 'not a json'}, None)['statusCode'] == 400
+  assert lambda_handler({'body': '{"id": "1"}'}, None)['statusCode'] == 400
+  assert lambda_handler({'body': '[]'}, None)['statusCode'] == 400
+  assert lambda_handler({'body': '{"id": 1, "email": "a@example.com"}'}, None)['statusCode'] == 400
+
+def test_create_accounts_batch(accounts_table):
+  accounts_table.put_item(Item={'id': '7', 'email': 'old@example.com'})
+  accounts = [{'id': str(i), 'email': f'{i}@example.com'} for i in range(250)]
+  accounts += [{'id': '3', 'email': 'again@example.com'}, {'id': '', 'email': 'x@example.com'}, 'nope',
+               {'id': ['x'], 'email': 'a@example.com'}, {'id': 5, 'email': 'b@example.com'}, {'id': 'c', 'email': 7}]
+  response = lambda_handler({'body': json.dumps(accounts)}, None)
+
+  body = json.loads(response['body'])
+  assert response['statusCode'] == 207
+  assert body['created'] == 249
+  statuses = [result['status'] for result in body['results']]
+  assert statuses[7] == 'exists'
+  assert statuses[250:] == ['duplicate'] + ['invalid'] * 5
+  assert statuses.count('created') == 249
+  assert accounts_table.get_item(Key={'id': '3'})['Item']['email'] == '3@example.com'
+  assert accounts_table.get_item(Key={'id': '249'})['Item']['email'] == '249@example.com'
+
+def test_create_accounts_batch_all_created(accounts_table):
+  accounts = [{'id': 'a', 'email': 'a@example.com'}, {'id': 'b', 'email': 'b@example.com'}]
+  response = lambda_handler({'body': json.dumps(accounts)}, None)
+  assert response['statusCode'] == 201
+  assert json.loads(response['body']) == {'created': 2, 'results': [{'id': 'a', 'status': 'created'},
+                                                                    {'id': 'b', 'status': 'created'}]}
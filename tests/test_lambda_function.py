@@ -1,9 +1,14 @@
 import json
 import os
+import subprocess
+import sys
 import pytest
 from moto import mock_aws
 from unittest.mock import patch, MagicMock
-from src.lambda_function import lambda_handler
+from src.lambda_function import account_emails, get_email, get_emails, lambda_handler, lifetime_figures, ses_template_data, summary_figures
+from src.util import summarize_transactions
+from src.metrics import ListSink, Metrics
+from decimal import Decimal
 import boto3
 
 # Setup mock S3
@@ -69,6 +74,300 @@ def test_lambda_handler(s3_setup, dynamodb_setup, email_manager_mock, dynamodb_m
   assert 'Successfully processed transactions' in response['body']
 
 
+def test_lambda_handler_emits_metrics(s3_setup, dynamodb_setup, email_manager_mock, dynamodb_manager_mock):
+  mock_event = {
+      'Records': [{
+          's3': {
+              'bucket': {'name': 'stori-challenge-transaction-bucket'},
+              'object': {'key': 'uploads/stori_challenge_123.csv'}
+          }
+      }],
+      'running_type': 'local'
+  }
+  sink = ListSink()
+  with patch('src.lambda_function.Metrics.from_env', return_value=Metrics(sink=sink)):
+    lambda_handler(mock_event, None)
+
+  assert len(sink.records) == 1
+  record = sink.records[0]
+  assert record['invocation_count'] == 1
+  assert record['parse_aggregate_count'] == 1
+  assert record['s3_read_count'] >= 1
+
+def test_lambda_handler_skips_processed_file(s3_setup, email_manager_mock, dynamodb_manager_mock):
+  mock_event = {
+      'Records': [{
+          's3': {
+              'bucket': {'name': 'stori-challenge-transaction-bucket'},
+              'object': {'key': 'uploads/stori_challenge_123.csv', 'eTag': 'abc123'}
+          }
+      }]
+  }
+  dynamodb_manager_mock.return_value.claim_processing.return_value = False
+  with patch.dict('os.environ', {'DYNAMODB_MANIFEST_TABLE_NAME': 'processed_files'}):
+    response = lambda_handler(mock_event, None)
+
+  assert response['statusCode'] == 200
+  assert 'already processed' in response['body']
+  dynamodb_manager_mock.return_value.claim_processing.assert_called_once_with(
+    'stori-challenge-transaction-bucket/uploads/stori_challenge_123.csv#abc123')
+  dynamodb_manager_mock.return_value.save_transactions.assert_not_called()
+  email_manager_mock.assert_not_called()
+
+
+def upload_transactions(rows):
+  s3 = boto3.resource('s3', region_name='us-east-1')
+  body = 'Id;AccountId;Date;Transaction\n' + ''.join(f'{i};{i % 3};jul-15;+{i}.5\n' for i in range(rows))
+  s3.Object('stori-challenge-transaction-bucket', 'uploads/stori_challenge_123.csv').put(Body=body)
+  return {'Records': [{'s3': {'bucket': {'name': 'stori-challenge-transaction-bucket'},
+                              'object': {'key': 'uploads/stori_challenge_123.csv', 'eTag': 'abc123'}}}]}
+
+def saving_into(saved):
+  def save_transactions(rows, workers):
+    rows = list(rows)
+    saved.extend(rows)
+    return {'items': len(rows)}
+  return save_transactions
+
+def test_lambda_handler_saves_before_emailing(s3_setup, email_manager_mock, dynamodb_manager_mock):
+  event = upload_transactions(500)
+  saved = []
+  dynamodb_manager_mock.return_value.save_transactions.side_effect = saving_into(saved)
+  with patch('src.lambda_function.get_emails', return_value={'0': 'a@example.com', '1': 'b@example.com', '2': 'c@example.com'}):
+    response = lambda_handler(event, None)
+
+  assert response['statusCode'] == 200
+  assert sorted(int(row['id']) for row in saved) == list(range(500))
+  assert email_manager_mock.return_value.send_email.call_count == 3
+
+def test_lambda_handler_writes_monthly_rollups(s3_setup, email_manager_mock, dynamodb_manager_mock):
+  event = upload_transactions(30)
+  rolled_up = {}
+  file_ids = set()
+
+  def update_monthly_rollups(pairs, workers, file_id):
+    file_ids.add(file_id)
+    rolled_up.update(pairs)
+  dynamodb_manager_mock.return_value.save_transactions.side_effect = saving_into([])
+  dynamodb_manager_mock.return_value.update_monthly_rollups.side_effect = update_monthly_rollups
+  with patch.dict('os.environ', {'DYNAMODB_ROLLUPS_TABLE_NAME': 'monthly_rollups'}), \
+       patch('src.lambda_function.get_emails', return_value={}):
+    assert lambda_handler(event, None)['statusCode'] == 200
+  dynamodb_manager_mock.assert_any_call('monthly_rollups')
+  assert sorted(rolled_up) == ['0', '1', '2']
+  assert [month[:2] for month in rolled_up['0'].monthly_totals()] == [(7, 10)]
+  assert file_ids == {'stori-challenge-transaction-bucket/uploads/stori_challenge_123.csv#abc123'}
+
+def test_lambda_handler_marks_the_aggregates_with_the_file(s3_setup, email_manager_mock, dynamodb_manager_mock):
+  event = upload_transactions(30)
+  dynamodb_manager_mock.return_value.save_transactions.side_effect = saving_into([])
+  dynamodb_manager_mock.return_value.update_account_aggregate.return_value = None
+  with patch.dict('os.environ', {'DYNAMODB_AGGREGATES_TABLE_NAME': 'account_aggregates'}), \
+       patch('src.lambda_function.get_emails', return_value={}):
+    assert lambda_handler(event, None)['statusCode'] == 200
+  calls = dynamodb_manager_mock.return_value.update_account_aggregate.call_args_list
+  assert sorted(call.args[0] for call in calls) == ['0', '1', '2']
+  # a retry of the same object version is recognized by the aggregate items
+  assert {call.kwargs['file_id'] for call in calls} == {'stori-challenge-transaction-bucket/uploads/stori_challenge_123.csv#abc123'}
+
+def test_lambda_handler_raises_save_errors(s3_setup, email_manager_mock, dynamodb_manager_mock):
+  event = upload_transactions(500)
+
+  def save_transactions(rows, workers):
+    next(rows)
+    raise RuntimeError('write failed')
+  dynamodb_manager_mock.return_value.save_transactions.side_effect = save_transactions
+  with patch.dict('os.environ', {'DYNAMODB_MANIFEST_TABLE_NAME': 'processed_files'}), \
+       patch('src.lambda_function.get_emails', return_value={}):
+    with pytest.raises(RuntimeError, match='write failed'):
+      lambda_handler(event, None)
+  # the claim is released so the redelivered event processes the file again,
+  # and nothing was counted or sent that the retry would repeat
+  dynamodb_manager_mock.return_value.delete_item.assert_called_once()
+  dynamodb_manager_mock.return_value.mark_processed.assert_not_called()
+  dynamodb_manager_mock.return_value.update_account_aggregate.assert_not_called()
+  email_manager_mock.return_value.send_email.assert_not_called()
+
+def test_lambda_handler_fails_the_file_when_an_email_fails(s3_setup, email_manager_mock, dynamodb_manager_mock):
+  event = upload_transactions(30)
+  dynamodb_manager_mock.return_value.save_transactions.side_effect = saving_into([])
+  dynamodb_manager_mock.return_value.claim_processing.return_value = True
+  with patch.dict('os.environ', {'DYNAMODB_MANIFEST_TABLE_NAME': 'processed_files'}), \
+       patch('src.lambda_function.EmailDispatcher') as dispatcher_class, \
+       patch('src.lambda_function.get_emails', return_value={'0': 'a@example.com', '1': 'b@example.com', '2': 'c@example.com'}):
+    dispatcher_class.return_value.dispatch.side_effect = lambda messages: [
+      {'recipient': recipient, 'status': 'failed' if recipient == 'b@example.com' else 'sent', 'seconds': 0.1}
+      for recipient, _, _ in messages]
+    with pytest.raises(RuntimeError, match='emails of 1 accounts .* were not sent: 1'):
+      lambda_handler(event, None)
+  # the file is not marked as processed, so account 1 gets its email on the retry
+  dynamodb_manager_mock.return_value.delete_item.assert_called_once()
+  dynamodb_manager_mock.return_value.mark_processed.assert_not_called()
+
+def test_lambda_handler_reports_failed_bulk_emails(s3_setup, email_manager_mock, dynamodb_manager_mock):
+  upload_transactions(30)
+  dynamodb_manager_mock.return_value.save_transactions.side_effect = saving_into([])
+  email_manager_mock.return_value.send_bulk_templated_email.side_effect = lambda template, destinations: [
+    {'Status': 'TransientFailure'} if recipient == 'c@example.com' else {'Status': 'Success'} for recipient, _ in destinations]
+  event = {'Records': [{'messageId': 'm1', 'body': json.dumps({'Records': [s3_record('uploads/stori_challenge_123.csv')]})}]}
+  with patch.dict('os.environ', {'EMAIL_DELIVERY': 'bulk'}), \
+       patch('src.lambda_function.get_emails', return_value={'0': 'a@example.com', '1': 'b@example.com', '2': 'c@example.com'}):
+    response = lambda_handler(event, None)
+  assert response['batchItemFailures'] == [{'itemIdentifier': 'm1'}]
+
+def test_lambda_handler_checks_every_row_was_saved(s3_setup, email_manager_mock, dynamodb_manager_mock):
+  event = upload_transactions(50)
+  dynamodb_manager_mock.return_value.save_transactions.side_effect = lambda rows, workers: {'items': len(list(rows)) - 1}
+  with patch('src.lambda_function.get_emails', return_value={'0': 'a@example.com'}):
+    with pytest.raises(RuntimeError, match='Saved 49 of the 50'):
+      lambda_handler(event, None)
+  email_manager_mock.return_value.send_email.assert_not_called()
+
+
+def s3_record(key):
+  return {'s3': {'bucket': {'name': 'stori-challenge-transaction-bucket'}, 'object': {'key': key, 'eTag': key}}}
+
+def test_lambda_handler_processes_every_record(s3_setup, email_manager_mock, dynamodb_manager_mock):
+  s3 = boto3.resource('s3', region_name='us-east-1')
+  keys = [f'uploads/stori_challenge_{i}.csv' for i in range(3)]
+  for i, key in enumerate(keys):
+    s3.Object('stori-challenge-transaction-bucket', key).put(Body=f'Id;AccountId;Date;Transaction\n{i};0;jul-15;+1.5\n')
+  saved = []
+  dynamodb_manager_mock.return_value.save_transactions.side_effect = saving_into(saved)
+  sink = ListSink()
+  with patch('src.lambda_function.Metrics.from_env', return_value=Metrics(sink=sink)), \
+       patch('src.lambda_function.get_emails', return_value={}):
+    response = lambda_handler({'Records': [s3_record(key) for key in keys]}, None)
+
+  assert response == {'statusCode': 200, 'body': 'Processed 3 of 3 files.', 'batchItemFailures': []}
+  assert sorted(row['id'] for row in saved) == ['0', '1', '2']
+  assert sink.records[0]['save_transactions_count'] == 3
+
+def test_lambda_handler_shares_the_send_rate_between_records(s3_setup, email_manager_mock, dynamodb_manager_mock):
+  s3 = boto3.resource('s3', region_name='us-east-1')
+  keys = [f'uploads/stori_challenge_{i}.csv' for i in range(3)]
+  for i, key in enumerate(keys):
+    s3.Object('stori-challenge-transaction-bucket', key).put(Body=f'Id;AccountId;Date;Transaction\n{i};{i};jul-15;+1.5\n')
+  dynamodb_manager_mock.return_value.save_transactions.side_effect = saving_into([])
+  with patch('src.lambda_function.EmailDispatcher') as dispatcher_class, \
+       patch('src.lambda_function.get_emails', side_effect=lambda account_ids: {a: 'a@example.com' for a in account_ids}):
+    dispatcher_class.return_value.dispatch.return_value = []
+    lambda_handler({'Records': [s3_record(key) for key in keys]}, None)
+
+  buckets = {id(call.kwargs['bucket']) for call in dispatcher_class.call_args_list}
+  assert dispatcher_class.call_count == 3 and len(buckets) == 1
+
+def test_lambda_handler_reports_failed_sqs_messages(s3_setup, email_manager_mock, dynamodb_manager_mock):
+  upload_transactions(10)
+  dynamodb_manager_mock.return_value.save_transactions.side_effect = saving_into([])
+  event = {'Records': [
+    {'messageId': 'good', 'body': json.dumps({'Records': [s3_record('uploads/stori_challenge_123.csv')]})},
+    {'messageId': 'missing', 'body': json.dumps({'Records': [s3_record('uploads/missing.csv')]})},
+    {'messageId': 'garbled', 'body': 'not json'}
+  ]}
+  with patch('src.lambda_function.get_emails', return_value={}):
+    response = lambda_handler(event, None)
+
+  assert response['statusCode'] == 200
+  assert response['body'] == 'Processed 1 of 2 files.'
+  assert response['batchItemFailures'] == [{'itemIdentifier': 'garbled'}, {'itemIdentifier': 'missing'}]
+
+def test_lambda_handler_spills_large_files(s3_setup, email_manager_mock, dynamodb_manager_mock, tmp_path):
+  event = upload_transactions(90)
+  event['Records'][0]['s3']['object']['size'] = 2048
+  saved = []
+  dynamodb_manager_mock.return_value.save_transactions.side_effect = saving_into(saved)
+  emails = {str(account): f'{account}@example.com' for account in range(3)}
+  with patch.dict('os.environ', {'SPILL_THRESHOLD_BYTES': '1024', 'SPILL_PARTITIONS': '8', 'SPILL_DIR': str(tmp_path)}), \
+       patch('src.lambda_function.get_emails', side_effect=lambda account_ids: {a: emails[a] for a in account_ids}) as get_emails:
+    assert lambda_handler(event, None)['statusCode'] == 200
+
+  assert len(saved) == 90
+  # the accounts are emailed one partition at a time
+  assert sorted(account for call in get_emails.call_args_list for account in call.args[0]) == ['0', '1', '2']
+  assert get_emails.call_count == 3
+  assert email_manager_mock.return_value.send_email.call_count == 3
+  assert os.listdir(tmp_path) == []
+
+def test_lambda_handler_deduplicates_large_files_by_partition(s3_setup, email_manager_mock, dynamodb_manager_mock, tmp_path):
+  event = upload_transactions(90)
+  event['Records'][0]['s3']['object']['size'] = 2048
+  calls = []
+  dynamodb_manager_mock.return_value.save_transactions.side_effect = lambda rows, workers: calls.append(('save', len(list(rows))))
+  email_manager_mock.return_value.send_email.side_effect = lambda *args: calls.append(('email',)) or {'MessageId': '1'}
+  emails = {str(account): f'{account}@example.com' for account in range(3)}
+  with patch.dict('os.environ', {'SPILL_THRESHOLD_BYTES': '1024', 'SPILL_PARTITIONS': '8', 'SPILL_DIR': str(tmp_path),
+                                 'DYNAMODB_TRANSACTION_INDEX_TABLE_NAME': 'transaction_index'}), \
+       patch('transaction_index.TransactionIndex') as index_class, \
+       patch('src.lambda_function.get_emails', side_effect=lambda account_ids: {a: emails[a] for a in account_ids}):
+    index = index_class.return_value
+    index.iter_new.side_effect = lambda rows: rows
+    index.commit.side_effect = lambda: calls.append(('commit',))
+    assert lambda_handler(event, None)['statusCode'] == 200
+
+  # every partition is saved, emailed and committed before the next one
+  assert calls == [('save', 30), ('email',), ('commit',)] * 3
+  assert index.evict.call_count == 3
+
+def test_lambda_function_import_does_not_load_botocore():
+  # in a fresh interpreter, as the Lambda runtime imports the handler;
+  # boto3 and botocore wait for the first client
+  src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+  probe = "import sys, lambda_function; print(sorted(name for name in sys.modules if name.split('.')[0] in ('boto3', 'botocore')))"
+  output = subprocess.run([sys.executable, '-c', probe], cwd=src, capture_output=True, text=True, check=True,
+                          env={**os.environ, 'AWS_EXECUTION_ENV': 'AWS_Lambda_python3.11'}).stdout
+  assert output.strip() == '[]'
+
+def test_summary_figures():
+  summary = summarize_transactions(['Id;AccountId;Date;Transaction', '1;1;jul-23;+60.5', '2;1;jul-23;-10.3'])['1']
+  figures = summary_figures(summary)
+  assert figures['total_balance'] == '50.20'
+  assert figures['average_credit'] == '60.50'
+  assert figures['average_debit'] == '-10.30'
+  assert list(figures['transactions_by_month'].values()) == [2]
+
+
+def test_ses_template_data():
+  data = ses_template_data({'total_balance': '1.00', 'transactions_by_month': {'July': 2, 'May': 1}})
+  assert data == {'total_balance': '1.00', 'transactions_by_month': [{'month': 'July', 'count': 2}, {'month': 'May', 'count': 1}]}
+
+
+def test_get_emails(aws_credentials):
+  with mock_aws():
+    dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+    table = dynamodb.create_table(
+        TableName='accounts',
+        KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
+        ProvisionedThroughput={'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1}
+    )
+    for i in range(0, 300, 2):
+      table.put_item(Item={'id': str(i), 'email': f'{i}@example.com'})
+    account_emails.clear()
+    with patch.dict('os.environ', {'DYNAMODB_ACCOUNTS_TABLE_NAME': 'accounts'}):
+      emails = get_emails(range(300))
+      # a warm invocation answers every account from the cache
+      hits = account_emails.hits
+      with patch('src.lambda_function.DynamoDBManager') as manager:
+        assert get_emails(range(300)) == emails
+        assert get_email(42) == '42@example.com'
+      manager.assert_not_called()
+  assert len(emails) == 150
+  assert emails['42'] == '42@example.com' and '43' not in emails
+  assert account_emails.hits - hits == 301
+  account_emails.clear()
+
+
+def test_lifetime_figures():
+  aggregate = {'balance': Decimal('3.81'), 'credit_total': Decimal('20.21'), 'credit_count': Decimal(4),
+               'debit_total': Decimal('-16.4'), 'debit_count': Decimal(0)}
+  assert lifetime_figures(aggregate) == {
+    'lifetime_balance': '3.81',
+    'lifetime_average_credit': '5.05',
+    'lifetime_average_debit': '0.00'
+  }
+
+
 # @pytest.fixture
 # def dynamodb_table(aws_credentials):
 #   with mock_aws():
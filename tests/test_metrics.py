@@ -0,0 +1,104 @@
+import time
+import tracemalloc
+from src.metrics import ListSink, Metrics
+
+
+def test_nested_stages_are_charged_their_own_time():
+  sink = ListSink()
+  metrics = Metrics(sink=sink, dimensions={'FunctionName': 'test'})
+  with metrics.stage('outer'):
+    time.sleep(0.02)
+    with metrics.stage('inner'):
+      time.sleep(0.05)
+  metrics.emit()
+
+  record = sink.records[0]
+  assert record['FunctionName'] == 'test'
+  assert record['outer_count'] == 1 and record['inner_count'] == 1
+  assert 45 <= record['inner_time'] < 200
+  assert 15 <= record['outer_time'] < 45
+  definitions = record['_aws']['CloudWatchMetrics'][0]
+  assert definitions['Dimensions'] == [['FunctionName']]
+  assert {'Name': 'inner_time', 'Unit': 'Milliseconds'} in definitions['Metrics']
+
+
+def test_timed_iterators():
+  sink = ListSink()
+  metrics = Metrics(sink=sink)
+
+  def slow_rows():
+    for i in range(3):
+      time.sleep(0.01)
+      yield i
+
+  rows = metrics.timed('read', slow_rows())
+  with metrics.stage('save'):
+    assert [row * 2 for row in metrics.timed('parse', rows)] == [0, 2, 4]
+  metrics.observe('email_latency', 0.0015)
+  metrics.emit()
+
+  record = sink.records[0]
+  assert record['read_count'] == 4 and record['parse_count'] == 4
+  assert record['read_time'] >= 30
+  assert record['parse_time'] < 10 and record['save_time'] < 10
+  assert record['email_latency'] == [1.5]
+
+
+def test_peak_memory():
+  sink = ListSink()
+  metrics = Metrics(sink=sink, trace_memory=True)
+  with metrics.stage('outer'):
+    with metrics.stage('allocate'):
+      data = bytearray(4 * 1024 * 1024)
+      del data
+    with metrics.stage('small'):
+      pass
+  metrics.emit()
+
+  record = sink.records[0]
+  assert record['allocate_peak_memory'] >= 4 * 1024 * 1024
+  assert record['outer_peak_memory'] >= 4 * 1024 * 1024
+  assert record['small_peak_memory'] < 1024 * 1024
+  assert not tracemalloc.is_tracing()
+
+
+def test_disabled_metrics_do_nothing():
+  sink = ListSink()
+  metrics = Metrics(enabled=False, sink=sink)
+  rows = [1, 2]
+  assert metrics.timed('parse', rows) is rows
+  with metrics.stage('save'):
+    pass
+  metrics.observe('email_latency', 1)
+  metrics.emit()
+  assert sink.records == [] and metrics.stages == {}
+
+def test_merge_adds_child_metrics():
+  sink = ListSink()
+  metrics = Metrics(sink=sink)
+  children = [metrics.child() for _ in range(2)]
+  for child in children:
+    with child.stage('parse'):
+      child.observe('rows', 10)
+  for child in children:
+    metrics.merge(child)
+  metrics.emit()
+
+  assert len(sink.records) == 1
+  assert sink.records[0]['parse_count'] == 2
+
+def test_observations_are_split_in_records_of_100_values():
+  sink = ListSink()
+  metrics = Metrics(sink=sink)
+  with metrics.stage('send'):
+    for i in range(250):
+      metrics.observe('email_latency', i / 1000)
+  metrics.observe('render_latency', 0.002)
+  metrics.emit()
+
+  assert len(sink.records) == 3
+  assert [len(record['email_latency']) for record in sink.records] == [100, 100, 50]
+  assert sink.records[0]['send_count'] == 1 and sink.records[0]['render_latency'] == [2.0]
+  assert 'send_count' not in sink.records[1] and 'render_latency' not in sink.records[1]
+  assert [m['Name'] for m in sink.records[2]['_aws']['CloudWatchMetrics'][0]['Metrics']] == ['email_latency']
+  assert sink.records[2]['email_latency'][-1] == 249.0
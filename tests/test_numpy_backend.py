@@ -0,0 +1,56 @@
+import random
+from unittest.mock import patch
+import pytest
+
+pytest.importorskip('numpy')
+
+from src.numpy_backend import summarize_transactions_numpy, iter_summarized_transactions
+from src.util import summarize_transactions, iter_transactions
+
+
+def generate_lines(rows, accounts, seed=11, amount=None):
+  rng = random.Random(seed)
+  dates = ['jul-23', 'jun-02', 'may-15', 'oct-01', 'nov-30', 'feb-28', 'xxx-01']
+  lines = ['Id;AccountId;Date;Transaction']
+  for i in range(rows):
+    value = amount(rng) if amount else f"{rng.choice('+-')}{rng.randint(0, 10 ** 7) / 100}"
+    lines.append(f"{i};{rng.randint(1, accounts)};{rng.choice(dates)};{value}")
+  return lines
+
+def assert_same_summaries(actual, expected):
+  assert list(actual) == list(expected)
+  for account_id, summary in expected.items():
+    assert actual[account_id].balance == summary.balance
+    assert actual[account_id].overall_averages() == summary.overall_averages()
+    assert actual[account_id].month_counts == summary.month_counts
+    assert list(actual[account_id].monthly_totals()) == list(summary.monthly_totals())
+
+
+@pytest.mark.parametrize('chunk_rows', [1, 97, 100_000])
+def test_summarize_transactions_numpy_matches_python(chunk_rows):
+  lines = generate_lines(2000, 37)
+  assert_same_summaries(summarize_transactions_numpy(lines, chunk_rows=chunk_rows), summarize_transactions(lines))
+
+
+def test_summarize_transactions_numpy_exact_for_unusual_amounts():
+  """Amounts that float64 cannot carry exactly fall back to exact integer parsing."""
+  amounts = ['1e2', '-0.0000001', '+12345678901234.56', ' 7.5 ', '0', '-3']
+  lines = generate_lines(500, 5, amount=lambda rng: rng.choice(amounts))
+  for chunk_rows in (50, 100_000):
+    assert_same_summaries(summarize_transactions_numpy(lines, chunk_rows=chunk_rows), summarize_transactions(lines))
+
+
+def test_iter_summarized_transactions():
+  lines = generate_lines(300, 4)
+  summaries = {}
+  transactions = list(iter_summarized_transactions(summaries, lines, chunk_rows=64))
+  assert transactions == list(iter_transactions(lines))
+  assert_same_summaries(summaries, summarize_transactions(lines))
+
+def test_iter_summarized_transactions_parses_each_row_once():
+  lines = generate_lines(100, 3) + ['100;"7;8";jul-23;+1.5']
+  with patch('src.util.csv.DictReader') as dict_reader:
+    transactions = list(iter_summarized_transactions({}, lines, chunk_rows=64))
+  dict_reader.assert_not_called()
+  assert transactions == list(iter_transactions(lines))
+  assert transactions[-1]['accountId'] == '7;8'
@@ -0,0 +1,111 @@
+import gzip
+import os
+import random
+import boto3
+import pytest
+from moto import mock_aws
+
+from src.dynamodb_manager import DynamoDBManager
+from src.parallel_ingest import plan_byte_ranges, iter_range_lines, summarize_s3_file_parallel
+from src.transaction_index import TransactionIndex
+from src.util import parse_transactions, calculate_balance, calculate_overall_averages, calculate_transactions_by_month
+
+BUCKET = 'stori-challenge-transaction-bucket'
+KEY = 'uploads/stori_challenge_123.csv'
+
+
+@pytest.fixture
+def csv_content():
+  rng = random.Random(7)
+  dates = ['jul-23', 'jul-02', 'ago-15', 'ene-01', 'dic-31']
+  rows = ['Id;AccountId;Date;Transaction']
+  for i in range(400):
+    rows.append(f"{i};{rng.randint(1, 12)};{rng.choice(dates)};{rng.choice('+-')}{rng.randint(1, 99999) / 100}")
+  return '\r\n'.join(rows)
+
+@pytest.fixture
+def s3_client(csv_content):
+  os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+  os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+  os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+  with mock_aws():
+    s3 = boto3.client('s3', region_name='us-east-1')
+    s3.create_bucket(Bucket=BUCKET)
+    s3.put_object(Bucket=BUCKET, Key=KEY, Body=('\ufeff' + csv_content).encode('utf-8'))
+    yield s3
+
+
+def test_plan_byte_ranges():
+  assert plan_byte_ranges(0, 4) == []
+  assert plan_byte_ranges(10, 3) == [(0, 4), (4, 8), (8, 10)]
+  assert plan_byte_ranges(3, 8) == [(0, 1), (1, 2), (2, 3)]
+
+
+def test_iter_range_lines_covers_every_line_once(s3_client, csv_content):
+  """Every line must belong to exactly one range, wherever the boundaries fall."""
+  size = s3_client.head_object(Bucket=BUCKET, Key=KEY)['ContentLength']
+  for parts in (1, 2, 7, 64):
+    lines = []
+    for start, end in plan_byte_ranges(size, parts):
+      lines.extend(iter_range_lines(s3_client, BUCKET, KEY, start, end, chunk_size=16))
+    lines[0] = lines[0].lstrip('\ufeff')
+    assert lines == csv_content.splitlines()
+
+
+def test_summarize_s3_file_parallel_matches_single_pass(s3_client, csv_content):
+  """Summaries merged from several processes equal the single-threaded results."""
+  transactions = parse_transactions(csv_content)
+  expected = {}
+  for transaction in transactions:
+    expected.setdefault(transaction['accountId'], []).append(transaction)
+
+  summaries = summarize_s3_file_parallel(BUCKET, KEY, workers=4, min_range_bytes=1024)
+
+  assert list(summaries) == list(expected)
+  for account_id, account_transactions in expected.items():
+    summary = summaries[account_id]
+    assert summary.balance == calculate_balance(account_transactions)
+    assert summary.transactions_by_month() == calculate_transactions_by_month(account_transactions)
+    assert summary.overall_averages() == calculate_overall_averages(account_transactions)
+
+
+def test_summarize_s3_file_parallel_reads_compressed_files_in_one_pass(s3_client, csv_content):
+  s3_client.put_object(Bucket=BUCKET, Key=KEY + '.gz', Body=gzip.compress(csv_content.encode()))
+
+  summaries = summarize_s3_file_parallel(BUCKET, KEY + '.gz', workers=4, min_range_bytes=1024)
+
+  expected = summarize_s3_file_parallel(BUCKET, KEY, workers=1)
+  assert list(summaries) == list(expected)
+  for account_id, summary in expected.items():
+    assert summaries[account_id].balance == summary.balance
+
+
+def test_summarize_s3_file_parallel_skips_indexed_transactions(s3_client, csv_content):
+  """Rows already in the transaction index are skipped by every worker, as in the single-process ingest."""
+  dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+  for table_name in ('transactions', 'transaction_index'):
+    dynamodb.create_table(TableName=table_name, KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+                          AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
+                          BillingMode='PAY_PER_REQUEST')
+  managers = DynamoDBManager('transaction_index'), DynamoDBManager('transactions')
+  transactions = parse_transactions(csv_content)
+  # an earlier file already brought the first 150 rows
+  index = TransactionIndex(*managers)
+  managers[1].save_transactions(index.iter_new(transactions[:150]))
+  index.commit()
+
+  index = TransactionIndex(*managers)
+  summaries = summarize_s3_file_parallel(BUCKET, KEY, workers=4, min_range_bytes=1024, table_name='transactions',
+                                         index=index)
+
+  expected = {}
+  for transaction in transactions[150:]:
+    expected.setdefault(transaction['accountId'], []).append(transaction)
+  assert sorted(summaries) == sorted(expected)
+  for account_id, account_transactions in expected.items():
+    assert summaries[account_id].balance == calculate_balance(account_transactions)
+  assert (index.stats['new'], index.stats['duplicates']) == (len(transactions) - 150, 150)
+  # the ids the workers found new are committed by the caller
+  index.commit()
+  stored = TransactionIndex(*managers)
+  assert all(transaction['id'] in stored._filter(transaction['accountId']) for transaction in transactions)
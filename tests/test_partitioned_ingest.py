@@ -0,0 +1,50 @@
+import os
+import random
+from src.partitioned_ingest import PartitionSpill, partition_of
+from src.util import iter_transactions, summarize_transactions
+
+
+def csv_lines():
+  rng = random.Random(11)
+  dates = ['jul-23', 'jul-02', 'ago-15', 'ene-01', 'dic-31']
+  lines = ['Id;AccountId;Date;Transaction\n']
+  for i in range(500):
+    lines.append(f"{i};{rng.randint(1, 40)};{rng.choice(dates)};{rng.choice('+-')}{rng.randint(1, 99999) / 100}\n")
+  return lines
+
+def test_partitions_match_in_memory_summaries(tmp_path):
+  lines = csv_lines()
+  expected = summarize_transactions(lines)
+  with PartitionSpill(partitions=8, directory=str(tmp_path)) as spill:
+    assert list(spill.spill(iter_transactions(lines))) == list(iter_transactions(lines))
+    partitions = list(spill.summaries())
+
+  assert 1 < len(partitions) <= 8
+  merged = {}
+  for account_summaries in partitions:
+    assert len({partition_of(account_id, 8) for account_id in account_summaries}) == 1
+    assert not set(merged) & set(account_summaries)
+    merged.update(account_summaries)
+  assert sorted(merged) == sorted(expected)
+  for account_id, summary in expected.items():
+    assert merged[account_id].balance == summary.balance
+    assert merged[account_id].overall_averages() == summary.overall_averages()
+    assert list(merged[account_id].monthly_totals()) == list(summary.monthly_totals())
+  assert os.listdir(tmp_path) == []
+
+def test_close_removes_unread_partitions(tmp_path):
+  spill = PartitionSpill(partitions=4, directory=str(tmp_path))
+  for transaction in iter_transactions(csv_lines()):
+    spill.add(transaction)
+  assert spill.rows == 500
+  spill.close()
+  assert os.listdir(tmp_path) == []
+
+def test_account_ids_with_separators_round_trip(tmp_path):
+  lines = ['Id;AccountId;Date;Transaction\n', '1;"a;b";jul-02;+1.5\n', '2;"say ""hi""";jul-02;-2\n', '3;"x\ny";ago-15;+3\n']
+  with PartitionSpill(partitions=1, directory=str(tmp_path)) as spill:
+    for transaction in iter_transactions(lines):
+      spill.add(transaction)
+    summaries, = spill.summaries()
+  assert sorted(summaries) == ['a;b', 'say "hi"', 'x\ny']
+  assert summaries['a;b'].balance == 1.5
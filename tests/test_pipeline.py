@@ -0,0 +1,64 @@
+import threading
+import pytest
+from src.pipeline import BackgroundStage, StageCancelled
+
+
+def test_background_stage_passes_every_item():
+  stage = BackgroundStage(lambda items: list(items), maxsize=2, chunk_size=3)
+  for i in range(10):
+    stage.put(i)
+  stage.close()
+  assert stage.join() == list(range(10))
+
+def test_background_stage_overlaps_the_caller():
+  first_item_seen = threading.Event()
+  caller_done = threading.Event()
+
+  def consumer(items):
+    seen = []
+    for item in items:
+      seen.append(item)
+      first_item_seen.set()
+    # the caller's own work happens while this stage is still running
+    assert caller_done.wait(5)
+    return seen
+  stage = BackgroundStage(consumer, chunk_size=1)
+  stage.put(0)
+  # the consumer has the first item before the rest is produced
+  assert first_item_seen.wait(5)
+  for i in range(1, 20):
+    stage.put(i)
+  stage.close()
+  assert stage._thread.is_alive()
+  caller_done.set()
+  assert stage.join() == list(range(20))
+
+def test_background_stage_raises_consumer_errors_to_the_producer():
+  def consumer(items):
+    for item in items:
+      if item == 5:
+        raise ValueError('write failed')
+  stage = BackgroundStage(consumer, maxsize=1, chunk_size=1)
+  with pytest.raises(ValueError, match='write failed'):
+    for i in range(1000):
+      stage.put(i)
+    stage.close()
+  with pytest.raises(ValueError):
+    stage.join()
+
+def test_background_stage_cancel_stops_the_consumer():
+  seen = []
+  release = threading.Event()
+
+  def consumer(items):
+    for item in items:
+      release.wait()
+      seen.append(item)
+  stage = BackgroundStage(consumer, maxsize=2, chunk_size=1)
+  for i in range(3):
+    stage.put(i)
+  # the consumer is still blocked on the first item when the rest is dropped
+  threading.Timer(0.1, release.set).start()
+  stage.cancel()
+  assert isinstance(stage.error, StageCancelled)
+  assert seen == [0]
@@ -0,0 +1,43 @@
+from src.template_registry import SUMMARY_TEMPLATE, TemplateRegistry
+from src.util import format_monthly_summaries
+
+
+def email_data(**extra):
+  return {
+    'total_balance': '39.74',
+    'average_credit': '35.25',
+    'average_debit': '-15.38',
+    'transactions_by_month': {'July': 2, 'August': 2},
+    **extra
+  }
+
+
+def test_templates_are_compiled_once():
+  registry = TemplateRegistry()
+  template = registry.get(SUMMARY_TEMPLATE)
+  assert registry.get(SUMMARY_TEMPLATE) is template
+  assert registry.get(SUMMARY_TEMPLATE, 'es') is not template
+
+
+def test_render_summary():
+  html = TemplateRegistry().render(SUMMARY_TEMPLATE, email_data())
+  assert '<p>Total Balance: 39.74</p>' in html
+  # same markup format_monthly_summaries builds
+  for line in format_monthly_summaries({'July': 2, 'August': 2}).split('</p>')[:-1]:
+    assert line + '</p>' in html
+  assert 'Lifetime balance' not in html
+  assert 'Lifetime balance: 100.00' in TemplateRegistry().render(SUMMARY_TEMPLATE, email_data(lifetime_balance='100.00'))
+
+
+def test_locale_variants():
+  registry = TemplateRegistry()
+  assert '<p>Saldo total: 39.74</p>' in registry.render(SUMMARY_TEMPLATE, email_data(), locale='es')
+  # locales without a variant fall back to the default template
+  assert '<p>Total Balance: 39.74</p>' in registry.render(SUMMARY_TEMPLATE, email_data(), locale='fr')
+
+
+def test_bytecode_cache(tmp_path):
+  TemplateRegistry(bytecode_cache_dir=str(tmp_path / 'cache')).get(SUMMARY_TEMPLATE)
+  assert len(list((tmp_path / 'cache').iterdir())) == 1
+  html = TemplateRegistry(bytecode_cache_dir=str(tmp_path / 'cache')).render(SUMMARY_TEMPLATE, email_data())
+  assert '<p>Total Balance: 39.74</p>' in html
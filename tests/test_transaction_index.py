@@ -0,0 +1,104 @@
+import pytest
+import boto3
+from unittest.mock import patch
+from moto import mock_aws
+from src.dynamodb_manager import DynamoDBManager
+from src.transaction_index import BloomFilter, TransactionIndex
+
+
+@pytest.fixture
+def managers():
+  with mock_aws():
+    dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+    for table_name in ('transactions', 'transaction_index'):
+      dynamodb.create_table(
+        TableName=table_name,
+        KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
+        ProvisionedThroughput={'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1}
+      )
+    with patch.dict('os.environ', {'AWS_REGION': 'us-east-1'}):
+      yield DynamoDBManager('transaction_index'), DynamoDBManager('transactions')
+
+def transactions(ids, account_id='1'):
+  return [{'id': str(i), 'accountId': account_id, 'date': '2024-07-23T00:00:00', 'transaction': 1} for i in ids]
+
+def ingest(managers, rows):
+  index = TransactionIndex(*managers)
+  new = list(index.iter_new(rows))
+  managers[1].save_transactions(new)
+  index.commit()
+  return index, [row['id'] for row in new]
+
+
+def test_bloom_filter():
+  bloom = BloomFilter()
+  for i in range(1000):
+    bloom.add(f"id-{i}")
+  assert all(f"id-{i}" in bloom for i in range(1000))
+  false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+  assert false_positives < 100
+
+  other = BloomFilter()
+  other.add('extra')
+  bloom.update(other)
+  assert 'extra' in bloom and 'id-1' in bloom
+
+
+def test_iter_new_skips_stored_transactions(managers):
+  index, new = ingest(managers, transactions(range(10)))
+  assert new == [str(i) for i in range(10)]
+  assert index.stats == {'new': 10, 'duplicates': 0, 'lookups': 0}
+
+  index, new = ingest(managers, transactions(range(5, 15)))
+  assert new == [str(i) for i in range(10, 15)]
+  assert index.stats['duplicates'] == 5
+
+
+def test_false_positives_are_verified(managers):
+  index_manager, transactions_manager = managers
+  # a filter with every bit set reports every id as seen
+  index_manager.save_versioned_item({'id': '1', 'bloom': b'\xff' * 16, 'hashes': 3}, 0)
+  index = TransactionIndex(index_manager, transactions_manager, lookup_batch_size=4)
+  transactions_manager.save_transactions(transactions([2]))
+
+  assert [row['id'] for row in index.iter_new(transactions(range(6)))] == ['0', '1', '3', '4', '5']
+  assert index.stats == {'new': 5, 'duplicates': 1, 'lookups': 2}
+
+
+def test_commit_merges_concurrent_updates(managers):
+  first, second = TransactionIndex(*managers), TransactionIndex(*managers)
+  list(first.iter_new(transactions(['a'])))
+  list(second.iter_new(transactions(['b'])))
+  first.commit()
+  second.commit()
+
+  stored = TransactionIndex(*managers)
+  bloom = stored._filter('1')
+  assert 'a' in bloom and 'b' in bloom
+  assert managers[0].get_item({'id': '1'})['version'] == 2
+
+
+def test_evict_keeps_uncommitted_filters(managers):
+  index = TransactionIndex(*managers)
+  list(index.iter_new(transactions(range(3), '1') + transactions(range(3, 6), '2')))
+  index.evict()
+  assert sorted(index._filters) == ['1', '2']
+  index.commit()
+  index.evict()
+  assert index._filters == {}
+  # reloaded from the index table, the ids are still known
+  assert all(str(i) in index._filter('1') for i in range(3))
+
+
+def test_filters_are_loaded_in_batches(managers):
+  ingest(managers, [row for account in range(250) for row in transactions([f'{account}-0'], str(account))])
+  index_manager, transactions_manager = managers
+  index = TransactionIndex(index_manager, transactions_manager, load_batch_size=500)
+  rows = [row for account in range(250) for row in transactions([f'{account}-1'], str(account))]
+  with patch.object(index_manager, 'get_item', wraps=index_manager.get_item) as get_item, \
+       patch.object(index_manager, 'batch_get_items', wraps=index_manager.batch_get_items) as batch_get_items:
+    assert len(list(index.iter_new(rows))) == 250
+  get_item.assert_not_called()
+  assert batch_get_items.call_count == 1
+  assert all(f'{account}-0' in index._filter(str(account)) for account in range(250))
@@ -1,13 +1,14 @@
 from datetime import datetime
+import gzip
 import locale
+import io
+import tracemalloc
 from moto import mock_aws
 import boto3
 import pytest
 from decimal import Decimal
 
-from src.util import read_s3_file, parse_transactions, calculate_balance, calculate_overall_averages, calculate_transactions_by_month, format_monthly_summaries
-
-locale.setlocale(locale.LC_TIME, 'es_ES')
+from src.util import detect_compression, read_s3_file, stream_s3_file, iter_lines, iter_transactions, parse_transactions, parse_transaction_batches, iter_transaction_batches, TransactionBatch, AccountSummary, accumulate_summaries, summarize_transactions, calculate_balance, calculate_overall_averages, calculate_transactions_by_month, format_monthly_summaries
 
 @pytest.fixture
 def mock_s3_bucket():
@@ -34,12 +35,112 @@ def test_read_s3_file(mock_s3_bucket, mock_csv_content):
   assert file_content == mock_csv_content
   
   
+def test_stream_s3_file(mock_s3_bucket, mock_csv_content):
+  """Test streaming a file from S3 line by line."""
+  bucket_name = mock_s3_bucket
+  file_key = 'uploads/stori_challenge_123.csv'
+  s3 = boto3.client('s3', region_name='us-east-1')
+  s3.put_object(Bucket=bucket_name, Key=file_key, Body=mock_csv_content.encode('utf-8-sig'))
+
+  lines = stream_s3_file(bucket_name, file_key, chunk_size=7)
+  assert list(lines) == mock_csv_content.splitlines()
+
+
+def test_detect_compression():
+  assert detect_compression('uploads/file.csv') is None
+  assert detect_compression('uploads/file.csv.gz') == 'gzip'
+  assert detect_compression('uploads/FILE.CSV.ZST') == 'zstd'
+  assert detect_compression('uploads/file.csv', 'gzip') == 'gzip'
+  assert detect_compression('uploads/file.csv.gz', 'identity') == 'gzip'
+
+
+def test_stream_s3_file_decompresses_gzip(mock_s3_bucket, mock_csv_content):
+  """Test that gzip objects are read by extension or Content-Encoding, including multi-member files."""
+  s3 = boto3.client('s3', region_name='us-east-1')
+  first, second = mock_csv_content.encode().split(b'\n2;')
+  body = gzip.compress(first + b'\n') + gzip.compress(b'2;' + second)
+  s3.put_object(Bucket=mock_s3_bucket, Key='uploads/statement.csv.gz', Body=body)
+  s3.put_object(Bucket=mock_s3_bucket, Key='uploads/statement.csv', Body=body, ContentEncoding='gzip')
+
+  for key in ('uploads/statement.csv.gz', 'uploads/statement.csv'):
+    assert list(stream_s3_file(mock_s3_bucket, key, chunk_size=5)) == mock_csv_content.splitlines()
+  assert read_s3_file(mock_s3_bucket, 'uploads/statement.csv.gz') == mock_csv_content
+
+
+def test_stream_s3_file_decompresses_zstd(mock_s3_bucket, mock_csv_content):
+  zstandard = pytest.importorskip('zstandard')
+  s3 = boto3.client('s3', region_name='us-east-1')
+  s3.put_object(Bucket=mock_s3_bucket, Key='uploads/statement.csv.zst',
+                Body=zstandard.ZstdCompressor().compress(mock_csv_content.encode()))
+
+  assert list(stream_s3_file(mock_s3_bucket, 'uploads/statement.csv.zst', chunk_size=5)) == mock_csv_content.splitlines()
+
+
+class SyntheticCsvBody:
+  """File-like S3 body that produces `size` bytes of CSV without holding them."""
+  def __init__(self, size):
+    row = b"%s;42;jul-23;+10.5\n" % (b"9" * 230)
+    self.block = row * (64 * 1024 // len(row))
+    self.pending = b"Id;AccountId;Date;Transaction\n"
+    self.remaining = size // len(self.block)
+
+  def read(self, size=-1):
+    if not self.pending and self.remaining:
+      self.pending = self.block
+      self.remaining -= 1
+    chunk, self.pending = self.pending, b''
+    return chunk
+
+
+def test_iter_lines_chunk_boundaries():
+  """Test that lines, CRLFs and multi-byte characters split across chunks are rebuilt."""
+  content = '\ufeffId;AccountId\r\n1;ñandú\r\n2;€\n3;x'.encode('utf-8')
+  for chunk_size in range(1, len(content) + 1):
+    lines = list(iter_lines(io.BytesIO(content), chunk_size))
+    assert lines == ['Id;AccountId', '1;ñandú', '2;€', '3;x']
+
+
+def test_iter_lines_memory_is_bounded():
+  """Test that streaming a multi-hundred-MB body keeps peak memory flat."""
+  tracemalloc.start()
+  try:
+    line_count = sum(1 for _ in iter_lines(SyntheticCsvBody(256 * 1024 * 1024)))
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  assert line_count > 1_000_000
+  assert peak < 4 * 1024 * 1024
+
+
+def test_iter_transactions_memory_is_bounded():
+  """Test that parsing a stream row by row does not accumulate rows."""
+  tracemalloc.start()
+  try:
+    transactions = iter_transactions(iter_lines(SyntheticCsvBody(8 * 1024 * 1024)))
+    total = sum(transaction['transaction'] for transaction in transactions)
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  assert total > 0
+  assert peak < 4 * 1024 * 1024
+
+
 def test_parse_transactions():
   """Test parsing transactions from a CSV string."""
   csv_content = 'Id;AccountId;Date;Transaction\n1;1;jul-23;+10.1\n2;1;jul-23;-8.2'
   transactions = parse_transactions(csv_content)
   assert len(transactions) == 2
-  assert transactions[0]['date'].strftime('%b-%d') == 'jul-23'
+  assert (transactions[0]['date'].month, transactions[0]['date'].day) == (7, 23)
+
+
+def test_parse_spanish_month_abbreviations():
+  """Dates use the Spanish month abbreviations whatever the process locale is."""
+  csv_content = 'Id;AccountId;Date;Transaction\n1;1;ene-01;+1\n2;1;AGO-15;+1\n3;1;Dic-31;+1\n4;1;sept-9;+1\n5;1;xxx-01;+1\n6;1;feb-30;+1\n7;1;jul 23;+1'
+  locale_before = locale.setlocale(locale.LC_TIME)
+  transactions = parse_transactions(csv_content)
+  assert [(t['date'].month, t['date'].day) for t in transactions] == [(1, 1), (8, 15), (12, 31), (9, 9)]
+  assert calculate_transactions_by_month(transactions) == {'enero': 1, 'agosto': 1, 'diciembre': 1, 'septiembre': 1}
+  assert locale.setlocale(locale.LC_TIME) == locale_before
   
 def test_calculate_balance():
   """Test calculating the balance from a list of transactions."""
@@ -75,4 +176,113 @@ def test_format_monthly_summaries():
   transactions_by_month = {'Jul': 2}
   html = format_monthly_summaries(transactions_by_month)
   assert html == '<p>Number of transactions in Jul: 2<br></p>'
-  
\ No newline at end of file
+  
+
+def test_transaction_batch_matches_list_results():
+  """Test that the util calculations give the same results for a batch and a list."""
+  transactions = [
+    {'id': '1', 'accountId': '1', 'date': datetime(1900, 7, 23), 'transaction': Decimal('10.1')},
+    {'id': '2', 'accountId': '1', 'date': datetime(1900, 7, 23), 'transaction': Decimal('-8.2')},
+    {'id': '3', 'accountId': '1', 'date': datetime(1900, 8, 1), 'transaction': Decimal('+0.33')},
+    {'id': '4', 'accountId': '1', 'date': datetime(1900, 8, 2), 'transaction': Decimal('-0.1')}
+  ]
+  batch = TransactionBatch.from_transactions(transactions, year=1900)
+  assert len(batch) == 4
+  assert calculate_balance(batch) == calculate_balance(transactions)
+  assert calculate_overall_averages(batch) == calculate_overall_averages(transactions)
+  assert calculate_transactions_by_month(batch) == calculate_transactions_by_month(transactions)
+  assert list(batch) == transactions
+
+
+def test_transaction_batch_rescales_sub_cent_amounts():
+  """Test that amounts finer than cents rescale the batch instead of losing precision."""
+  batch = TransactionBatch(year=1900)
+  batch.append('1', '1', 7 * 32 + 23, 1010, 2)
+  batch.append('2', '1', 7 * 32 + 23, -3333, 3)
+  assert batch.scale == 3
+  assert calculate_balance(batch) == Decimal('6.767')
+  assert calculate_overall_averages(batch) == {'average_credit': Decimal('10.1'), 'average_debit': Decimal('-3.333')}
+
+
+def test_parse_transaction_batches():
+  """Test parsing CSV lines into one batch per account."""
+  csv_content = 'Id;AccountId;Date;Transaction\n1;1;jul-23;+10.1\n2;2;jul-23;-8.2\n3;1;jul-02;5e1\n4;1;xxx-01;+1'
+  batches = parse_transaction_batches(csv_content.splitlines())
+  assert list(batches) == ['1', '2']
+  assert len(batches['1']) == 2
+  assert calculate_balance(batches['1']) == Decimal('60.1')
+  assert [transaction['id'] for transaction in batches['1']] == ['1', '3']
+  assert list(batches['2']) == parse_transactions(csv_content)[1:2]
+
+
+def test_transaction_batch_keeps_amounts_beyond_int64():
+  """Test that amounts too large for the int64 column are kept exactly."""
+  batch = TransactionBatch(year=1900)
+  batch.append('1', '1', 7 * 32 + 23, 1010, 2)
+  batch.append('2', '1', 7 * 32 + 23, 5 * 10 ** 30, 0)
+  batch.append('3', '1', 7 * 32 + 23, -1, 3)
+  assert calculate_balance(batch) == Decimal('5e30') + Decimal('10.099')
+  assert [transaction['id'] for transaction in batch] == ['1', '2', '3']
+
+
+def test_iter_transaction_batches():
+  """Test that packing rows into batches gives the same rows back."""
+  csv_content = 'Id;AccountId;Date;Transaction\n1;1;jul-23;+10.1\n2;2;jul-23;-8.2\n3;1;ago-02;5e1\n4;3;jul-01;-0.005\n5;1;jul-03;+1'
+  transactions = parse_transactions(csv_content)
+  batches = list(iter_transaction_batches(iter(transactions), rows=2))
+  assert [len(batch) for batch in batches] == [2, 2, 1]
+  assert [transaction for batch in batches for transaction in batch] == transactions
+
+
+def test_transaction_batch_is_compact():
+  """Test that a batch takes an order of magnitude less memory than a list of dicts."""
+  lines = ['Id;AccountId;Date;Transaction'] + [f'{100000 + i};{i % 50};jul-23;-{i}.{i % 100:02d}' for i in range(20000)]
+
+  tracemalloc.start()
+  try:
+    transactions = parse_transactions('\n'.join(lines))
+    dicts_size, _ = tracemalloc.get_traced_memory()
+    del transactions
+    baseline, _ = tracemalloc.get_traced_memory()
+    batches = parse_transaction_batches(lines)
+    batches_size = tracemalloc.get_traced_memory()[0] - baseline
+  finally:
+    tracemalloc.stop()
+  assert sum(len(batch) for batch in batches.values()) == 20000
+  assert batches_size * 10 < dicts_size
+
+
+def test_summarize_transactions():
+  """Test summarizing CSV lines per account in a single pass."""
+  csv_content = 'Id;AccountId;Date;Transaction\n1;1;ago-23;+10.1\n2;2;jul-23;-8.2\n3;1;jul-02;-0.005\n4;1;jul-03;+1'
+  transactions = parse_transactions(csv_content)
+  summaries = summarize_transactions(csv_content.splitlines())
+  assert list(summaries) == ['1', '2']
+  for account_id, summary in summaries.items():
+    account_transactions = [transaction for transaction in transactions if transaction['accountId'] == account_id]
+    assert summary.balance == calculate_balance(account_transactions)
+    assert summary.overall_averages() == calculate_overall_averages(account_transactions)
+    assert summary.transactions_by_month() == calculate_transactions_by_month(account_transactions)
+
+
+def test_account_summary_merge():
+  """Test that merging summaries of two halves equals summarizing the whole."""
+  transactions = [
+    {'id': '1', 'accountId': '1', 'date': datetime(1900, 7, 23), 'transaction': Decimal('10.1')},
+    {'id': '2', 'accountId': '1', 'date': datetime(1900, 8, 23), 'transaction': Decimal('-8.255')},
+    {'id': '3', 'accountId': '1', 'date': datetime(1900, 7, 1), 'transaction': Decimal('0')}
+  ]
+  whole, first, second = {}, {}, {}
+  assert list(accumulate_summaries(whole, transactions)) == transactions
+  list(accumulate_summaries(first, transactions[:1]))
+  list(accumulate_summaries(second, transactions[1:]))
+
+  merged = first['1'].merge(second['1'])
+  assert merged.balance == whole['1'].balance == Decimal('1.845')
+  assert merged.overall_averages() == whole['1'].overall_averages()
+  assert merged.month_counts == whole['1'].month_counts
+  assert merged.month_counts[7] == 2
+  assert list(merged.monthly_totals()) == list(whole['1'].monthly_totals()) == [
+    (7, 2, Decimal('10.1'), Decimal('0')),
+    (8, 1, Decimal('0'), Decimal('-8.255')),
+  ]